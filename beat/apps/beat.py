@@ -426,7 +426,9 @@ def command_import(args):
                                 inputf.load_SAR_data(gc.datadir, gc.names))
                         elif 'kite' in options.geodetic_format:
                             gtargets.extend(
-                                inputf.load_kite_scenes(gc.datadir, gc.names))
+                                inputf.load_kite_scenes(
+                                    gc.datadir, gc.names,
+                                    covariance_taper=gc.covariance_taper))
                         else:
                             raise ImportError(
                                 'Format %s not implemented yet for SAR data.' %
@@ -988,6 +990,13 @@ def command_build_gfs(args):
             help='Start actual GF calculations. If not set only'
                  ' configuration files are being created')
 
+        parser.add_option(
+            '--prefilter', dest='prefilter', action='store_true',
+            help='Build derived seismic GF stores from the existing stores,'
+                 ' with the filterer of the waveforms and the instrument'
+                 ' responses applied. To be used with "prefiltered_gfs" in'
+                 ' the waveform configs.')
+
     parser, options, args = cl_parse(command_str, args, setup=setup)
 
     project_dir = get_project_directory(
@@ -995,12 +1004,32 @@ def command_build_gfs(args):
 
     c = bconfig.load_config(project_dir, options.mode)
 
+    if options.prefilter:
+        if 'seismic' not in options.datatypes:
+            raise ValueError(
+                'Prefiltering is only supported for seismic GFs!')
+
+        logger.info('Building prefiltered seismic GF stores ...')
+        heart.seis_construct_prefiltered_gf(
+            seismic_config=c.seismic_config,
+            seismic_data_path=pjoin(c.project_dir, bconfig.seismic_data_name),
+            event=c.event,
+            force=options.force)
+        logger.info('Prefiltered GF stores successfully created!')
+        return
+
     if options.mode in [geometry_mode_str, 'interseismic']:
         for datatype in options.datatypes:
             if datatype == 'geodetic':
                 gc = c.geodetic_config
                 gf = c.geodetic_config.gf_config
 
+                if gf.code == 'okada':
+                    logger.info(
+                        'Geodetic synthetics are calculated analytically'
+                        ' (code: okada), no GFs needed!')
+                    continue
+
                 for crust_ind in range(*gf.n_variations):
                     heart.geo_construct_gf(
                         event=c.event,
@@ -1633,7 +1662,7 @@ def command_export(args):
                     for wmap in composite.wavemaps:
                         pcovs = {
                             list2string(dataset.nslc_id):
-                                dataset.covariance.pred_v
+                                dataset.covariance.pred_v_dense
                             for dataset in wmap.datasets}
 
                         outname = pjoin(
@@ -22,6 +22,7 @@ import itertools
 import json
 import logging
 import os
+import pickle
 import shutil
 from glob import glob
 from time import time
@@ -45,7 +46,8 @@ from pymc3.model import modelcontext
 from pymc3.step_methods.arraystep import BlockedStep
 from pyrocko import util
 
-from beat.config import sample_p_outname, transd_vars_dist
+from beat.config import sample_p_outname, stage_draws_outname, \
+    transd_vars_dist
 from beat.covariance import calc_sample_covariance
 from beat.utility import load_objects, dump_objects, \
     ListArrayOrdering, ListToArrayBijection
@@ -53,6 +55,9 @@ from beat.utility import load_objects, dump_objects, \
 logger = logging.getLogger('backend')
 
 
+checkpoint_suffix = 'checkpoint'
+
+
 def thin_buffer(buffer, buffer_thinning, ensure_last=True):
     """
     Reduce a list of objects by a given value.
@@ -261,9 +266,11 @@ class FileChain(BaseChain):
         self.progressbar = progressbar
 
         self.stored_samples = 0
+        self.stored_rows = 0
         self.draws = 0
         self._df = None
         self.filename = None
+        self.checkpoint = None
 
     def __len__(self):
         if self.filename is None:
@@ -305,12 +312,72 @@ class FileChain(BaseChain):
             logger.debug(
                 'Start Record: Chain_%i' % self.chain)
             self._write_data_to_file()
+            self.stored_rows += len(thin_buffer(
+                self.buffer, self.buffer_thinning, ensure_last=True))
+            self._write_checkpoint()
 
             t1 = time()
             logger.debug('End Record: Chain_%i' % self.chain)
             logger.debug('Writing to file took %f' % (t1 - t0))
             self.empty_buffer()
 
+    def checkpoint_filename(self, chain):
+        return os.path.join(
+            self.dir_path, 'chain-{}.{}'.format(chain, checkpoint_suffix))
+
+    def _write_checkpoint(self):
+        """
+        Write the sampler state of the chain at the last sample in the
+        buffer to file, to be able to resume sampling from that sample.
+        """
+        if self.checkpoint is None:
+            return
+
+        if len(self.buffer) > 0:
+            if self.buffer[-1][1] != \
+                    self.checkpoint['chain_state']['cumulative_samples']:
+                logger.debug(
+                    'Checkpoint of chain %i not consistent with buffer, not'
+                    ' writing!' % self.chain)
+                return
+
+        checkpoint = copy.copy(self.checkpoint)
+        checkpoint['n_stored'] = self.stored_rows
+        checkpoint['rng_state'] = num.random.get_state()
+
+        filename = self.checkpoint_filename(self.chain)
+        tmp_filename = filename + '.tmp'
+        dump_objects(tmp_filename, checkpoint)
+        os.rename(tmp_filename, filename)
+
+    def _remove_checkpoint(self):
+        filename = self.checkpoint_filename(self.chain)
+        if os.path.exists(filename):
+            os.remove(filename)
+
+    def load_checkpoint(self, chain):
+        """
+        Load sampler state of the chain at the last sample written to file.
+
+        Parameters
+        ----------
+        chain : int
+            Chain number
+
+        Returns
+        -------
+        dict of chain checkpoint or None if not existing
+        """
+        filename = self.checkpoint_filename(chain)
+        if not os.path.exists(filename):
+            return None
+
+        try:
+            return load_objects(filename)
+        except (EOFError, pickle.UnpicklingError):
+            logger.warning('Checkpoint %s is corrupted!' % filename)
+            return None
+
     def write(self, lpoint, draw):
         """
         Write sampling results into buffer.
@@ -417,6 +484,8 @@ class TextChain(FileChain):
             logger.debug('Found existing trace, appending!')
         else:
             self.count = 0
+            self.stored_rows = 0
+            self._remove_checkpoint()
 
             # writing header
             with open(self.filename, 'w') as fh:
@@ -621,6 +690,8 @@ class NumpyChain(FileChain):
             logger.debug('Found existing trace, appending!')
         else:
             self.count = 0
+            self.stored_rows = 0
+            self._remove_checkpoint()
             data_type = OrderedDict()
             with open(self.filename, 'wb') as fh:
                 for k, v in self.var_dtypes.items():
@@ -852,6 +923,10 @@ class SampleStage(object):
     def trans_stage_path(self, stage):
         return os.path.join(self.base_dir, 'trans_stage_{}'.format(stage))
 
+    def resolution_stage_path(self, stage):
+        return os.path.join(
+            self.base_dir, 'resolution_stage_{}'.format(stage))
+
     def stage_number(self, stage_path):
         """
         Inverse function of SampleStage.path
@@ -977,7 +1052,9 @@ class SampleStage(object):
 
         if stage > 0:
             prev = stage - 1
-            if update is not None:
+            if os.path.exists(self.resolution_stage_path(prev)):
+                prev_stage_path = self.resolution_stage_path(prev)
+            elif update is not None:
                 prev_stage_path = self.trans_stage_path(prev)
             else:
                 prev_stage_path = self.stage_path(prev)
@@ -999,7 +1076,8 @@ class SampleStage(object):
                 # continue sampling if traces exist
                 logger.info('Checking for corrupted files ...')
                 return check_multitrace(
-                    mtrace, draws=draws, n_chains=step.n_chains,
+                    mtrace, draws=load_stage_draws(stage_path, draws),
+                    n_chains=step.n_chains,
                     buffer_thinning=buffer_thinning)
 
         logger.info('Init new trace!')
@@ -1070,6 +1148,45 @@ def load_multitrace(dirname, varnames=[], chains=None, backend='csv'):
         raise NotImplementedError('Loading trans-d trace is not implemented!')
 
 
+def dump_stage_draws(dirname, draws):
+    """
+    Record the number of draws of a stage, if it differs from the number
+    of draws the traces have been set up with, e.g. if sampling of the
+    stage has been stopped early.
+
+    Parameters
+    ----------
+    dirname : str
+        directory of the stage traces
+    draws : int
+        number of draws that have been sampled in each chain
+    """
+    dump_objects(os.path.join(dirname, stage_draws_outname), [draws])
+
+
+def load_stage_draws(dirname, draws):
+    """
+    Load the recorded number of draws of a stage, see
+    :func:`dump_stage_draws`.
+
+    Parameters
+    ----------
+    dirname : str
+        directory of the stage traces
+    draws : int
+        number of draws returned, if none have been recorded
+
+    Returns
+    -------
+    int, number of draws
+    """
+    draws_path = os.path.join(dirname, stage_draws_outname)
+    if os.path.exists(draws_path):
+        return load_objects(draws_path)[0]
+    else:
+        return draws
+
+
 def check_multitrace(mtrace, draws, n_chains, buffer_thinning=1):
     """
     Check multitrace for incomplete sampling and return indexes from chains
@@ -196,6 +196,8 @@ fault_geometry_name = 'fault_geometry.pkl'
 geodetic_linear_gf_name = 'linear_geodetic_gfs.pkl'
 
 sample_p_outname = 'sample.params'
+stage_draws_outname = 'stage.draws'
+worker_state_outname = 'worker.state'
 
 summary_name = 'summary.txt'
 
@@ -209,6 +211,7 @@ _regularization_choices = ['laplacian', 'none']
 _initialization_choices = ['random', 'lsq']
 _backend_choices = ['csv', 'bin']
 _datatype_choices = ['geodetic', 'seismic']
+_domain_choices = ['time', 'spectrum']
 
 
 class InconsistentParameterNaming(Exception):
@@ -342,8 +345,13 @@ class GeodeticGFConfig(NonlinearGFConfig):
     """
     code = String.T(
         default='psgrn',
-        help='Modeling code to use. (psgrn, ... others need to be'
-             'implemented!)')
+        help='Modeling code to use. (psgrn, okada - analytical solution for'
+             ' rectangular sources in a homogeneous elastic halfspace, no GF'
+             ' stores needed)')
+    poisson_ratio = Float.T(
+        default=0.25,
+        help='Poisson ratio of the homogeneous halfspace. Only used for'
+             ' code "okada".')
     sample_rate = Float.T(
         default=1. / (3600. * 24.),
         help='Sample rate for the Greens Functions. Mainly relevant for'
@@ -452,6 +460,21 @@ class WaveformFitConfig(Object):
     arrival_taper = trace.Taper.T(
         default=ArrivalTaper.D(),
         help='Taper a,b/c,d time [s] before/after wave arrival')
+    prefiltered_gfs = Bool.T(
+        default=False,
+        help='If set, synthetics are calculated from derived GF stores that'
+             ' have the filterer and the instrument responses applied'
+             ' already, created with "beat build_gfs --prefilter". Filtering'
+             ' of the synthetics is skipped.')
+    domain = StringChoice.T(
+        choices=_domain_choices,
+        default='time',
+        help='Domain of the misfit calculation. "spectrum" compares only the'
+             ' spectral coefficients of the data windows within the band of'
+             ' the filterer, weighted by their variance under the data'
+             ' covariance (exact for stationary noise). Hyperparameter'
+             ' estimation remains in the time domain. Choices: %s' %
+             utility.list2string(_domain_choices))
 
 
 class SeismicNoiseAnalyserConfig(Object):
@@ -465,6 +488,12 @@ class SeismicNoiseAnalyserConfig(Object):
         default=5.,
         help='Time [s] before synthetic P-wave arrival until '
              'variance is estimated')
+    structured = Bool.T(
+        default=False,
+        help='If set, only the autocovariances of the noise are kept and '
+             'the misfit is calculated without dense weight matrices. '
+             'Not possible for imported data-covariances, velocity model '
+             'covariances and resolution schedules.')
 
 
 class SeismicConfig(Object):
@@ -486,7 +515,9 @@ class SeismicConfig(Object):
              ' taper')
     station_corrections = Bool.T(
         default=False,
-        help='If set, optimize for time shift for each station.')
+        help='If set, optimize for time shift for each station.'
+             ' Without "pre_stack_cut" the synthetics are only windowed'
+             ' again if just the time shifts changed.')
     waveforms = List.T(WaveformFitConfig.T(default=WaveformFitConfig.D()))
     dataset_specific_residual_noise_estimation = Bool.T(
         default=False,
@@ -494,6 +525,10 @@ class SeismicConfig(Object):
              'n_hypers = nstations * nchannels.'
              'If false one hyperparameter for each DATATYPE and '
              'displacement COMPONENT.')
+    nthreads = Int.T(
+        default=1,
+        help='Number of threads to use for the synthetics calculation of'
+             ' a single model, passed to the engine.')
     gf_config = GFConfig.T(default=SeismicGFConfig.D())
 
     def __init__(self, **kwargs):
@@ -553,6 +588,22 @@ class SeismicConfig(Object):
             self.waveforms.append(WaveformFitConfig(name=wavename))
 
 
+class GeodeticCovarianceTaperConfig(Object):
+    """
+    Config for tapered, sparse data-covariances of large geodetic datasets.
+    """
+
+    taper_distance = Float.T(
+        default=30000.,
+        help='Distance [m] beyond which the data-covariances are tapered to'
+             ' zero.')
+    max_neighbours = Int.T(
+        default=30,
+        help='Maximum number of neighbouring data points each data point is'
+             ' conditioned on in the sparse weight matrix. The larger the'
+             ' more accurate, but the more memory and time is needed.')
+
+
 class GeodeticConfig(Object):
     """
     Config for geodetic data optimization related parameters.
@@ -572,6 +623,13 @@ class GeodeticConfig(Object):
         default=True,
         help='Flag for calculating the data covariance matrix, '
              'outsourced to "kite"')
+    covariance_taper = GeodeticCovarianceTaperConfig.T(
+        optional=True,
+        help='If given, the data-covariances of SAR data in kite format are'
+             ' imported as the tapered exponential covariance model fitted'
+             ' by kite and the misfit is calculated with sparse weight'
+             ' matrices. Needed for large datasets. Not possible with'
+             ' velocity model covariances and resolution schedules.')
     interpolation = StringChoice.T(
         choices=_interpolation_choices,
         default='multilinear',
@@ -588,6 +646,10 @@ class GeodeticConfig(Object):
              'nstations * ncomponents (GNSS).'
              'If false one hyperparameter for each DATATYPE and '
              'displacement COMPONENT.')
+    nthreads = Int.T(
+        default=1,
+        help='Number of threads to use for the synthetics calculation of'
+             ' a single model, passed to the engine.')
     gf_config = GFConfig.T(default=GeodeticGFConfig.D())
 
     def __init__(self, **kwargs):
@@ -935,6 +997,13 @@ class SamplerParameters(Object):
         default=True,
         help='Flag for checking whether proposed step lies within'
              ' variable bounds.')
+    surrogate_datatypes = List.T(
+        String.T(),
+        default=[],
+        help='Datatypes (e.g. "geodetic") whose likelihood is used as cheap'
+             ' surrogate to prescreen proposals (delayed acceptance). The'
+             ' full likelihood is only evaluated for proposals that pass.'
+             ' The posterior remains exact. Default: [] (disabled)')
 
     rm_flag = Bool.T(default=False,
                      help='Remove existing results prior to sampling.')
@@ -986,6 +1055,14 @@ class ParallelTemperingConfig(SamplerParameters):
              ' specified backend trace objects (during sampler initialization).'
              ' Very useful for debugging purposes. MUST be False for runs on'
              ' distributed computing systems!')
+    communicator = StringChoice.T(
+        choices=['mpi', 'local'],
+        default='mpi',
+        help='Communication between the PT master and the workers. "mpi":'
+             ' processes are started with mpiexec and may be distributed'
+             ' over several machines. "local": processes are forked on the'
+             ' local machine and exchange chain states through shared'
+             ' memory, which does not require MPI.')
 
 
 class MetropolisConfig(SamplerParameters):
@@ -1009,6 +1086,26 @@ class MetropolisConfig(SamplerParameters):
              ' samples from the beginning of the chain.')
 
 
+class HMCConfig(MetropolisConfig):
+    """
+    Config for optimization parameters of the Hamiltonian Monte Carlo
+    algorithm within a Gibbs scheme, for the "ffi" mode.
+    """
+    n_leapfrog = Int.T(
+        default=20,
+        help='Maximum number of leapfrog steps of a Hamiltonian trajectory.'
+             ' The number of steps is drawn uniformly between 1 and'
+             ' n_leapfrog.')
+    step_size = Float.T(
+        default=0.1,
+        help='Initial leapfrog step size relative to the prior standard'
+             ' deviations. It is tuned during sampling.')
+    target_accept = Float.T(
+        default=0.8,
+        help='Acceptance rate of the Hamiltonian trajectories the step size'
+             ' is tuned towards.')
+
+
 class SMCConfig(SamplerParameters):
     """
     Config for optimization parameters of the SMC algorithm.
@@ -1029,15 +1126,76 @@ class SMCConfig(SamplerParameters):
     stage = Int.T(default=0,
                   help='Stage where to start/continue the sampling. Has to'
                        ' be int -1 for final stage')
-    proposal_dist = String.T(
+    proposal_dist = StringChoice.T(
         default='MultivariateNormal',
-        help='Multivariate Normal Proposal distribution, for Metropolis steps'
-             'alternatives need to be implemented')
+        choices=[
+            'MultivariateNormal', 'MultivariateCauchy',
+            'DifferentialEvolution'],
+        help='Proposal distribution for Metropolis steps. '
+             '"MultivariateNormal": scaled by the weighted covariance of the'
+             ' stage population. "DifferentialEvolution": differences of'
+             ' pairs of the unique stage end points and snooker updates,'
+             ' suited for strongly correlated or curved posteriors.')
 
     update_covariances = Bool.T(
         default=False,
         help='Update model prediction covariance matrixes in transition '
              'stages.')
+    adaptive_n_steps = Bool.T(
+        default=False,
+        help='Adapt the number of steps of each stage to the acceptance rate'
+             ' and autocorrelation of the chain likelihoods. n_steps is then'
+             ' the number of steps of the first stage. With population_batch'
+             ' a stage is stopped once the chains are decorrelated, otherwise'
+             ' the number of steps of the next stage is estimated from the'
+             ' current stage.')
+    min_n_steps = Int.T(
+        default=10,
+        help='Minimum number of steps per stage if adaptive_n_steps.')
+    max_n_steps = Int.T(
+        default=1000,
+        help='Maximum number of steps per stage if adaptive_n_steps.')
+    decorrelation_factor = Float.T(
+        default=5.,
+        help='Number of likelihood autocorrelation times each chain is'
+             ' sampled per stage, if adaptive_n_steps.')
+    population_batch = Bool.T(
+        default=False,
+        help='Sample all chains synchronously in one process and calculate'
+             ' the synthetics for the proposals of all chains in one batch.'
+             ' Reduces the per-call overhead for cheap forward models and'
+             ' large numbers of chains. n_jobs is ignored for stage sampling.'
+             ' Not supported with the seismic "pre_stack_cut".')
+    emulator = StringChoice.T(
+        choices=['none', 'prescreen', 'approximate'],
+        default='none',
+        help='Gaussian process emulator of the dataset likelihoods, trained'
+             ' on the samples of the previous stages. "prescreen": proposals'
+             ' are prescreened with the emulated likelihood, the posterior'
+             ' remains exact. "approximate": after emulator_exact_stages the'
+             ' forward model is replaced by the emulator for fast,'
+             ' approximate exploratory runs.')
+    emulator_max_samples = Int.T(
+        default=1000,
+        help='Maximum number of training samples of the emulator.')
+    emulator_exact_stages = Int.T(
+        default=2,
+        help='Number of stages sampled with the forward model before it is'
+             ' replaced by the emulator, if emulator is "approximate".')
+    resolution_factors = List.T(
+        Int.T(),
+        default=[],
+        help='Decimation factors of the datasets of coarse resolution levels'
+             ' for the early stages, from coarse to fine, e.g. [8, 2].'
+             ' Waveforms are averaged over blocks of samples and geodetic'
+             ' data points within grid cells. Empty for full resolution.')
+    resolution_betas = List.T(
+        Float.T(),
+        default=[],
+        help='Tempering parameters beta until which the resolution levels of'
+             ' "resolution_factors" are used, increasing, e.g. [0.001, 0.1].'
+             ' At each switch the stage end points are importance reweighted'
+             ' to the finer resolution.')
 
 
 class SamplerConfig(Object):
@@ -1048,7 +1206,7 @@ class SamplerConfig(Object):
     name = String.T(
         default='SMC',
         help='Sampler to use for sampling the solution space.'
-             ' Metropolis/ SMC')
+             ' Metropolis/ SMC/ PT/ HMC')
     backend = StringChoice.T(
         default='csv',
         choices=_backend_choices,
@@ -1089,6 +1247,9 @@ class SamplerConfig(Object):
             elif self.name == 'PT':
                 self.parameters = ParallelTemperingConfig(**kwargs)
 
+            elif self.name == 'HMC':
+                self.parameters = HMCConfig(**kwargs)
+
             else:
                 raise TypeError('Sampler "%s" is not implemented.' % self.name)
 
@@ -1193,6 +1354,20 @@ class BEATconfig(Object, Cloneable):
         if n_hypers == 0:
             self.hyper_sampler_config = None
 
+    def validate_sampler(self):
+        """
+        Check if the sampler options are supported by the problem setup!
+        """
+        sc = self.sampler_config
+        if sc.name == 'SMC' and sc.parameters.population_batch and \
+                self.seismic_config is not None and \
+                self.seismic_config.pre_stack_cut:
+            raise ValueError(
+                'SMC "population_batch" is not supported with seismic'
+                ' "pre_stack_cut", the GF traces are cut for the arrival'
+                ' times of each individual point! Please disable one of'
+                ' both.')
+
     def update_hierarchicals(self):
         """
         Evaluate the whole config and initialise necessary
@@ -1500,4 +1675,5 @@ def load_config(project_dir, mode):
         raise ConfigNeedsUpdatingError()
 
     config.problem_config.validate_all()
+    config.validate_sampler()
     return config
@@ -20,6 +20,8 @@ logger = logging.getLogger('covariance')
 __all__ = [
     'geodetic_cov_velocity_models',
     'geodetic_cov_velocity_models_pscmp',
+    'sample_covariance_factor',
+    'scaled_autocovariance',
     'seismic_cov_velocity_models',
     'SeismicNoiseAnalyser']
 
@@ -158,10 +160,15 @@ class SeismicNoiseAnalyser(object):
         reference event from catalog
     chop_bounds : list of len 2
         of taper attributes a, b, c, or d
+    structured : boolean
+        if True, the data covariances are returned as
+        :class:`heart.ToeplitzCovariance`, not possible for imported
+        covariances
     """
     def __init__(
             self, structure='identity', pre_arrival_time=5.,
-            engine=None, event=None, sources=None, chop_bounds=['b', 'c']):
+            engine=None, event=None, sources=None, chop_bounds=['b', 'c'],
+            structured=False):
 
         avail = available_noise_structures()
         if structure not in avail:
@@ -169,12 +176,17 @@ class SeismicNoiseAnalyser(object):
                 'Selected noise structure "%s" not supported! Implemented'
                 ' noise structures: %s' % (structure, list2string(avail)))
 
+        if structured and structure == 'import':
+            raise ValueError(
+                'Imported data covariances can not be structured!')
+
         self.event = event
         self.engine = engine
         self.sources = sources
         self.pre_arrival_time = pre_arrival_time
         self.structure = structure
         self.chop_bounds = chop_bounds
+        self.structured = structured
 
     def get_structure(self, wmap, sample_rate):
 
@@ -202,14 +214,40 @@ class SeismicNoiseAnalyser(object):
                 'Results need(s) to be given for non-toeplitz'
                 ' covariance estimates!')
         else:
-            scalings = []
-            for result in results:
-                residual = result.filtered_res.get_ydata()
-                scaling = non_toeplitz_covariance(
-                    residual, window_size=residual.size // 5)
-                scalings.append(scaling)
+            return [
+                toeplitz(coeffs) * stds[:, num.newaxis] * stds[num.newaxis, :]
+                for coeffs, stds in self.get_residual_autocovariances(
+                    results)]
+
+    def get_residual_autocovariances(self, results):
+        """
+        Scaled autocovariances of the filtered residuals of results.
+        Residuals of equal size are estimated at once.
+
+        Parameters
+        ----------
+        results : list
+            of :class:`heart.SeismicResult`
+
+        Returns
+        -------
+        list of tuples (coeffs, stds)
+            see :func:`scaled_autocovariance`
+        """
+        residuals = [result.filtered_res.get_ydata() for result in results]
+
+        sizes = set(residual.size for residual in residuals)
+        if len(sizes) == 1:
+            residuals = [num.vstack(residuals)]
+
+        autocovs = []
+        for residual in residuals:
+            coeffs, stds = scaled_autocovariance(
+                residual, window_size=residual.shape[-1] // 5)
+            autocovs.extend(zip(
+                num.atleast_2d(coeffs), num.atleast_2d(stds)))
 
-            return scalings
+        return autocovs
 
     def do_variance_estimate(self, wmap):
 
@@ -261,8 +299,13 @@ class SeismicNoiseAnalyser(object):
 
         Returns
         -------
-        :class:`numpy.ndarray`
+        :class:`numpy.ndarray` or, if structured,
+        :class:`heart.ToeplitzCovariance`
         """
+        if self.structured:
+            return self.get_structured_data_covariances(
+                wmap, sample_rate, results)
+
         covariance_structure = self.get_structure(wmap, sample_rate)
 
         if self.structure == 'import':
@@ -278,6 +321,40 @@ class SeismicNoiseAnalyser(object):
 
         return cov_ds
 
+    def get_structured_data_covariances(
+            self, wmap, sample_rate, results=None):
+        """
+        Estimated data covariances of seismic traces, only the
+        autocovariances (and scaling standard deviations) of the noise
+        are kept.
+
+        Parameters
+        ----------
+        wmap : :class:`eat.WaveformMapping`
+        results
+        sample_rate : float
+            sampling rate of data_traces and GreensFunction stores
+
+        Returns
+        -------
+        list of :class:`heart.ToeplitzCovariance`
+        """
+        if self.structure == 'non-toeplitz':
+            if results is None:
+                raise ValueError(
+                    'Results need(s) to be given for non-toeplitz'
+                    ' covariance estimates!')
+
+            return [
+                heart.ToeplitzCovariance(autocovariance=coeffs, stds=stds)
+                for coeffs, stds in self.get_residual_autocovariances(
+                    results)]
+
+        coeffs = self.get_structure(wmap, sample_rate)[0]
+        return [
+            heart.ToeplitzCovariance(autocovariance=scaling * coeffs)
+            for scaling in self.do_variance_estimate(wmap)]
+
 
 def model_prediction_sensitivity(engine, *args, **kwargs):
     '''
@@ -401,9 +478,34 @@ def model_prediction_sensitivity(engine, *args, **kwargs):
     return sensitivity_param_trcs
 
 
+def sample_covariance_factor(realizations):
+    """
+    Low-rank factor of the sample covariance matrix of realizations.
+
+    Parameters
+    ----------
+    realizations : :class:`numpy.ndarray`
+        of size (n_realizations, samples)
+
+    Returns
+    -------
+    :class:`numpy.ndarray` U of size (samples, n_realizations), such that
+    U * U^T is the sample covariance matrix, i.e. num.cov(realizations,
+    rowvar=0)
+    """
+    n_realizations = realizations.shape[0]
+    if n_realizations < 2:
+        raise ValueError(
+            'Need at least two realizations for a sample covariance!')
+
+    deviations = realizations - realizations.mean(axis=0)
+    return (deviations.T / num.sqrt(n_realizations - 1.)).astype(
+        tconfig.floatX)
+
+
 def seismic_cov_velocity_models(
         engine, sources, targets, arrival_taper, arrival_time,
-        wavename, filterer, plot=False, n_jobs=1):
+        wavename, filterer, plot=False, n_jobs=1, factorized=False):
     '''
     Calculate model prediction uncertainty matrix with respect to uncertainties
     in the velocity model for station and channel.
@@ -425,7 +527,10 @@ def seismic_cov_velocity_models(
     plot : boolean
         open snuffler and browse traces if True
     n_jobs : int
-        number of processors to be used for calculation
+        number of threads to be used for calculation
+    factorized : boolean
+        if True, return the low-rank factor of the covariance matrix,
+        see :func:`sample_covariance_factor`
 
     Returns
     -------
@@ -446,16 +551,21 @@ def seismic_cov_velocity_models(
         pre_stack_cut=True,
         plot=plot,
         outmode='array',
-        chop_bounds=['b', 'c'])
+        chop_bounds=['b', 'c'],
+        nprocs=n_jobs)
 
     t1 = time()
     logger.debug('Trace generation time %f' % (t1 - t0))
 
+    if factorized:
+        return sample_covariance_factor(synths)
+
     return num.cov(synths, rowvar=0)
 
 
 def geodetic_cov_velocity_models(
-        engine, sources, targets, dataset, plot=False, event=None, n_jobs=1):
+        engine, sources, targets, dataset, plot=False, event=None, n_jobs=1,
+        factorized=False):
     """
     Calculate model prediction uncertainty matrix with respect to uncertainties
     in the velocity model for geodetic targets using fomosto GF stores.
@@ -471,6 +581,11 @@ def geodetic_cov_velocity_models(
         matrix
     plot : boolean
         if set, a plot is produced and not covariance matrix is returned
+    n_jobs : int
+        number of threads to be used for calculation
+    factorized : boolean
+        if True, return the low-rank factor of the covariance matrix,
+        see :func:`sample_covariance_factor`
 
     Returns
     -------
@@ -481,7 +596,8 @@ def geodetic_cov_velocity_models(
         engine=engine,
         targets=targets,
         sources=sources,
-        outmode='stacked_arrays')
+        outmode='stacked_arrays',
+        nprocs=n_jobs)
     t1 = time()
     logger.debug('Synthetics generation time %f' % (t1 - t0))
 
@@ -500,6 +616,9 @@ def geodetic_cov_velocity_models(
         plt.colorbar(im)
         plt.show()
 
+    if factorized:
+        return sample_covariance_factor(synths)
+
     return num.cov(synths, rowvar=0)
 
 
@@ -544,25 +663,56 @@ def geodetic_cov_velocity_models_pscmp(
 
 def autocovariance(data):
     """
-    Calculate autocovariance of data.
+    Calculate autocovariance of data, along the last axis.
+    Uses the Fourier transform of the zero-padded data, so that
+    several data arrays of equal size may be processed at once.
+
+    Parameters
+    ----------
+    data : :class:`numpy.ndarray` 1-d or 2-d
+        (n_data, size data)
 
     Returns
     -------
-    :class:`numpy.ndarray`
+    :class:`numpy.ndarray` of shape data
 
     Notes
     -----
     Following Dettmer et al. 2007 JASA
     """
-    n = data.size
-    meand = data.mean()
+    n = data.shape[-1]
+    demeaned = data - data.mean(axis=-1, keepdims=True)
 
-    autocov = num.zeros((n), tconfig.floatX)
-    for j in range(n):
-        for k in range(n - j):
-            autocov[j] += (data[j + k] - meand) * (data[k] - meand)
+    # padding avoids wrap-around of the circular correlation
+    nfft = trace.nextpow2(2 * n)
+    spectrum = num.fft.rfft(demeaned, nfft, axis=-1)
+    autocov = num.fft.irfft(
+        spectrum * num.conj(spectrum), nfft, axis=-1)[..., :n]
 
-    return autocov / n
+    return (autocov / n).astype(tconfig.floatX)
+
+
+def scaled_autocovariance(data, window_size):
+    """
+    Get autocovariance of data scaled by its running window rms.
+
+    Parameters
+    ----------
+    data : :class:`numpy.ndarray` 1-d or 2-d
+        of data, 2-d (n_data, size data) for several data arrays at once
+    window_size : int
+        samples to take on running rmse estimation over data
+
+    Returns
+    -------
+    coeffs : :class:`numpy.ndarray` of shape data
+        autocovariance, first row of the Toeplitz matrix
+    stds : :class:`numpy.ndarray` of shape data
+        of running windows
+    """
+    stds = running_window_rms(data, window_size=window_size, mode='same')
+    coeffs = autocovariance(data / stds)
+    return coeffs, stds
 
 
 def toeplitz_covariance(data, window_size):
@@ -575,8 +725,7 @@ def toeplitz_covariance(data, window_size):
     stds : :class:`numpy.ndarray` 1-d, size data
         of running windows
     """
-    stds = running_window_rms(data, window_size=window_size, mode='same')
-    coeffs = autocovariance(data / stds)
+    coeffs, stds = scaled_autocovariance(data, window_size)
     return toeplitz(coeffs), stds
 
 
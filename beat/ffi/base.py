@@ -913,6 +913,12 @@ def _process_patch_seismic(
         pcopy.stf.duration = float(duration)
         source_patches_durations.append(pcopy)
 
+    event_arrival_times = heart.get_phase_arrival_times(
+        engine=engine,
+        source=gfs.config.event,
+        targets=targets,
+        wavename=gfs.config.wave_config.name)
+
     for j, target in enumerate(targets):
 
         traces, _ = heart.seis_synthetics(
@@ -928,11 +934,7 @@ def _process_patch_seismic(
 
         # getting event related arrival time valid for all patches
         # as common reference
-        event_arrival_time = heart.get_phase_arrival_time(
-            engine=engine,
-            source=gfs.config.event,
-            target=target,
-            wavename=gfs.config.wave_config.name)
+        event_arrival_time = event_arrival_times[j]
 
         gfs.set_patch_time(targetidx=j, tmin=event_arrival_time)
 
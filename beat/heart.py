@@ -7,6 +7,7 @@ import os
 import logging
 import shutil
 import copy
+import hashlib
 from time import time
 from collections import OrderedDict
 
@@ -15,8 +16,9 @@ from beat import psgrn, pscmp, utility, qseis2d
 from theano import config as tconfig
 from theano import shared
 import numpy as num
-from scipy import linalg
-from scipy.signal import lfilter, zpk2tf
+from scipy import linalg, sparse
+from scipy.spatial import cKDTree
+from scipy.signal import lfilter, zpk2tf, butter
 
 from pyrocko.guts import (Dict, Object, String, StringChoice,
                           Float, Int, Tuple, List)
@@ -88,6 +90,13 @@ class Covariance(Object):
     """
     Covariance of an observation. Holds data and model prediction uncertainties
     for one observation object.
+
+    The factorization of ALL uncertainty covariance matrices is calculated
+    once on demand and kept until one of the matrices is reassigned.
+    Changes of the matrices in place are not tracked!
+    If the velocity model prediction covariance is given in low-rank form
+    (pred_v_factor), it is added to the factorization of the other matrices
+    by the Woodbury identity and the matrix determinant lemma.
     """
 
     data = Array.T(
@@ -105,15 +114,74 @@ class Covariance(Object):
         dtype=tconfig.floatX,
         help='Model prediction covariance matrix, velocity model',
         optional=True)
+    pred_v_factor = Array.T(
+        shape=(None, None),
+        dtype=tconfig.floatX,
+        help='Low-rank factor U (samples x rank) of the model prediction '
+             'covariance matrix U * U^T, velocity model, that is added to '
+             'pred_v',
+        optional=True)
 
     def __init__(self, **kwargs):
         self.slog_pdet = shared(0., name='cov_normalisation', borrow=True)
         Object.__init__(self, **kwargs)
         self.update_slog_pdet()
 
+    def __setattr__(self, name, value):
+        Object.__setattr__(self, name, value)
+        if name in self.covs_supported():
+            self.__dict__['_factorization'] = {}
+            self.__dict__['_low_rank_factorization'] = {}
+        elif name == 'pred_v_factor':
+            self.__dict__['_low_rank_factorization'] = {}
+
+    def __getstate__(self):
+        # factorizations are large and recalculated on demand
+        state = self.__dict__.copy()
+        state.pop('_factorization', None)
+        state.pop('_low_rank_factorization', None)
+        return state
+
     def covs_supported(self):
         return ['pred_g', 'pred_v', 'data']
 
+    def _get_factor(self, name, calculate, low_rank=False):
+        """
+        Get factor of the covariance matrices from the cached factorization,
+        or calculate and cache it. Factors that depend on the low-rank
+        velocity model covariance are kept separately.
+        """
+        cache_name = '_low_rank_factorization' if low_rank else \
+            '_factorization'
+
+        factorization = self.__dict__.get(cache_name, {})
+        if name not in factorization:
+            factor = calculate()
+            self.__dict__.setdefault(cache_name, {})[name] = factor
+            return factor
+
+        return factorization[name]
+
+    def _base(self):
+        """
+        Sum of the dense uncertainty covariance matrices.
+        """
+        self.check_matrix_init('pred_g')
+        self.check_matrix_init('pred_v')
+
+        Cx = self.pred_g + self.pred_v + self.data
+        if Cx.sum() == 0:
+            raise ValueError('No covariances given!')
+
+        return Cx
+
+    def _total(self):
+        Cx = self.p_total + self.data
+        if Cx.sum() == 0:
+            raise ValueError('No covariances given!')
+
+        return Cx
+
     def check_matrix_init(self, cov_mat_str=''):
         """
         Check if matrix is initialised and if not set with zeros of size data.
@@ -134,26 +202,47 @@ class Covariance(Object):
                     '%s covariances defined but size '
                     'inconsistent!' % cov_mat_str)
 
-        setattr(self, cov_mat_str, cov_mat)
+        if cov_mat is not getattr(self, cov_mat_str):
+            setattr(self, cov_mat_str, cov_mat)
+
+    @property
+    def pred_v_dense(self):
+        """
+        Model prediction covariance matrix, velocity model, including the
+        low-rank part.
+        """
+        self.check_matrix_init('pred_v')
+        if self.pred_v_factor is None:
+            return self.pred_v
+
+        if self.pred_v_factor.shape[0] != self.data.shape[0]:
+            raise ValueError(
+                'pred_v_factor covariances defined but size inconsistent!')
+
+        return self.pred_v + self.pred_v_factor.dot(self.pred_v_factor.T)
 
     @property
     def p_total(self):
 
         self.check_matrix_init('pred_g')
-        self.check_matrix_init('pred_v')
 
-        return self.pred_g + self.pred_v
+        return self.pred_g + self.pred_v_dense
 
     @property
     def inverse(self):
         """
         Add and invert ALL uncertainty covariance Matrices.
         """
-        Cx = self.p_total + self.data
-        if Cx.sum() == 0:
-            raise ValueError('No covariances given!')
-        else:
-            return num.linalg.inv(Cx).astype(tconfig.floatX)
+        def calculate():
+            if self.pred_v_factor is not None:
+                weight = self.chol_inverse
+                return weight.T.dot(weight).astype(tconfig.floatX)
+
+            chol = self.chol
+            return linalg.cho_solve(
+                (chol, True), num.eye(chol.shape[0])).astype(tconfig.floatX)
+
+        return self._get_factor('inverse', calculate, low_rank=True)
 
     @property
     def inverse_p(self):
@@ -178,11 +267,48 @@ class Covariance(Object):
         """
         Cholesky decomposition of ALL uncertainty covariance matrices.
         """
-        Cx = self.p_total + self.data
-        if Cx.sum() == 0:
-            raise ValueError('No covariances given!')
-        else:
-            return linalg.cholesky(Cx, lower=True).astype(tconfig.floatX)
+        def calculate():
+            return linalg.cholesky(
+                self._total(), lower=True).astype(tconfig.floatX)
+
+        return self._get_factor('chol', calculate, low_rank=True)
+
+    @property
+    def _reversed_chol(self):
+        """
+        Cholesky decomposition of the dense uncertainty covariance matrices
+        with reversed order of the samples.
+        """
+        def calculate():
+            return linalg.cholesky(self._base()[::-1, ::-1], lower=True)
+
+        return self._get_factor('reversed_chol', calculate)
+
+    @property
+    def _base_chol_inverse(self):
+        def calculate():
+            # the inverse of the Cholesky factor of the reversed matrix
+            # is the reversed Cholesky factor of the inverse, no explicit
+            # inversion needed
+            reversed_chol = self._reversed_chol
+            return linalg.solve_triangular(
+                reversed_chol, num.eye(reversed_chol.shape[0]),
+                lower=True)[::-1, ::-1].astype(tconfig.floatX)
+
+        return self._get_factor('chol_inverse', calculate)
+
+    @property
+    def _low_rank_svd(self):
+        """
+        Singular value decomposition of the low-rank factor whitened by the
+        dense uncertainty covariance matrices.
+        """
+        def calculate():
+            whitened_factor = self._base_chol_inverse.dot(self.pred_v_factor)
+            vecs, svals, _ = linalg.svd(whitened_factor, full_matrices=False)
+            return vecs, svals
+
+        return self._get_factor('svd', calculate, low_rank=True)
 
     @property
     def chol_inverse(self):
@@ -190,30 +316,626 @@ class Covariance(Object):
         Cholesky decomposition of the Inverse of the Covariance matrix of
         ALL uncertainty covariance
         matrices. To be used as weight in the optimization.
+        With a low-rank velocity model covariance the weight W is not
+        triangular anymore, but still W^T * W is the inverse.
 
         Returns
         -------
         lower triangle of the cholesky decomposition
         """
-        return num.linalg.cholesky(
-            self.inverse).T.astype(tconfig.floatX)
+        if self.pred_v_factor is None:
+            return self._base_chol_inverse
+
+        def calculate():
+            # Woodbury: W = (I - P * diag(1 - 1 / sqrt(1 + s^2)) * P^T) * Wb
+            # with whitened factor Wb * U = P * diag(s) * Q^T
+            base_weight = self._base_chol_inverse
+            vecs, svals = self._low_rank_svd
+            shrink = 1. - 1. / num.sqrt(1. + svals ** 2)
+            return (base_weight - (vecs * shrink).dot(
+                vecs.T.dot(base_weight))).astype(tconfig.floatX)
+
+        return self._get_factor('chol_inverse', calculate, low_rank=True)
 
     @property
     def log_pdet(self):
         """
         Calculate the log of the determinant of the total matrix.
         """
-        ldet_x = num.log(num.diag(self.chol)).sum() * 2.
+        def calculate():
+            return num.log(num.diag(self._reversed_chol)).sum() * 2.
+
+        ldet_x = self._get_factor('log_pdet', calculate)
+        if self.pred_v_factor is not None:
+            # matrix determinant lemma
+            _, svals = self._low_rank_svd
+            ldet_x += num.log1p(svals ** 2).sum()
+
         return utility.scalar2floatX(ldet_x)
 
-    def update_slog_pdet(self):
+    @property
+    def samples(self):
+        if self.data is None:
+            return None
+
+        return self.data.shape[0]
+
+    @property
+    def has_prediction_covariances(self):
+        return self.pred_v_factor is not None or any(
+            cov_mat is not None and cov_mat.any()
+            for cov_mat in (self.pred_g, self.pred_v))
+
+    def inverse_quadratic_form(self, residual):
+        """
+        Calculate the quadratic form r^T * Cx^-1 * r of a residual with the
+        inverse of ALL uncertainty covariance matrices.
+
+        Parameters
+        ----------
+        residual : :class:`numpy.ndarray`
+            of size samples
+
+        Returns
+        -------
+        float
+        """
+        tmp = self.chol_inverse.dot(residual)
+        return num.dot(tmp, tmp)
+
+    def update_slog_pdet(self, operator=None):
         """
         Update shared variable with current log_norm_factor (lnf)
         (for theano models).
+
+        Parameters
+        ----------
+        operator : :class:`numpy.ndarray`
+            optional, reduction operator of the data, see :meth:`reduced`
         """
-        self.slog_pdet.set_value(self.log_pdet)
+        if operator is None:
+            log_pdet = self.log_pdet
+        else:
+            log_pdet = self.reduced(operator).log_pdet
+
+        self.slog_pdet.set_value(log_pdet)
         self.slog_pdet.astype(tconfig.floatX)
 
+    def reduced(self, operator):
+        """
+        Covariance of the data reduced by a linear operator with orthonormal
+        columns, e.g. a lower resolution representation of the data,
+        see :func:`decimation_operator`.
+
+        Parameters
+        ----------
+        operator : :class:`numpy.ndarray`
+            of size (samples, reduced samples)
+
+        Returns
+        -------
+        :class:`Covariance`
+        """
+        reduced_covs = {}
+        for cov_mat_str in self.covs_supported():
+            cov_mat = getattr(self, cov_mat_str)
+            if cov_mat is not None:
+                reduced_covs[cov_mat_str] = operator.T.dot(
+                    cov_mat).dot(operator).astype(tconfig.floatX)
+
+        if self.pred_v_factor is not None:
+            reduced_covs['pred_v_factor'] = operator.T.dot(
+                self.pred_v_factor).astype(tconfig.floatX)
+
+        return Covariance(**reduced_covs)
+
+    def reduced_chol_inverse(self, operator):
+        """
+        Cholesky decomposition of the Inverse of the reduced Covariance
+        matrix of ALL uncertainty covariance matrices, multiplied with the
+        transposed reduction operator. To be used as weight of the full
+        resolution residuals in the optimization.
+
+        Parameters
+        ----------
+        operator : :class:`numpy.ndarray`
+            of size (samples, reduced samples), see :meth:`reduced`
+
+        Returns
+        -------
+        :class:`numpy.ndarray` of size (reduced samples, samples)
+        """
+        return self.reduced(operator).chol_inverse.dot(
+            operator.T).astype(tconfig.floatX)
+
+    def spectral_variances(self, basis):
+        """
+        Variances of ALL uncertainty covariance matrices with respect to
+        the coefficients of an orthonormal basis, i.e. the diagonal of
+        basis.T * Cx * basis. For a Fourier basis the coefficients are
+        uncorrelated, if the covariance is circulant, which is a good
+        approximation for stationary (Toeplitz) noise.
+
+        Parameters
+        ----------
+        basis : :class:`numpy.ndarray`
+            of size (samples, coefficients), see :func:`spectral_basis`
+
+        Returns
+        -------
+        :class:`numpy.ndarray` of size coefficients
+        """
+        Cx = self.p_total + self.data
+        if Cx.sum() == 0:
+            raise ValueError('No covariances given!')
+        else:
+            return (basis * Cx.dot(basis)).sum(axis=0)
+
+    def spectral_weights(self, basis):
+        """
+        Inverse standard deviations of the coefficients of an orthonormal
+        basis of ALL uncertainty covariance matrices. To be used as weight
+        in the optimization in the spectral domain.
+
+        Parameters
+        ----------
+        basis : :class:`numpy.ndarray`
+            of size (samples, coefficients), see :func:`spectral_basis`
+
+        Returns
+        -------
+        :class:`numpy.ndarray` of size coefficients
+        """
+        return (1. / num.sqrt(
+            self.spectral_variances(basis))).astype(tconfig.floatX)
+
+
+def levinson_durbin(autocovariance):
+    """
+    Levinson-Durbin recursion for the symmetric positive definite Toeplitz
+    matrix of an autocovariance.
+
+    Parameters
+    ----------
+    autocovariance : :class:`numpy.ndarray`
+        first row of the Toeplitz matrix
+
+    Returns
+    -------
+    :class:`numpy.ndarray` first column of the inverse Toeplitz matrix and
+    float log-determinant of the Toeplitz matrix
+    """
+    error = float(autocovariance[0])
+    if error <= 0.:
+        raise ValueError('Autocovariance is not positive definite!')
+
+    predictor = num.zeros(0)
+    log_det = num.log(error)
+    for k in range(1, autocovariance.size):
+        reflection = (
+            autocovariance[k] - predictor.dot(autocovariance[k - 1:0:-1])) / \
+            error
+        predictor = num.concatenate(
+            [predictor - reflection * predictor[::-1], [reflection]])
+        error *= 1. - reflection ** 2
+        if error <= 0.:
+            raise ValueError('Autocovariance is not positive definite!')
+
+        log_det += num.log(error)
+
+    return num.concatenate([[1.], -predictor]) / error, log_det
+
+
+def toeplitz_quadratic_form(weight, residuals):
+    """
+    Quadratic forms r^T * C^-1 * r of residuals with the inverse of a scaled
+    Toeplitz covariance matrix C = S * T * S, given by its structured
+    weight, see :attr:`ToeplitzCovariance.toeplitz_weight`.
+    The Gohberg-Semencul formula T^-1 = L(g1) * L(g1)^T - L(g2) * L(g2)^T,
+    with L the lower triangular Toeplitz matrices of the generators, is
+    evaluated with FFTs.
+
+    Parameters
+    ----------
+    weight : :class:`numpy.ndarray`
+        of size (3, samples), generators g1 and g2 and inverse stds
+    residuals : :class:`numpy.ndarray`
+        of size (samples) or (n_residuals, samples)
+
+    Returns
+    -------
+    float or :class:`numpy.ndarray` of size n_residuals
+    """
+    nsamples = weight.shape[1]
+    nfft = trace.nextpow2(2 * nsamples)
+    spectrum = num.fft.rfft(residuals * weight[2], nfft, axis=-1)
+
+    quadratic_form = 0.
+    for generator, sign in zip(weight[:2], (1., -1.)):
+        # correlation with the generator, i.e. L(generator)^T * residuals
+        products = num.fft.irfft(
+            num.conj(num.fft.rfft(generator, nfft)) * spectrum, nfft,
+            axis=-1)[..., :nsamples]
+        quadratic_form = quadratic_form + sign * (products ** 2).sum(axis=-1)
+
+    return quadratic_form
+
+
+def toeplitz_inverse_product(weight, residuals):
+    """
+    Products C^-1 * r of residuals with the inverse of a scaled Toeplitz
+    covariance matrix, given by its structured weight, i.e. half the
+    gradient of :func:`toeplitz_quadratic_form`.
+
+    Parameters
+    ----------
+    weight : :class:`numpy.ndarray`
+        of size (3, samples), generators g1 and g2 and inverse stds
+    residuals : :class:`numpy.ndarray`
+        of size (samples) or (n_residuals, samples)
+
+    Returns
+    -------
+    :class:`numpy.ndarray` of the size of residuals
+    """
+    nsamples = weight.shape[1]
+    nfft = trace.nextpow2(2 * nsamples)
+    spectrum = num.fft.rfft(residuals * weight[2], nfft, axis=-1)
+
+    inverse_product = 0.
+    for generator, sign in zip(weight[:2], (1., -1.)):
+        generator_spectrum = num.fft.rfft(generator, nfft)
+        # L(generator)^T * residuals, then convolution with the generator
+        products = num.fft.irfft(
+            num.conj(generator_spectrum) * spectrum, nfft,
+            axis=-1)[..., :nsamples]
+        inverse_product = inverse_product + sign * num.fft.irfft(
+            generator_spectrum * num.fft.rfft(products, nfft, axis=-1),
+            nfft, axis=-1)[..., :nsamples]
+
+    return inverse_product * weight[2]
+
+
+class ToeplitzCovariance(Covariance):
+    """
+    Covariance of an observation with stationary, or scaled stationary,
+    data noise. The data covariance matrix S * T * S, with T the symmetric
+    Toeplitz matrix of the autocovariance and S the diagonal matrix of the
+    stds, is not stored, but assembled on access of data.
+
+    Without model prediction covariances, the log-determinant is given by
+    the Levinson-Durbin recursion and the misfits are calculated with
+    :func:`toeplitz_quadratic_form` from the weight
+    :attr:`toeplitz_weight` of size (3, samples), instead of a dense
+    weight matrix.
+    """
+
+    autocovariance = Array.T(
+        shape=(None,),
+        dtype=tconfig.floatX,
+        help='Autocovariance of the data noise, first row of the Toeplitz '
+             'matrix')
+    stds = Array.T(
+        shape=(None,),
+        dtype=tconfig.floatX,
+        help='Standard deviations that scale the data noise, e.g. for '
+             'non-stationary noise, ones if not given',
+        optional=True)
+
+    def __setattr__(self, name, value):
+        Covariance.__setattr__(self, name, value)
+        if name in ('autocovariance', 'stds'):
+            self.__dict__['_factorization'] = {}
+            self.__dict__['_low_rank_factorization'] = {}
+
+    @property
+    def data(self):
+        if self.autocovariance is None:
+            return None
+
+        data = linalg.toeplitz(self.autocovariance)
+        if self.stds is not None:
+            data *= self.stds[:, num.newaxis] * self.stds[num.newaxis, :]
+
+        return data.astype(tconfig.floatX)
+
+    @property
+    def samples(self):
+        return self.autocovariance.size
+
+    @property
+    def _levinson(self):
+        return self._get_factor(
+            'levinson',
+            lambda: levinson_durbin(self.autocovariance.astype('float64')))
+
+    @property
+    def toeplitz_weight(self):
+        """
+        Generators of the Gohberg-Semencul representation of the inverse
+        Toeplitz matrix and inverse stds. To be used as weight in the
+        optimization, see :func:`toeplitz_quadratic_form`.
+
+        Returns
+        -------
+        :class:`numpy.ndarray` of size (3, samples)
+        """
+        if self.has_prediction_covariances:
+            raise ValueError(
+                'Model prediction covariances are not supported in'
+                ' structured form!')
+
+        def calculate():
+            first_column, _ = self._levinson
+            nsamples = first_column.size
+            weight = num.zeros((3, nsamples))
+            weight[0] = first_column / num.sqrt(first_column[0])
+            weight[1, 1:] = weight[0, :0:-1]
+            if self.stds is None:
+                weight[2] = 1.
+            else:
+                weight[2] = 1. / self.stds
+
+            return weight.astype(tconfig.floatX)
+
+        return self._get_factor('toeplitz_weight', calculate, low_rank=True)
+
+    @property
+    def log_pdet(self):
+        """
+        Calculate the log of the determinant of the total matrix.
+        """
+        if self.has_prediction_covariances:
+            return super(ToeplitzCovariance, self).log_pdet
+
+        _, log_det = self._levinson
+        if self.stds is not None:
+            log_det += 2. * num.log(self.stds).sum()
+
+        return utility.scalar2floatX(log_det)
+
+    def inverse_quadratic_form(self, residual):
+        if self.has_prediction_covariances:
+            return super(ToeplitzCovariance, self).inverse_quadratic_form(
+                residual)
+
+        return toeplitz_quadratic_form(self.toeplitz_weight, residual)
+
+
+def tapered_exponential_covariance(
+        distances, variance, correlation_distance, taper_distance):
+    """
+    Exponential covariance function multiplied with the compactly supported
+    Wendland taper (1 - h)^4 * (4h + 1), h = distance / taper_distance,
+    which is positive definite in up to three dimensions. Covariances of
+    points further apart than the taper distance are zero.
+
+    Parameters
+    ----------
+    distances : :class:`numpy.ndarray`
+        of any shape, distances [m] between points
+    variance : float
+        of the exponential covariance function
+    correlation_distance : float
+        [m] e-folding distance of the exponential covariance function
+    taper_distance : float
+        [m] distance beyond which the covariances are zero
+
+    Returns
+    -------
+    :class:`numpy.ndarray` of shape distances
+    """
+    h = num.minimum(distances / taper_distance, 1.)
+    return variance * num.exp(-distances / correlation_distance) * \
+        (1. - h) ** 4 * (4. * h + 1.)
+
+
+class TaperedCovariance(Covariance):
+    """
+    Covariance of an observation with spatially correlated data noise, e.g.
+    of InSAR data, given by a tapered exponential covariance function, see
+    :func:`tapered_exponential_covariance`, and uncorrelated noise
+    (nugget). The data covariance matrix is not stored, but assembled on
+    access of data or sparse_data.
+
+    Without model prediction covariances, the weight is the sparse
+    inverse Cholesky factor of the Vecchia approximation, i.e. each point
+    is conditioned only on its nearest max_neighbours points that precede
+    it in a random ordering of the points. For max_neighbours >= samples - 1
+    the factorization is exact. The weight has max_neighbours + 1 non-zero
+    entries per row, so that memory and setup time grow linearly with the
+    number of points.
+    """
+
+    locations = Array.T(
+        shape=(None, 2),
+        dtype=num.float,
+        help='Local coordinates [m] of the data points, e.g. (northings, '
+             'eastings)')
+    variance = Float.T(
+        default=1.,
+        help='Variance of the exponential covariance function')
+    correlation_distance = Float.T(
+        default=5000.,
+        help='Distance [m] of the exponential decay of the covariances')
+    taper_distance = Float.T(
+        default=30000.,
+        help='Distance [m] beyond which the covariances are zero')
+    nugget = Float.T(
+        default=0.,
+        help='Variance of the uncorrelated data noise')
+    max_neighbours = Int.T(
+        default=30,
+        help='Maximum number of neighbouring points each point is '
+             'conditioned on in the sparse weight')
+
+    def __setattr__(self, name, value):
+        Covariance.__setattr__(self, name, value)
+        if name in ('locations', 'variance', 'correlation_distance',
+                    'taper_distance', 'nugget', 'max_neighbours'):
+            self.__dict__['_factorization'] = {}
+            self.__dict__['_low_rank_factorization'] = {}
+
+    def covariance_function(self, distances):
+        return tapered_exponential_covariance(
+            distances, self.variance, self.correlation_distance,
+            self.taper_distance)
+
+    @property
+    def sparse_data(self):
+        """
+        Data covariance matrix.
+
+        Returns
+        -------
+        :class:`scipy.sparse.csr_matrix` of size (samples, samples)
+        """
+        if self.locations is None:
+            return None
+
+        tree = cKDTree(self.locations)
+        pairs = tree.sparse_distance_matrix(
+            tree, self.taper_distance, output_type='ndarray')
+        covs = self.covariance_function(pairs['v'])
+        covs[pairs['i'] == pairs['j']] += self.nugget
+        return sparse.csr_matrix(
+            (covs, (pairs['i'], pairs['j'])),
+            shape=(self.samples, self.samples), dtype=tconfig.floatX)
+
+    @property
+    def data(self):
+        if self.locations is None:
+            return None
+
+        return self.sparse_data.toarray()
+
+    @property
+    def samples(self):
+        return self.locations.shape[0]
+
+    @property
+    def _vecchia(self):
+        def calculate():
+            return self._sparse_inverse_cholesky()
+
+        return self._get_factor('vecchia', calculate)
+
+    def _sparse_inverse_cholesky(self, chunk_size=1000):
+        """
+        Sparse inverse Cholesky factor of the data covariance matrix in a
+        random ordering of the points and its log-determinant.
+        """
+        nsamples = self.samples
+        locations = self.locations.astype('float64')
+        nneighbours = max(min(self.max_neighbours, nsamples - 1), 1)
+
+        ranks = num.empty(nsamples, dtype='int')
+        ranks[num.random.RandomState(0).permutation(nsamples)] = \
+            num.arange(nsamples)
+
+        # preceding neighbours among the nearest points, the precision
+        # matrix is not sparse, so points beyond the taper are not excluded
+        nsearch = min(nsamples, 4 * nneighbours + 1)
+        _, candidates = cKDTree(locations).query(locations, k=nsearch)
+        candidates = candidates.reshape((nsamples, nsearch))
+        precede = ranks[candidates] < ranks[:, num.newaxis]
+        counts = num.cumsum(precede, axis=1)
+        positions = num.where(
+            precede & (counts <= nneighbours), counts - 1, nneighbours)
+
+        neighbours = num.full(
+            (nsamples, nneighbours + 1), nsamples, dtype='int')
+        neighbours[
+            num.arange(nsamples)[:, num.newaxis], positions] = candidates
+        neighbours = neighbours[:, :nneighbours]
+
+        padded_locations = num.vstack([locations, num.zeros((1, 2))])
+        total_variance = self.variance + self.nugget
+
+        rows, columns, values = [], [], []
+        log_det = 0.
+        for istart in range(0, nsamples, chunk_size):
+            points = num.arange(istart, min(istart + chunk_size, nsamples))
+            idxs = neighbours[points]
+            valid = idxs < nsamples
+            neighbour_locations = padded_locations[idxs]
+
+            # covariances between the neighbours, identity for padding
+            distances = num.sqrt(((
+                neighbour_locations[:, :, num.newaxis] -
+                neighbour_locations[:, num.newaxis, :]) ** 2).sum(axis=-1))
+            pair_valid = valid[:, :, num.newaxis] & valid[:, num.newaxis, :]
+            Cgg = self.covariance_function(distances) * pair_valid
+            Cgg += num.eye(nneighbours) * num.where(
+                valid, self.nugget, 1.)[:, num.newaxis, :]
+
+            distances = num.sqrt(((
+                neighbour_locations -
+                locations[points, num.newaxis, :]) ** 2).sum(axis=-1))
+            Cgi = self.covariance_function(distances) * valid
+
+            # conditional mean coefficients and variances
+            coefficients = num.linalg.solve(
+                Cgg, Cgi[:, :, num.newaxis])[:, :, 0]
+            conditional_variances = total_variance - \
+                (Cgi * coefficients).sum(axis=1)
+            if (conditional_variances <= 0.).any():
+                raise ValueError('Covariance is not positive definite!')
+
+            log_det += num.log(conditional_variances).sum()
+            scales = 1. / num.sqrt(conditional_variances)
+
+            point_rows = ranks[points]
+            neighbour_rows = num.repeat(point_rows, valid.sum(axis=1))
+            rows.extend([point_rows, neighbour_rows])
+            columns.extend([points, idxs[valid]])
+            values.extend([
+                scales, -(coefficients * scales[:, num.newaxis])[valid]])
+
+        weight = sparse.csr_matrix(
+            (num.concatenate(values),
+             (num.concatenate(rows), num.concatenate(columns))),
+            shape=(nsamples, nsamples), dtype=tconfig.floatX)
+        return weight, log_det
+
+    @property
+    def sparse_weight(self):
+        """
+        Sparse inverse Cholesky factor W of the data covariance matrix,
+        W^T * W is the (approximate) inverse. To be used as weight in the
+        optimization, rows are not ordered like the samples.
+
+        Returns
+        -------
+        :class:`scipy.sparse.csr_matrix` of size (samples, samples)
+        """
+        if self.has_prediction_covariances:
+            raise ValueError(
+                'Model prediction covariances are not supported in'
+                ' sparse form!')
+
+        weight, _ = self._vecchia
+        return weight
+
+    @property
+    def log_pdet(self):
+        """
+        Calculate the log of the determinant of the total matrix.
+        """
+        if self.has_prediction_covariances:
+            return super(TaperedCovariance, self).log_pdet
+
+        _, log_det = self._vecchia
+        return utility.scalar2floatX(log_det)
+
+    def inverse_quadratic_form(self, residual):
+        if self.has_prediction_covariances:
+            return super(TaperedCovariance, self).inverse_quadratic_form(
+                residual)
+
+        tmp = self.sparse_weight.dot(residual)
+        return num.dot(tmp, tmp)
+
 
 class ArrivalTaper(trace.Taper):
     """
@@ -326,6 +1048,29 @@ class FrequencyFilter(FilterBase):
              ' ends of trace.')
 
 
+def get_filter_band(filterer=None):
+    """
+    Get the frequency band that is passed by a filterer.
+
+    Parameters
+    ----------
+    filterer : :class:`Filter` or :class:`FrequencyFilter` or None
+
+    Returns
+    -------
+    tuple of lower and upper frequency [Hz], upper is None if unbounded
+    """
+    if filterer is None:
+        return 0., None
+    elif isinstance(filterer, Filter):
+        return filterer.lower_corner, filterer.upper_corner
+    elif isinstance(filterer, FrequencyFilter):
+        return filterer.freqlimits[0], filterer.freqlimits[3]
+    else:
+        raise TypeError(
+            'Filterer "%s" not supported!' % filterer.__class__.__name__)
+
+
 class ResultPoint(Object):
     """
     Containing point in solution space.
@@ -596,8 +1341,8 @@ class SeismicDataset(trace.Trace):
 
     @property
     def samples(self):
-        if self.covariance.data is not None:
-            return self.covariance.data.shape[0]
+        if self.covariance.samples is not None:
+            return self.covariance.samples
         else:
             logger.warn(
                 'Dataset has no uncertainties! Return full data length!')
@@ -931,13 +1676,23 @@ class DiffIFG(IFG):
         optional=True)
 
     @classmethod
-    def from_kite_scene(cls, scene, **kwargs):
-        logger.info(
-            'Attempting to access the full covariance matrix of the kite'
-            ' scene %s. If this is not precalculated it will be calculated '
-            'now, which may take a significant amount of time...' %
-            scene.meta.filename)
-        covariance = Covariance(data=scene.covariance.covariance_matrix)
+    def from_kite_scene(cls, scene, covariance_taper=None, **kwargs):
+        """
+        Parameters
+        ----------
+        scene : :class:`kite.Scene`
+        covariance_taper : :class:`config.GeodeticCovarianceTaperConfig`
+            optional, if given the exponential covariance model fitted by
+            kite is used as :class:`TaperedCovariance`, instead of the full
+            covariance matrix
+        """
+        if covariance_taper is None:
+            logger.info(
+                'Attempting to access the full covariance matrix of the kite'
+                ' scene %s. If this is not precalculated it will be '
+                'calculated now, which may take a significant amount of '
+                'time...' % scene.meta.filename)
+            covariance = Covariance(data=scene.covariance.covariance_matrix)
 
         if scene.quadtree.frame.isDegree():
                 lats = num.empty(scene.quadtree.nleaves)
@@ -953,6 +1708,22 @@ class DiffIFG(IFG):
                     lat0=scene.frame.llLat, lon0=scene.frame.llLon,
                     north_m=locn, east_m=loce)
 
+        if covariance_taper is not None:
+            logger.info(
+                'Using the tapered exponential covariance model of the kite'
+                ' scene %s.' % scene.meta.filename)
+            north_shifts, east_shifts = orthodrome.latlon_to_ne_numpy(
+                scene.frame.llLat, scene.frame.llLon, lats, lons)
+            variance, correlation_distance = \
+                scene.covariance.covariance_model
+            covariance = TaperedCovariance(
+                locations=num.vstack([north_shifts, east_shifts]).T,
+                variance=variance,
+                correlation_distance=correlation_distance,
+                nugget=max(scene.covariance.variance - variance, 0.),
+                taper_distance=covariance_taper.taper_distance,
+                max_neighbours=covariance_taper.max_neighbours)
+
         d = dict(
             name=scene.meta.filename,
             displacement=scene.quadtree.leaf_means,
@@ -1999,6 +2770,192 @@ def get_phase_arrival_time(engine, source, target, wavename=None, snap=True):
     return atime
 
 
+class ArrivalTimeTable(object):
+    """
+    Travel times of a tabulated phase of a Greens Function store,
+    precomputed on the source depth - distance grid of the store.
+    The arrival times of many targets are evaluated at once by bilinear
+    interpolation on the grid.
+
+    Parameters
+    ----------
+    store : :class:`pyrocko.gf.store.Store`
+        of type A (source depth, distance)
+    wavename : string
+        of the tabulated phase
+    """
+
+    def __init__(self, store, wavename):
+        sc = store.config
+        self.wavename = wavename
+        self.deltat = 1. / sc.sample_rate
+
+        axes = []
+        for vmin, vmax, delta in (
+                (sc.source_depth_min, sc.source_depth_max,
+                 sc.source_depth_delta),
+                (sc.distance_min, sc.distance_max, sc.distance_delta)):
+            n = int(round((vmax - vmin) / delta)) + 1
+            axes.append((vmin, delta, n))
+
+        (self.depth_min, self.depth_delta, ndepths), \
+            (self.distance_min, self.distance_delta, ndistances) = axes
+
+        depths, distances = num.meshgrid(
+            self.depth_min + num.arange(ndepths) * self.depth_delta,
+            self.distance_min + num.arange(ndistances) * self.distance_delta,
+            indexing='ij')
+
+        t0 = time()
+        self.times = store.get_stored_phase(wavename).interpolate_many(
+            num.vstack((depths.ravel(), distances.ravel())).T).reshape(
+                (ndepths, ndistances))
+
+        # at least two nodes on each axis for the interpolation
+        for axis in range(2):
+            if self.times.shape[axis] == 1:
+                self.times = num.repeat(self.times, 2, axis=axis)
+
+        logger.debug(
+            'Travel time table "%s" of %s with %i x %i nodes,'
+            ' setup time %f' % (
+                wavename, sc.id, ndepths, ndistances, time() - t0))
+
+    def __call__(self, depths, distances):
+        """
+        Interpolate the travel times.
+
+        Parameters
+        ----------
+        depths : :class:`numpy.ndarray`
+            [m] source depths
+        distances : :class:`numpy.ndarray`
+            [m] source - receiver distances
+
+        Returns
+        -------
+        :class:`numpy.ndarray` of travel times, NaN where the phase does not
+        arrive or the points are outside of the store grid
+        """
+        depths, distances = num.broadcast_arrays(
+            num.asarray(depths, dtype='float64'),
+            num.asarray(distances, dtype='float64'))
+
+        ndepths, ndistances = self.times.shape
+        fi = (depths - self.depth_min) / self.depth_delta
+        fj = (distances - self.distance_min) / self.distance_delta
+
+        eps = 1e-6
+        outside = (fi < -eps) | (fi > ndepths - 1 + eps) | \
+            (fj < -eps) | (fj > ndistances - 1 + eps)
+
+        i = num.clip(num.floor(fi).astype('int64'), 0, ndepths - 2)
+        j = num.clip(num.floor(fj).astype('int64'), 0, ndistances - 2)
+        wi = num.clip(fi - i, 0., 1.)
+        wj = num.clip(fj - j, 0., 1.)
+
+        times = (1. - wi) * (1. - wj) * self.times[i, j] + \
+            (1. - wi) * wj * self.times[i, j + 1] + \
+            wi * (1. - wj) * self.times[i + 1, j] + \
+            wi * wj * self.times[i + 1, j + 1]
+
+        times[outside] = num.nan
+        return times
+
+
+# travel time tables by store id and wavename
+_arrival_time_tables = {}
+
+
+def get_arrival_time_table(engine, store_id, wavename):
+    """
+    Get the travel time table of the phase, it is calculated only once per
+    store and phase.
+
+    Parameters
+    ----------
+    engine : :class:`pyrocko.gf.seismosizer.LocalEngine`
+    store_id : string
+        of the Greens Function store
+    wavename : string
+        of the tabulated phase
+
+    Returns
+    -------
+    :class:`ArrivalTimeTable`
+    """
+    key = (store_id, wavename)
+    if key not in _arrival_time_tables:
+        _arrival_time_tables[key] = ArrivalTimeTable(
+            engine.get_store(store_id), wavename)
+
+    return _arrival_time_tables[key]
+
+
+def get_phase_arrival_times(
+        engine, source, targets, wavename=None, snap=True):
+    """
+    Get arrival times from the travel time tables of the Greens Function
+    stores for many targets at once, see :func:`get_phase_arrival_time`.
+
+    Parameters
+    ----------
+    engine : :class:`pyrocko.gf.seismosizer.LocalEngine`
+    source : :class:`pyrocko.gf.meta.Location`
+        can be therefore :class:`pyrocko.gf.seismosizer.Source` or
+        :class:`pyrocko.model.Event`
+    targets : list
+        of :class:`pyrocko.gf.seismosizer.Target`
+    wavename : string
+        of the tabulated phase that determines the phase arrival
+        needs to be the Id of a tabulated phase in the respective target.store
+        if "None" uses first tabulated phase
+    snap : if True
+        force arrival time on discrete samples of the store
+
+    Returns
+    -------
+    :class:`numpy.ndarray` of the arrival times of the wave at the targets
+    """
+    distances = num.array([target.distance_to(source) for target in targets])
+    arrival_times = num.empty(len(targets))
+
+    for store_id, idxs in utility.gather(
+            range(len(targets)), lambda i: targets[i].store_id).items():
+        idxs = num.array(idxs)
+        try:
+            store = engine.get_store(store_id)
+        except gf.seismosizer.NoSuchStore:
+            raise gf.seismosizer.NoSuchStore(
+                'No such store with ID %s found!' % store_id)
+
+        if wavename is None:
+            store_wavename = store.config.tabulated_phases[0].id
+            logger.debug(
+                'Wavename not specified using '
+                'first tabulated phase! %s' % store_wavename)
+        else:
+            store_wavename = wavename
+
+        table = get_arrival_time_table(engine, store_id, store_wavename)
+        atimes = table(source.depth, distances[idxs])
+
+        if num.isnan(atimes).any():
+            raise RayPathError(
+                'No wave-arrival for wavename "%s" distances %s [deg]! '
+                'Please adjust the distance range in the wavemap config!' % (
+                    store_wavename, utility.list2string(
+                        cake.m2d * distances[idxs][num.isnan(atimes)])))
+
+        atimes += source.time
+        if snap:
+            atimes = num.round(atimes / table.deltat) * table.deltat
+
+        arrival_times[idxs] = atimes
+
+    return arrival_times
+
+
 def get_phase_taperer(
         engine, source, wavename, target, arrival_taper, arrival_time=num.nan):
     """
@@ -2049,6 +3006,8 @@ class WaveformMapping(object):
     targets : list
         of :class:`pyrocko.gf.target.Target`
     """
+    _max_cached_locations = 1000
+
     def __init__(self, name, stations, weights=None, channels=['Z'],
                  datasets=[], targets=[]):
 
@@ -2059,8 +3018,11 @@ class WaveformMapping(object):
         self.targets = targets
         self.channels = channels
         self.station_correction_idxs = None
+        self.spectral_basis = None
+        self.decimation_operator = None
         self._prepared_data = None
         self._arrival_times = None
+        self._arrival_times_cache = OrderedDict()
         self._target2index = None
         self._station2index = None
 
@@ -2091,6 +3053,107 @@ class WaveformMapping(object):
 
         self.weights = weights
 
+    def init_spectral_basis(self, sample_rate, chop_bounds=['b', 'c']):
+        """
+        Initialise the Fourier basis of the data windows restricted to the
+        frequency band of the filterer. If initialised, the misfit of this
+        mapping is evaluated on the in-band spectral coefficients.
+
+        Parameters
+        ----------
+        sample_rate : float
+            sampling rate of data_traces and GreensFunction stores
+        chop_bounds : list of len 2
+            of taper attributes a, b, c, or d
+        """
+        fmin, fmax = get_filter_band(self.config.filterer)
+        nsamples = self.config.arrival_taper.nsamples(
+            sample_rate, chop_bounds)
+
+        self.spectral_basis = spectral_basis(
+            nsamples, deltat=1. / sample_rate, fmin=fmin, fmax=fmax)
+        logger.info(
+            'Misfit of "%s" on %i spectral coefficients instead of %i'
+            ' samples' % (
+                self._mapid, self.spectral_basis.shape[1], nsamples))
+
+    def set_decimation(self, factor, sample_rate, chop_bounds=['b', 'c']):
+        """
+        Set the resolution of the data windows in the misfit by averaging
+        blocks of samples. The weights have to be updated afterwards, see
+        :meth:`get_weight`. Not supported for the spectral misfit.
+
+        Parameters
+        ----------
+        factor : int
+            decimation factor, 1 for full resolution
+        sample_rate : float
+            sampling rate of data_traces and GreensFunction stores
+        chop_bounds : list of len 2
+            of taper attributes a, b, c, or d
+        """
+        if factor > 1 and self.spectral_basis is None:
+            nsamples = self.config.arrival_taper.nsamples(
+                sample_rate, chop_bounds)
+            self.decimation_operator = decimation_operator(nsamples, factor)
+        else:
+            self.decimation_operator = None
+
+    def get_weight(self, covariance):
+        """
+        Get the weight of a dataset of this mapping.
+
+        Parameters
+        ----------
+        covariance : :class:`Covariance`
+
+        Returns
+        -------
+        :class:`numpy.ndarray`, inverse cholesky decomposition of the
+        covariance matrix or the inverse standard deviations of the
+        spectral coefficients, if the spectral basis is initialised
+        or the reduced inverse cholesky decomposition if the data are
+        decimated or the structured weight of a
+        :class:`ToeplitzCovariance`
+        """
+        if self.spectral_basis is not None:
+            return covariance.spectral_weights(self.spectral_basis)
+        elif self.decimation_operator is not None:
+            return covariance.reduced_chol_inverse(self.decimation_operator)
+        elif isinstance(covariance, ToeplitzCovariance):
+            return covariance.toeplitz_weight
+        else:
+            return covariance.chol_inverse
+
+    @property
+    def structured_noise(self):
+        """
+        True if the misfits of the datasets are calculated with
+        structured weights, see :class:`ToeplitzCovariance`.
+        """
+        return self.spectral_basis is None and \
+            self.decimation_operator is None and all(
+                isinstance(dataset.covariance, ToeplitzCovariance)
+                for dataset in self.datasets)
+
+    def get_misfit_residuals(self, residuals):
+        """
+        Transform residuals in time to the domain of the misfit.
+
+        Parameters
+        ----------
+        residuals : :class:`numpy.ndarray` or :class:`theano.tensor.Tensor`
+            of size (targets, samples)
+
+        Returns
+        -------
+        residuals of size (targets, samples) or (targets, coefficients)
+        """
+        if self.spectral_basis is None:
+            return residuals
+        else:
+            return residuals.dot(self.spectral_basis)
+
     def _update_station_corrections(self):
         """
         Update station_correction_idx
@@ -2124,12 +3187,41 @@ class WaveformMapping(object):
         # reset mappings
         self._target2index = None
         self._station2index = None
+        self._arrival_times_cache = OrderedDict()
 
         if self.n_t > 0:
             self._update_station_corrections()
 
         self.check_consistency()
 
+    def prefilter_targets(self):
+        """
+        Replace the targets with copies that use the derived GF stores, with
+        filter and instrument responses applied already
+        (see :func:`build_prefiltered_store`).
+        """
+        targets = []
+        for target in self.targets:
+            prefiltered_target = copy.deepcopy(target)
+            prefiltered_target.store_id = get_prefiltered_store_id(
+                target.store_id, self.config.filterer, target.response)
+            prefiltered_target.response = None
+            targets.append(prefiltered_target)
+
+        self.targets = targets
+        self._target2index = None
+        self._arrival_times_cache = OrderedDict()
+
+    @property
+    def synthetics_filterer(self):
+        """
+        Filter to apply to the synthetics, None if the GFs are prefiltered.
+        """
+        if self.config.prefiltered_gfs:
+            return None
+        else:
+            return self.config.filterer
+
     def get_station_names(self):
         """
         Returns list of strings of station names
@@ -2205,6 +3297,33 @@ class WaveformMapping(object):
 
         return tidxs
 
+    def get_arrival_times(self, engine, source):
+        """
+        Get the arrival times of the wave at the targets. They are cached
+        with respect to the source location, e.g. the depth.
+
+        Parameters
+        ----------
+        engine : :class:`pyrocko.gf.seismosizer.LocalEngine`
+        source : :class:`pyrocko.gf.meta.Location`
+
+        Returns
+        -------
+        :class:`numpy.ndarray` of arrival times
+        """
+        key = (source.lat, source.lon, source.north_shift,
+               source.east_shift, source.depth)
+
+        if key not in self._arrival_times_cache:
+            if len(self._arrival_times_cache) == self._max_cached_locations:
+                self._arrival_times_cache.popitem(last=False)
+
+            self._arrival_times_cache[key] = get_phase_arrival_times(
+                engine=engine, source=source, targets=self.targets,
+                wavename=self.name) - source.time
+
+        return self._arrival_times_cache[key] + source.time
+
     def prepare_data(
             self, source, engine, outmode='array', chop_bounds=['b', 'c']):
         """
@@ -2217,11 +3336,8 @@ class WaveformMapping(object):
                 (self.name + '_' + str(self.mapnumber)))
 
         if hasattr(self, 'config'):
-            arrival_times = num.zeros((self.n_t), dtype=tconfig.floatX)
-            for i, target in enumerate(self.targets):
-                arrival_times[i] = get_phase_arrival_time(
-                    engine=engine, source=source,
-                    target=target, wavename=self.name)
+            arrival_times = self.get_arrival_times(
+                engine, source).astype(tconfig.floatX)
 
             if self.config.preprocess_data:
                 logger.debug('Pre-processing data ...')
@@ -2479,6 +3595,214 @@ def concatenate_datasets(datasets):
     return datasets, los_vectors, odws, Bij
 
 
+def get_prefiltered_store_id(store_id, filterer, response=None):
+    """
+    Get the ID of the derived GF store with the filter and the instrument
+    response applied to the GFs, see :func:`build_prefiltered_store`.
+
+    Parameters
+    ----------
+    store_id : str
+        of the original GF store
+    filterer : :class:`Filter` or :class:`FrequencyFilter`
+    response : :class:`pyrocko.trace.PoleZeroResponse`
+        optional, instrument response
+
+    Returns
+    -------
+    str
+    """
+    key = filterer.dump()
+    if response is not None:
+        key += response.dump()
+
+    return '%s_pf%s' % (
+        store_id, hashlib.sha1(key.encode('utf-8')).hexdigest()[:8])
+
+
+def get_prefilter_padding(filterer):
+    """
+    Duration [s] of the padding of the GFs before filtering, such that
+    the filter response decays within the padded traces. For Butterworth
+    filters the response to a step decays below 1e-5 of its peak within
+    2 * order periods of the lower corner.
+    """
+    if isinstance(filterer, Filter):
+        return 2. * filterer.order / filterer.lower_corner
+    elif isinstance(filterer, FrequencyFilter):
+        return max(2. * filterer.tfade, 8. / filterer.freqlimits[1])
+    else:
+        raise TypeError('Filter type "%s" not supported!' % filterer.__class__)
+
+
+def filter_gf_trace(gf_trace, filterer, transfer_function=None, padding=0.):
+    """
+    Apply filter and instrument response to a GF trace.
+
+    Parameters
+    ----------
+    gf_trace : :class:`pyrocko.gf.store.GFTrace`
+    filterer : :class:`Filter` or :class:`FrequencyFilter`
+    transfer_function : :class:`pyrocko.trace.PoleZeroResponse`
+        optional, instrument response
+    padding : float
+        [s] the trace is extended with its begin and end values by this
+        duration on both sides before filtering, see
+        :func:`get_prefilter_padding`
+
+    Returns
+    -------
+    :class:`pyrocko.gf.store.GFTrace`, zero outside of the padded trace,
+    as the filter removes constant values
+    """
+    if gf_trace.is_zero:
+        return gf_trace
+
+    deltat = gf_trace.deltat
+    npad = int(num.ceil(padding / deltat))
+
+    # the begin value extends to the infinite past, as it is removed by the
+    # filter, it is subtracted to avoid a step at the start of the trace
+    begin_value = gf_trace.begin_value
+    tr = trace.Trace(
+        tmin=(gf_trace.itmin - npad) * deltat,
+        deltat=deltat,
+        ydata=num.concatenate((
+            num.zeros(npad),
+            gf_trace.data - begin_value,
+            num.full(npad, gf_trace.end_value - begin_value))).astype(
+                num.float64))
+
+    tr = post_process_trace(
+        trace=tr, taper=None, filterer=filterer, outmode='data',
+        transfer_function=transfer_function, demean=False)
+
+    return gf.GFTrace(
+        data=tr.ydata.astype(gf.store.gf_dtype),
+        itmin=int(round(tr.tmin / deltat)),
+        deltat=deltat,
+        begin_value=0.,
+        end_value=0.)
+
+
+def build_prefiltered_store(
+        store_superdir, store_id, filterer, transfer_function=None,
+        force=False):
+    """
+    Build a derived GF store, where the filter and the instrument response
+    are applied to all the GF traces of the store. As both are linear, the
+    synthetics of the derived store do not need to be filtered anymore.
+    Filters are applied without demeaning, so the synthetics differ from the
+    ones of the original store with subsequent filtering at the trace
+    edges.
+
+    Parameters
+    ----------
+    store_superdir : str
+        directory of the GF stores
+    store_id : str
+        of the original GF store
+    filterer : :class:`Filter` or :class:`FrequencyFilter`
+    transfer_function : :class:`pyrocko.trace.PoleZeroResponse`
+        optional, instrument response
+    force : boolean
+        overwrite existing derived store
+
+    Returns
+    -------
+    str of the derived store ID
+    """
+    prefiltered_id = get_prefiltered_store_id(
+        store_id, filterer, transfer_function)
+    store_dir = os.path.join(store_superdir, prefiltered_id)
+
+    if os.path.exists(store_dir):
+        if force:
+            shutil.rmtree(store_dir)
+        else:
+            logger.info(
+                'Prefiltered store %s exists! Use force=True to overwrite!' %
+                prefiltered_id)
+            return prefiltered_id
+
+    store = gf.Store(os.path.join(store_superdir, store_id))
+    config = copy.deepcopy(store.config)
+    config.id = prefiltered_id
+    padding = get_prefilter_padding(filterer)
+
+    logger.info(
+        'Building prefiltered store %s of %s with %i records ...' % (
+            prefiltered_id, store_id, config.nrecords))
+
+    store_dir_incomplete = store_dir + '-incomplete'
+    gf.Store.create(store_dir_incomplete, config=config, force=True)
+    prefiltered = gf.Store(store_dir_incomplete, 'w')
+    try:
+        for args in config.iter_nodes():
+            prefiltered.put(args, filter_gf_trace(
+                store.get(args),
+                filterer=filterer,
+                transfer_function=transfer_function,
+                padding=padding))
+    finally:
+        prefiltered.close()
+        store.close()
+
+    # travel time tables
+    phases_dir = os.path.join(store_superdir, store_id, 'phases')
+    if os.path.exists(phases_dir):
+        prefiltered_phases_dir = os.path.join(store_dir_incomplete, 'phases')
+        util.ensuredir(prefiltered_phases_dir)
+        for fn in os.listdir(phases_dir):
+            shutil.copy(os.path.join(phases_dir, fn), prefiltered_phases_dir)
+
+    shutil.move(store_dir_incomplete, store_dir)
+    return prefiltered_id
+
+
+def seis_construct_prefiltered_gf(
+        seismic_config, seismic_data_path, event, force=False):
+    """
+    Build the prefiltered GF stores of the targets of all included wavemaps
+    from the GF stores of the reference velocity model, see
+    :func:`build_prefiltered_store`.
+
+    Parameters
+    ----------
+    seismic_config : :class:`config.SeismicConfig`
+    seismic_data_path : str
+        absolute path to the seismic data file
+    event : :class:`pyrocko.model.Event`
+    force : boolean
+        overwrite existing derived stores
+    """
+    sc = seismic_config
+    datahandler = init_datahandler(
+        seismic_config=sc,
+        seismic_data_path=seismic_data_path,
+        responses_path=sc.responses_path)
+
+    for wc in sc.waveforms:
+        if not wc.include:
+            continue
+
+        wmap = datahandler.get_waveform_mapping(wc.name, channels=wc.channels)
+        wmap.station_weeding(event, wc.distances, blacklist=wc.blacklist)
+
+        built = set()
+        for target in wmap.targets:
+            prefiltered_id = get_prefiltered_store_id(
+                target.store_id, wc.filterer, target.response)
+            if prefiltered_id not in built:
+                build_prefiltered_store(
+                    store_superdir=sc.gf_config.store_superdir,
+                    store_id=target.store_id,
+                    filterer=wc.filterer,
+                    transfer_function=target.response,
+                    force=force)
+                built.add(prefiltered_id)
+
+
 def init_datahandler(
         seismic_config, seismic_data_path='./', responses_path=None):
     """
@@ -2550,6 +3874,9 @@ def init_wavemap(
         datahandler._deltat)
 
     wmap.station_weeding(event, wc.distances, blacklist=wc.blacklist)
+    if wc.prefiltered_gfs:
+        wmap.prefilter_targets()
+
     wmap.update_interpolation(wc.interpolation)
     wmap._update_trace_wavenames('_'.join([wc.name, str(wmap.mapnumber)]))
 
@@ -2560,7 +3887,8 @@ def init_wavemap(
 
 def post_process_trace(
         trace, taper, filterer, taper_tolerance_factor=0.,
-        outmode=None, chop_bounds=['b', 'c'], transfer_function=None):
+        outmode=None, chop_bounds=['b', 'c'], transfer_function=None,
+        demean=True):
     """
     Taper, filter and then chop one trace in place.
 
@@ -2575,6 +3903,8 @@ def post_process_trace(
     chop_bounds : str
         determines where to chop the trace on the taper attributes
         may be combination of [a, b, c, d]
+    demean : boolean
+        remove the mean of the trace before time-domain filtering
     """
     if transfer_function:
         # convolve invert False deconvolve invert True
@@ -2591,7 +3921,8 @@ def post_process_trace(
             trace.bandpass(
                 corner_hp=filterer.lower_corner,
                 corner_lp=filterer.upper_corner,
-                order=filterer.order)
+                order=filterer.order,
+                demean=demean)
 
         if isinstance(filterer, FrequencyFilter):
             trace = trace.transfer(
@@ -2614,43 +3945,271 @@ def post_process_trace(
     return trace
 
 
-class StackingError(Exception):
-    pass
+def cos_taper_weights(times, a, b, c, d):
+    """
+    Weights of a cosine taper at the given times, as applied by
+    :class:`pyrocko.trace.CosTaper`.
 
+    Parameters
+    ----------
+    times : :class:`numpy.ndarray`
+        [s] times of the samples
+    a, b, c, d : float or :class:`numpy.ndarray`
+        [s] taper times, broadcastable to times
 
-nzeros = {
-    'displacement': 2,
-    'velocity': 3,
-}
+    Returns
+    -------
+    :class:`numpy.ndarray` of weights with the shape of times
+    """
+    weights = num.zeros_like(times)
+    with num.errstate(divide='ignore', invalid='ignore'):
+        fadein = 0.5 - 0.5 * num.cos((times - a) / (b - a) * num.pi)
+        fadeout = 0.5 + 0.5 * num.cos((times - c) / (d - c) * num.pi)
 
+    idxs = (times >= a) & (times < b)
+    weights[idxs] = fadein[idxs]
+    weights[(times >= b) & (times < c)] = 1.
+    idxs = (times >= c) & (times < d)
+    weights[idxs] = fadeout[idxs]
+    return weights
 
-def proto2zpk(magnification, damping, period, quantity='displacement'):
+
+def batch_post_processable(targets, filterer):
     """
-    Convert magnification, damping and period of a station to poles and zeros.
+    Check whether the synthetics of the targets can be post-processed in
+    one batch by :func:`post_process_traces_batch`, i.e. no transfer
+    functions need to be applied.
+    """
+    if filterer is not None and not isinstance(filterer, Filter):
+        return False
+
+    return all(target.response is None for target in targets)
+
+
+def bandpass_batch(data, nsamples, deltat, filterer):
+    """
+    Demean and bandpass filter traces of equal sampling rate that are
+    zero padded to an array, as :meth:`pyrocko.trace.Trace.bandpass` does
+    for each trace.
 
     Parameters
     ----------
-    magnification : float
-        gain of station
-    damping : float
-        in []
-    period : float
-        in [s]
-    quantity : string
-        in which related data are recorded
+    data : :class:`numpy.ndarray`
+        (n_traces, n_samples) zero padded traces
+    nsamples : :class:`numpy.ndarray`
+        of int, number of samples of each trace
+    deltat : float
+        sampling interval [s]
+    filterer : :class:`Filter`
 
     Returns
     -------
-    lists of zeros, poles and gain
+    :class:`numpy.ndarray` (n_traces, n_samples) of filtered traces
     """
-    import cmath
+    # causal filter, samples after the end of a trace do not
+    # influence its filtered samples
+    b, a = butter(
+        filterer.order,
+        [corner * 2. * deltat for corner in (
+            filterer.lower_corner, filterer.upper_corner)],
+        btype='band')
+    data = data - (data.sum(axis=1) / nsamples)[:, num.newaxis]
+    data = lfilter(b, a, data, axis=-1)
+    data[num.arange(data.shape[1]) >= nsamples[:, num.newaxis]] = 0.
+    return data
+
+
+def subsample_shift_batch(data, shifts):
+    """
+    Advance traces of equal sampling rate by fractions of a sample, as a
+    linear phase shift in the frequency domain. The traces are zero padded
+    to avoid wrap around.
 
-    zeros = num.zeros(nzeros[quantity]).tolist()
-    omega0 = 2.0 * num.pi / period
-    preal = - damping * omega0
-    pimag = 1.0J * omega0 * cmath.sqrt(1.0 - damping ** 2)
-    poles = [preal + pimag, preal - pimag]
-    return zeros, poles, magnification
+    Parameters
+    ----------
+    data : :class:`numpy.ndarray`
+        (n_traces, n_samples) zero padded traces
+    shifts : :class:`numpy.ndarray`
+        (n_traces) shifts in samples, the shifted trace i at sample k has
+        the value of the trace at k + shifts[i]
+
+    Returns
+    -------
+    :class:`numpy.ndarray` (n_traces, n_samples) of shifted traces
+    """
+    nsamples = data.shape[1]
+    nfft = trace.nextpow2(2 * nsamples)
+    freqs = num.fft.rfftfreq(nfft)
+
+    spectra = num.fft.rfft(data, n=nfft, axis=1)
+    spectra *= num.exp(
+        2.j * num.pi * freqs[num.newaxis, :] * shifts[:, num.newaxis])
+    return num.fft.irfft(spectra, n=nfft, axis=1)[:, :nsamples]
+
+
+def post_process_traces_batch(
+        traces, tapers, filterer, taper_tolerance_factor=0.,
+        chop_bounds=['b', 'c'], subsample_shift=False):
+    """
+    Filter, taper and then chop traces of equal sampling rate in a few
+    vectorized operations. Equivalent to :func:`post_process_trace` with
+    outmode 'array' and without transfer function, for each trace.
+
+    Parameters
+    ----------
+    traces : list
+        of :class:`pyrocko.trace.Trace`
+    tapers : list
+        of :class:`pyrocko.trace.CosTaper`, one for each trace
+    filterer : :class:`Filter` or None
+    taper_tolerance_factor : float
+        default: 0 , cut exactly at the taper edges
+        taper.fadein times this factor determines added tolerance
+    chop_bounds : str
+        determines where to chop the trace on the taper attributes
+        may be combination of [a, b, c, d]
+    subsample_shift : bool
+        if True, the traces are shifted by fractions of a sample, so that
+        the first sample is exactly at the lower cut time, otherwise the
+        traces are chopped at the nearest samples
+
+    Returns
+    -------
+    :class:`numpy.ndarray` (n_traces, n_samples) of processed traces
+    """
+    deltat = traces[0].deltat
+    deltats = num.array([tr.deltat for tr in traces])
+    if num.abs(deltats - deltat).max() > deltat * 1e-4:
+        raise StackingError('Traces need to have the same sampling rate!')
+
+    ntraces = len(traces)
+    nsamples = num.array([tr.ydata.size for tr in traces])
+    tmins = num.array([tr.tmin for tr in traces])
+
+    data = num.zeros((ntraces, nsamples.max()))
+    for i, tr in enumerate(traces):
+        data[i, :nsamples[i]] = tr.ydata
+
+    if filterer:
+        data = bandpass_batch(data, nsamples, deltat, filterer)
+
+    tapers = num.array(
+        [[taper.a, taper.b, taper.c, taper.d] for taper in tapers])
+    a, b, c, d = [taper_times[:, num.newaxis] for taper_times in tapers.T]
+
+    tolerance = (tapers[:, 1] - tapers[:, 0]) * taper_tolerance_factor
+    lower_cut = tapers[:, 'abcd'.index(chop_bounds[0])] - tolerance
+    upper_cut = tapers[:, 'abcd'.index(chop_bounds[1])] + tolerance
+
+    # sample indexes as of extending with zeros and chopping the traces
+    nlower = num.minimum(
+        0, num.round((lower_cut - tmins) / deltat)).astype('int64')
+    nupper = num.maximum(
+        0, num.round(
+            (upper_cut - tmins - (nsamples - 1) * deltat) / deltat)).astype(
+                'int64')
+    extended_tmins = tmins + nlower * deltat
+    istarts = num.maximum(
+        0, num.floor((lower_cut - extended_tmins) / deltat)).astype('int64')
+    iends = num.minimum(
+        nsamples - nlower + nupper,
+        num.floor((upper_cut - extended_tmins) / deltat)).astype('int64')
+
+    lengths = iends - istarts
+    if (lengths != lengths[0]).any():
+        raise ValueError('Stacking error, traces different lengths!')
+
+    idxs = (nlower + istarts)[:, num.newaxis] + \
+        num.arange(lengths[0])[num.newaxis, :]
+    valid = (idxs >= 0) & (idxs < nsamples[:, num.newaxis])
+
+    if subsample_shift:
+        shifts = (lower_cut - extended_tmins) / deltat - istarts
+        data = subsample_shift_batch(data, shifts)
+    else:
+        shifts = num.zeros(ntraces)
+
+    synths = num.where(
+        valid,
+        data[num.arange(ntraces)[:, num.newaxis],
+             num.clip(idxs, 0, data.shape[1] - 1)],
+        0.)
+    synths *= cos_taper_weights(
+        tmins[:, num.newaxis] + (idxs + shifts[:, num.newaxis]) * deltat,
+        a, b, c, d)
+    return synths
+
+
+class StackingError(Exception):
+    pass
+
+
+nzeros = {
+    'displacement': 2,
+    'velocity': 3,
+}
+
+
+def proto2zpk(magnification, damping, period, quantity='displacement'):
+    """
+    Convert magnification, damping and period of a station to poles and zeros.
+
+    Parameters
+    ----------
+    magnification : float
+        gain of station
+    damping : float
+        in []
+    period : float
+        in [s]
+    quantity : string
+        in which related data are recorded
+
+    Returns
+    -------
+    lists of zeros, poles and gain
+    """
+    import cmath
+
+    zeros = num.zeros(nzeros[quantity]).tolist()
+    omega0 = 2.0 * num.pi / period
+    preal = - damping * omega0
+    pimag = 1.0J * omega0 * cmath.sqrt(1.0 - damping ** 2)
+    poles = [preal + pimag, preal - pimag]
+    return zeros, poles, magnification
+
+
+def process_targets(engine, sources, targets, nprocs=1, static=False):
+    """
+    Calculate the synthetics for all combinations of sources and targets
+    with a single engine call. The GF interpolation is distributed by the
+    engine over nprocs threads.
+
+    Parameters
+    ----------
+    engine : :class:`pyrocko.gf.seismosizer.LocalEngine`
+    sources : list
+        containing :class:`pyrocko.gf.seismosizer.Source` Objects
+    targets : list
+        containing :class:`pyrocko.gf.seismosizer.Target` Objects
+    nprocs : int
+        number of threads
+    static : boolean
+        if True, the targets are static targets
+
+    Returns
+    -------
+    list of :class:`pyrocko.trace.Trace` or static results, ordered as
+    the results of the engine response, i.e. for each source for each
+    target
+    """
+    response = engine.process(
+        sources=sources, targets=targets, nthreads=nprocs)
+
+    if static:
+        return list(response.static_results())
+    else:
+        return [tr for _, _, tr in response.iter_results()]
 
 
 def seis_synthetics(
@@ -2680,8 +4239,7 @@ def seis_synthetics(
     plot : boolean
         flag for looking at traces
     nprocs : int
-        number of processors to use for synthetics calculation
-        --> currently no effect !!!
+        number of threads the engine uses for the synthetics calculation
     outmode : string
         output format of synthetics can be 'array', 'stacked_traces',
         'data' returns traces unstacked including post-processing
@@ -2712,10 +4270,16 @@ def seis_synthetics(
             'Outmode "%s" not available! Available: %s' % (
                 outmode, utility.list2string(stackmodes)))
 
-    if not arrival_times.all():
+    if arrival_times is None or not arrival_times.all():
         arrival_times = num.zeros((len(targets)), dtype=tconfig.floatX)
         arrival_times[:] = None
 
+    if arrival_taper and num.isnan(arrival_times).any():
+        logger.warning('Using source reference for tapering!')
+        arrival_times = get_phase_arrival_times(
+            engine=engine, source=sources[0], targets=targets,
+            wavename=wavename)
+
     taperers = []
     tapp = taperers.append
     for i, target in enumerate(targets):
@@ -2732,39 +4296,40 @@ def seis_synthetics(
         for t, taperer in zip(targets, taperers):
             t.update_target_times(sources, taperer)
 
+    nt = len(targets)
+    ns = len(sources)
+
     t_2 = time()
-    response = engine.process(
-        sources=sources,
-        targets=targets, nprocs=nprocs)
+    synt_trcs = process_targets(
+        engine=engine, sources=sources, targets=targets, nprocs=nprocs)
     t_1 = time()
 
     logger.debug('Synthetics generation time: %f' % (t_1 - t_2))
-    # logger.debug('Details: %s \n' % response.stats)
 
-    nt = len(targets)
-    ns = len(sources)
+    if arrival_taper and outmode == 'array' and not plot:
+        return post_process_synthetics(
+            traces=synt_trcs,
+            targets=targets,
+            taperers=taperers,
+            filterer=filterer,
+            taper_tolerance_factor=taper_tolerance_factor,
+            chop_bounds=chop_bounds)
 
     t0 = time()
-    synt_trcs = []
-    sapp = synt_trcs.append
-    taper_index = [j for _ in range(ns) for j in range(nt)]
-
-    for i, (source, target, tr) in enumerate(response.iter_results()):
+    for i, tr in enumerate(synt_trcs):
         if arrival_taper:
-            taper = taperers[taper_index[i]]
+            taper = taperers[i % nt]
         else:
             taper = None
 
-        tr = post_process_trace(
+        synt_trcs[i] = post_process_trace(
             trace=tr,
             taper=taper,
             filterer=filterer,
             taper_tolerance_factor=taper_tolerance_factor,
             outmode=outmode,
             chop_bounds=chop_bounds,
-            transfer_function=target.response)
-
-        sapp(tr)
+            transfer_function=targets[i % nt].response)
 
     t1 = time()
     logger.debug('Post-process time %f' % (t1 - t0))
@@ -2831,6 +4396,524 @@ def seis_synthetics(
         raise TypeError('Outmode %s not supported!' % outmode)
 
 
+def post_process_synthetics(
+        traces, targets, taperers, filterer=None, taper_tolerance_factor=0.,
+        chop_bounds=['b', 'c']):
+    """
+    Taper, filter and stack the synthetic traces of the source-target
+    combinations of an engine response to an array of synthetics.
+
+    Parameters
+    ----------
+    traces : list
+        of :class:`pyrocko.trace.Trace` for all sources and targets, ordered
+        as the results of the engine response
+    targets : list
+        containing :class:`pyrocko.gf.seismosizer.Target` Objects
+    taperers : list
+        of :class:`pyrocko.trace.CosTaper` for each target
+    filterer : :class:`Filterer`
+    taper_tolerance_factor : float
+        tolerance to chop traces around taper.a and taper.d
+    chop_bounds : list  of str
+        determines where to chop the trace on the taper attributes
+        may be combination of [a, b, c, d]
+
+    Returns
+    -------
+    :class:`numpy.ndarray` synthetics (n_targets x nsamples) stacked for all
+    sources and :class:`numpy.ndarray` of tmins for traces
+    """
+    nt = len(targets)
+    ns = len(traces) // nt
+
+    t0 = time()
+    if batch_post_processable(targets, filterer):
+        synths = post_process_traces_batch(
+            traces=traces,
+            tapers=taperers * ns,
+            filterer=filterer,
+            taper_tolerance_factor=taper_tolerance_factor,
+            chop_bounds=chop_bounds)
+    else:
+        synt_trcs = [
+            post_process_trace(
+                trace=tr,
+                taper=taperers[i % nt],
+                filterer=filterer,
+                taper_tolerance_factor=taper_tolerance_factor,
+                outmode='array',
+                chop_bounds=chop_bounds,
+                transfer_function=targets[i % nt].response)
+            for i, tr in enumerate(traces)]
+
+        try:
+            synths = num.vstack([tr.ydata for tr in synt_trcs])
+        except ValueError:
+            raise ValueError('Stacking error, traces different lengths!')
+
+    # stack traces for all sources
+    outstack = synths.reshape((ns, nt, -1)).sum(axis=0)
+    t1 = time()
+    logger.debug('Post-process and stack time %f' % (t1 - t0))
+
+    tmins = num.array([getattr(at, chop_bounds[0]) for at in taperers])
+    return outstack, tmins
+
+
+def filter_synthetics(traces, targets, filterer=None):
+    """
+    Apply the transfer functions of the targets and the filterer to the
+    synthetic traces of the source-target combinations of an engine
+    response, without tapering and chopping. The traces can be windowed
+    afterwards for any arrival times with :func:`window_synthetics`.
+
+    Parameters
+    ----------
+    traces : list
+        of :class:`pyrocko.trace.Trace` for all sources and targets, ordered
+        as the results of the engine response
+    targets : list
+        containing :class:`pyrocko.gf.seismosizer.Target` Objects
+    filterer : :class:`Filterer`
+
+    Returns
+    -------
+    list of filtered :class:`pyrocko.trace.Trace`
+    """
+    nt = len(targets)
+    if not batch_post_processable(targets, filterer):
+        return [
+            post_process_trace(
+                trace=tr.copy(),
+                taper=None,
+                filterer=filterer,
+                transfer_function=targets[i % nt].response)
+            for i, tr in enumerate(traces)]
+
+    elif filterer is None:
+        return traces
+
+    nsamples = num.array([tr.ydata.size for tr in traces])
+    data = num.zeros((len(traces), nsamples.max()))
+    for i, tr in enumerate(traces):
+        data[i, :nsamples[i]] = tr.ydata
+
+    data = bandpass_batch(data, nsamples, traces[0].deltat, filterer)
+
+    filtered_traces = []
+    for i, tr in enumerate(traces):
+        filtered_trace = tr.copy(data=False)
+        filtered_trace.set_ydata(data[i, :nsamples[i]])
+        filtered_traces.append(filtered_trace)
+
+    return filtered_traces
+
+
+def window_synthetics(
+        traces, taperers, taper_tolerance_factor=0., chop_bounds=['b', 'c'],
+        subsample_shift=False):
+    """
+    Taper, chop and stack filtered synthetic traces of the source-target
+    combinations of an engine response, see :func:`filter_synthetics`.
+    The traces are not modified.
+
+    Parameters
+    ----------
+    traces : list
+        of filtered :class:`pyrocko.trace.Trace` for all sources and targets,
+        ordered as the results of the engine response
+    taperers : list
+        of :class:`pyrocko.trace.CosTaper` for each target
+    taper_tolerance_factor : float
+        tolerance to chop traces around taper.a and taper.d
+    chop_bounds : list  of str
+        determines where to chop the trace on the taper attributes
+        may be combination of [a, b, c, d]
+    subsample_shift : bool
+        if True, the traces are windowed exactly at the taper times by
+        shifting them by fractions of a sample, see
+        :func:`post_process_traces_batch`
+
+    Returns
+    -------
+    :class:`numpy.ndarray` synthetics (n_targets x nsamples) stacked for all
+    sources and :class:`numpy.ndarray` of tmins for traces
+    """
+    nt = len(taperers)
+    ns = len(traces) // nt
+
+    synths = post_process_traces_batch(
+        traces=traces,
+        tapers=taperers * ns,
+        filterer=None,
+        taper_tolerance_factor=taper_tolerance_factor,
+        chop_bounds=chop_bounds,
+        subsample_shift=subsample_shift)
+
+    outstack = synths.reshape((ns, nt, -1)).sum(axis=0)
+    tmins = num.array([getattr(at, chop_bounds[0]) for at in taperers])
+    return outstack, tmins
+
+
+def seis_synthetics_wavemaps(
+        engine, sources, targets_list, arrival_tapers, wavenames,
+        filterers, arrival_times_list=None, nprocs=1,
+        taper_tolerance_factor=0., chop_bounds=['b', 'c']):
+    """
+    Calculate synthetic seismograms for the targets of several waveform
+    mappings (e.g. P on Z and S on T components) with a single call to the
+    engine. The results are split and post-processed for each waveform
+    mapping as in :func:`seis_synthetics` with outmode 'array'.
+
+    Parameters
+    ----------
+    engine : :class:`pyrocko.gf.seismosizer.LocalEngine`
+    sources : list
+        containing :class:`pyrocko.gf.seismosizer.Source` Objects
+        reference source is the first in the list!!!
+    targets_list : list
+        of lists containing :class:`pyrocko.gf.seismosizer.Target` Objects,
+        one list for each waveform mapping
+    arrival_tapers : list
+        of :class:`ArrivalTaper`, one for each waveform mapping
+    wavenames : list
+        of strings of the tabulated phases that determine the phase arrivals
+    filterers : list
+        of :class:`Filterer`, one for each waveform mapping
+    arrival_times_list : None or list
+        of :class:`numpy.NdArray` of phase arrival times to apply tapers,
+        one for each waveform mapping, if None theoretic arrival of ray
+        tracing used
+    nprocs : int
+        number of threads the engine uses for the synthetics calculation
+    taper_tolerance_factor : float
+        tolerance to chop traces around taper.a and taper.d
+    chop_bounds : list  of str
+        determines where to chop the trace on the taper attributes
+        may be combination of [a, b, c, d]
+
+    Returns
+    -------
+    list of tuples of :class:`numpy.ndarray` synthetics (n_targets x nsamples)
+        and :class:`numpy.ndarray` of tmins for traces, one tuple for each
+        waveform mapping
+    """
+    if arrival_times_list is None:
+        arrival_times_list = [None] * len(targets_list)
+
+    taperers_list = []
+    for targets, arrival_taper, wavename, arrival_times in zip(
+            targets_list, arrival_tapers, wavenames, arrival_times_list):
+        if arrival_times is None or num.isnan(arrival_times).any():
+            arrival_times = get_phase_arrival_times(
+                engine=engine, source=sources[0], targets=targets,
+                wavename=wavename)
+
+        taperers_list.append([get_phase_taperer(
+            engine=engine,
+            source=sources[0],
+            wavename=wavename,
+            target=target,
+            arrival_taper=arrival_taper,
+            arrival_time=arrival_times[j])
+            for j, target in enumerate(targets)])
+
+    all_targets = [target for targets in targets_list for target in targets]
+
+    t_2 = time()
+    traces = process_targets(
+        engine=engine, sources=sources, targets=all_targets, nprocs=nprocs)
+    t_1 = time()
+
+    logger.debug('Synthetics generation time: %f' % (t_1 - t_2))
+
+    nt = len(all_targets)
+    target_offsets = num.cumsum(
+        [0] + [len(targets) for targets in targets_list])
+
+    results = []
+    for i, (targets, taperers, filterer) in enumerate(
+            zip(targets_list, taperers_list, filterers)):
+        results.append(post_process_synthetics(
+            traces=[
+                traces[k * nt + j] for k in range(len(sources))
+                for j in range(target_offsets[i], target_offsets[i + 1])],
+            targets=targets,
+            taperers=taperers,
+            filterer=filterer,
+            taper_tolerance_factor=taper_tolerance_factor,
+            chop_bounds=chop_bounds))
+
+    return results
+
+
+def seis_synthetics_population(
+        engine, sources_population, targets, arrival_taper,
+        wavename='any_P', filterer=None, nprocs=1,
+        taper_tolerance_factor=0., arrival_times_population=None,
+        chop_bounds=['b', 'c'], subsample_shift=False):
+    """
+    Calculate synthetic seismograms for a population of source
+    configurations (e.g. the proposals of all SMC chains) with a single call
+    to the engine. Tapering, filtering and stacking is done as in
+    :func:`seis_synthetics` with outmode 'array'.
+
+    Parameters
+    ----------
+    engine : :class:`pyrocko.gf.seismosizer.LocalEngine`
+    sources_population : list
+        of lists containing :class:`pyrocko.gf.seismosizer.Source` Objects,
+        one list of sources for each member of the population,
+        reference source is the first in each list!!!
+    targets : list
+        containing :class:`pyrocko.gf.seismosizer.Target` Objects
+    arrival_taper : :class:`ArrivalTaper`
+    wavename : string
+        of the tabulated phase that determines the phase arrival
+    filterer : :class:`Filterer`
+    nprocs : int
+        number of threads the engine uses for the synthetics calculation
+    taper_tolerance_factor : float
+        tolerance to chop traces around taper.a and taper.d
+    arrival_times_population : None or list
+        of :class:`numpy.NdArray` of phase arrival times to apply taper,
+        one for each member of the population, if None theoretic arrival
+        of ray tracing used
+    chop_bounds : list  of str
+        determines where to chop the trace on the taper attributes
+        may be combination of [a, b, c, d]
+    subsample_shift : bool
+        if True, the traces are windowed exactly at the taper times by
+        shifting them by fractions of a sample, see
+        :func:`post_process_traces_batch`
+
+    Returns
+    -------
+    list of tuples of :class:`numpy.ndarray` synthetics (n_targets x nsamples)
+        and :class:`numpy.ndarray` of tmins for traces, one tuple for each
+        member of the population
+    """
+    if arrival_times_population is not None:
+        arrival_times_population = [
+            [arrival_times] for arrival_times in arrival_times_population]
+
+    results = seis_synthetics_population_wavemaps(
+        engine=engine,
+        sources_population=sources_population,
+        targets_list=[targets],
+        arrival_tapers=[arrival_taper],
+        wavenames=[wavename],
+        filterers=[filterer],
+        nprocs=nprocs,
+        taper_tolerance_factor=taper_tolerance_factor,
+        arrival_times_population=arrival_times_population,
+        chop_bounds=chop_bounds,
+        subsample_shift=subsample_shift)
+
+    return [wresults[0] for wresults in results]
+
+
+def seis_synthetics_population_wavemaps(
+        engine, sources_population, targets_list, arrival_tapers,
+        wavenames, filterers, nprocs=1, taper_tolerance_factor=0.,
+        arrival_times_population=None, chop_bounds=['b', 'c'],
+        subsample_shift=False):
+    """
+    Calculate synthetic seismograms for a population of source
+    configurations and the targets of several waveform mappings with a
+    single call to the engine. The results are split and post-processed
+    for each waveform mapping as in :func:`seis_synthetics_population`.
+
+    Parameters
+    ----------
+    engine : :class:`pyrocko.gf.seismosizer.LocalEngine`
+    sources_population : list
+        of lists containing :class:`pyrocko.gf.seismosizer.Source` Objects,
+        one list of sources for each member of the population,
+        reference source is the first in each list!!!
+    targets_list : list
+        of lists containing :class:`pyrocko.gf.seismosizer.Target` Objects,
+        one list for each waveform mapping
+    arrival_tapers : list
+        of :class:`ArrivalTaper`, one for each waveform mapping
+    wavenames : list
+        of strings of the tabulated phases that determine the phase arrivals
+    filterers : list
+        of :class:`Filterer`, one for each waveform mapping
+    nprocs : int
+        number of threads to use for synthetics calculation
+    taper_tolerance_factor : float
+        tolerance to chop traces around taper.a and taper.d
+    arrival_times_population : None or list
+        for each member of the population of lists of
+        :class:`numpy.NdArray` of phase arrival times to apply tapers,
+        one for each waveform mapping, if None theoretic arrival of ray
+        tracing used
+    chop_bounds : list  of str
+        determines where to chop the trace on the taper attributes
+        may be combination of [a, b, c, d]
+    subsample_shift : bool
+        if True, the traces are windowed exactly at the taper times by
+        shifting them by fractions of a sample, see
+        :func:`post_process_traces_batch`
+
+    Returns
+    -------
+    list of lists of tuples of :class:`numpy.ndarray` synthetics
+        (n_targets x nsamples) and :class:`numpy.ndarray` of tmins for
+        traces, for each member of the population and waveform mapping
+    """
+    if any(arrival_taper is None for arrival_taper in arrival_tapers):
+        raise StackingError(
+            'Arrival taper has to be defined for population synthetics!')
+
+    nwavemaps = len(targets_list)
+    npop = len(sources_population)
+
+    if arrival_times_population is None:
+        arrival_times_population = [[None] * nwavemaps] * npop
+
+    taperers_population = []
+    source_indexes = []
+    all_sources = []
+    for i, (sources, arrival_times_list) in enumerate(
+            zip(sources_population, arrival_times_population)):
+        taperers_list = []
+        for targets, arrival_taper, wavename, arrival_times in zip(
+                targets_list, arrival_tapers, wavenames, arrival_times_list):
+            if arrival_times is None or num.isnan(arrival_times).any():
+                arrival_times = get_phase_arrival_times(
+                    engine=engine, source=sources[0], targets=targets,
+                    wavename=wavename)
+
+            taperers_list.append([get_phase_taperer(
+                engine=engine,
+                source=sources[0],
+                wavename=wavename,
+                target=target,
+                arrival_taper=arrival_taper,
+                arrival_time=arrival_times[j])
+                for j, target in enumerate(targets)])
+
+        taperers_population.append(taperers_list)
+        source_indexes.extend([i] * len(sources))
+        all_sources.extend(sources)
+
+    all_targets = [target for targets in targets_list for target in targets]
+
+    t_2 = time()
+    traces = process_targets(
+        engine=engine, sources=all_sources, targets=all_targets,
+        nprocs=nprocs)
+    t_1 = time()
+
+    logger.debug(
+        'Population synthetics generation time: %f' % (t_1 - t_2))
+
+    nt = len(all_targets)
+    target_offsets = num.cumsum(
+        [0] + [len(targets) for targets in targets_list])
+
+    results = [[] for _ in range(npop)]
+    for w, (targets, filterer) in enumerate(zip(targets_list, filterers)):
+        wresults = _post_process_population(
+            traces=[
+                traces[k * nt + j] for k in range(len(all_sources))
+                for j in range(target_offsets[w], target_offsets[w + 1])],
+            targets=targets,
+            taperers_population=[
+                taperers_list[w] for taperers_list in taperers_population],
+            source_indexes=source_indexes,
+            filterer=filterer,
+            taper_tolerance_factor=taper_tolerance_factor,
+            chop_bounds=chop_bounds,
+            subsample_shift=subsample_shift)
+
+        for result, wresult in zip(results, wresults):
+            result.append(wresult)
+
+    return results
+
+
+def _post_process_population(
+        traces, targets, taperers_population, source_indexes, filterer,
+        taper_tolerance_factor, chop_bounds, subsample_shift):
+    """
+    Taper, filter and stack the traces of the sources of a population for
+    one waveform mapping. The traces are ordered by source, then target.
+    """
+    nt = len(targets)
+    npop = len(taperers_population)
+
+    t0 = time()
+    if subsample_shift:
+        # windowing of filtered traces is always vectorized
+        traces = filter_synthetics(
+            traces=traces, targets=targets, filterer=filterer)
+        filterer = None
+
+    if subsample_shift or batch_post_processable(targets, filterer):
+        tapers = [
+            taperers_population[source_indexes[i // nt]][i % nt]
+            for i in range(len(traces))]
+
+        synths = post_process_traces_batch(
+            traces=traces,
+            tapers=tapers,
+            filterer=filterer,
+            taper_tolerance_factor=taper_tolerance_factor,
+            chop_bounds=chop_bounds,
+            subsample_shift=subsample_shift)
+
+        outstacks = [num.zeros((nt, synths.shape[1])) for _ in range(npop)]
+        for k, i in enumerate(range(0, synths.shape[0], nt)):
+            outstacks[source_indexes[k]] += synths[i:i + nt]
+
+        t1 = time()
+        logger.debug('Population batch post-process time %f' % (t1 - t0))
+
+        return [(outstack, num.array(
+                    [getattr(at, chop_bounds[0]) for at in taperers]))
+                for outstack, taperers in zip(
+                    outstacks, taperers_population)]
+
+    outstacks = [None] * npop
+    for i, tr in enumerate(traces):
+        ipop = source_indexes[i // nt]
+        itarget = i % nt
+        target = targets[itarget]
+
+        tr = post_process_trace(
+            trace=tr,
+            taper=taperers_population[ipop][itarget],
+            filterer=filterer,
+            taper_tolerance_factor=taper_tolerance_factor,
+            outmode='array',
+            chop_bounds=chop_bounds,
+            transfer_function=target.response)
+
+        if outstacks[ipop] is None:
+            outstacks[ipop] = num.zeros((nt, tr.ydata.size))
+
+        try:
+            outstacks[ipop][itarget, :] += tr.ydata
+        except ValueError:
+            raise ValueError(
+                'Stacking error, traces different lengths! Population'
+                ' member %i, target %i' % (ipop, itarget))
+
+    t1 = time()
+    logger.debug('Population post-process time %f' % (t1 - t0))
+
+    results = []
+    for outstack, taperers in zip(outstacks, taperers_population):
+        tmins = num.array([getattr(at, chop_bounds[0]) for at in taperers])
+        results.append((outstack, tmins))
+
+    return results
+
+
 def geo_synthetics(
         engine, targets, sources, outmode='stacked_array', plot=False,
         nprocs=1):
@@ -2841,6 +4924,7 @@ def geo_synthetics(
     Parameters
     ----------
     engine : :class:`pyrocko.gf.seismosizer.LocalEngine`
+        or :class:`beat.okada.OkadaEngine`
     sources : list
         containing :class:`pyrocko.gf.seismosizer.Source` Objects
         reference source is the first in the list!!!
@@ -2849,8 +4933,7 @@ def geo_synthetics(
     plot : boolean
         flag for looking at synthetics - not implemented yet
     nprocs : int
-        number of processors to use for synthetics calculation
-        --> currently no effect !!!
+        number of threads the engine uses for the synthetics calculation
     outmode : string
         output format of synthetics can be: 'array', 'arrays',
         'stacked_array','stacked_arrays'
@@ -2865,7 +4948,9 @@ def geo_synthetics(
     :class:`numpy.ndarray` (target.samples; ux-North, uy-East, uz-Down)
     """
 
-    response = engine.process(sources, targets)
+    results = process_targets(
+        engine=engine, sources=sources, targets=targets, nprocs=nprocs,
+        static=True)
     ns = len(sources)
     nt = len(targets)
 
@@ -2884,7 +4969,7 @@ def geo_synthetics(
 
     disp_arrays = []
     dapp = disp_arrays.append
-    for sresult in response.static_results():
+    for sresult in results:
         n = sresult.result['displacement.n']
         e = sresult.result['displacement.e']
         u = -sresult.result['displacement.d']
@@ -2906,6 +4991,58 @@ def geo_synthetics(
         raise ValueError('Outmode %s not available' % outmode)
 
 
+def geo_synthetics_population(
+        engine, targets, sources_population, nprocs=1):
+    """
+    Calculate synthetic displacements for a population of source
+    configurations (e.g. the proposals of all SMC chains) with a single call
+    to the engine.
+
+    Parameters
+    ----------
+    engine : :class:`pyrocko.gf.seismosizer.LocalEngine`
+    targets : list
+        containing :class:`pyrocko.gf.targets.StaticTarget` Objects
+    sources_population : list
+        of lists containing :class:`pyrocko.gf.seismosizer.Source` Objects,
+        one list of sources for each member of the population
+    nprocs : int
+        number of threads the engine uses for the synthetics calculation
+
+    Returns
+    -------
+    list of :class:`numpy.ndarray` (n_observations; ux-North, uy-East,
+    uz-Down), stacked displacements for each member of the population
+    """
+    all_sources = []
+    source_indexes = []
+    for i, sources in enumerate(sources_population):
+        source_indexes.extend([i] * len(sources))
+        all_sources.extend(sources)
+
+    results = process_targets(
+        engine=engine, sources=all_sources, targets=targets, nprocs=nprocs,
+        static=True)
+
+    nt = len(targets)
+    target_offsets = num.cumsum(
+        [0] + [target.lons.size for target in targets])
+
+    outstacks = [
+        num.zeros((target_offsets[-1], 3)) for _ in sources_population]
+
+    for i, sresult in enumerate(results):
+        ipop = source_indexes[i // nt]
+        itarget = i % nt
+        slc = slice(target_offsets[itarget], target_offsets[itarget + 1])
+
+        outstacks[ipop][slc, 0] += sresult.result['displacement.n']
+        outstacks[ipop][slc, 1] += sresult.result['displacement.e']
+        outstacks[ipop][slc, 2] -= sresult.result['displacement.d']
+
+    return outstacks
+
+
 def taper_filter_traces(
         traces, arrival_taper=None, filterer=None,
         arrival_times=None, plot=False, outmode='array',
@@ -2976,6 +5113,123 @@ def taper_filter_traces(
         return cut_traces
 
 
+def spectral_basis(nsamples, deltat, fmin=0., fmax=None):
+    """
+    Real, orthonormal Fourier basis of a time window of given length
+    restricted to the frequencies within a band. The coefficients of a
+    trace are its cosine and sine transform at these frequencies, i.e. the
+    real and imaginary parts of the normalised DFT.
+
+    Parameters
+    ----------
+    nsamples : int
+        number of samples of the time window
+    deltat : float
+        sampling interval [s]
+    fmin : float
+        lowest frequency [Hz] in the band
+    fmax : float
+        highest frequency [Hz] in the band, if None up to Nyquist
+
+    Returns
+    -------
+    :class:`numpy.ndarray` of size (nsamples, coefficients)
+    """
+    freqs = num.fft.rfftfreq(nsamples, d=deltat)
+    if fmax is None:
+        fmax = freqs[-1]
+
+    idxs = num.where((freqs >= fmin) & (freqs <= fmax))[0]
+    if idxs.size == 0:
+        raise ValueError(
+            'No frequencies of the %i samples window with sampling interval'
+            ' %f [s] within the band %f - %f [Hz]!' % (
+                nsamples, deltat, fmin, fmax))
+
+    phases = 2. * num.pi * num.outer(num.arange(nsamples), idxs) / nsamples
+
+    # zero frequency and nyquist have no sine part
+    real = (idxs == 0) | (2 * idxs == nsamples)
+    norms = num.where(
+        real, num.sqrt(1. / nsamples), num.sqrt(2. / nsamples))
+
+    return num.hstack((
+        num.cos(phases) * norms,
+        num.sin(phases[:, ~real]) * norms[~real])).astype(tconfig.floatX)
+
+
+def get_group_operator(groups):
+    """
+    Get the operator that sums the samples of groups normalised by the
+    square root of the group sizes, i.e. it has orthonormal columns.
+
+    Parameters
+    ----------
+    groups : :class:`numpy.ndarray`
+        of int, group index of each sample
+
+    Returns
+    -------
+    :class:`numpy.ndarray` of size (samples, groups)
+    """
+    _, groups = num.unique(groups, return_inverse=True)
+    counts = num.bincount(groups)
+
+    operator = num.zeros((groups.size, counts.size), dtype=tconfig.floatX)
+    operator[num.arange(groups.size), groups] = 1. / num.sqrt(counts[groups])
+    return operator
+
+
+def decimation_operator(nsamples, factor):
+    """
+    Get the operator that decimates a time window by averaging blocks of
+    samples.
+
+    Parameters
+    ----------
+    nsamples : int
+        number of samples of the time window
+    factor : int
+        number of samples of a block
+
+    Returns
+    -------
+    :class:`numpy.ndarray` of size (nsamples, ceil(nsamples / factor))
+    """
+    return get_group_operator(num.arange(nsamples) // int(factor))
+
+
+def spatial_decimation_operator(north_shifts, east_shifts, factor):
+    """
+    Get the operator that decimates scattered data points by averaging the
+    points within the cells of a regular grid. The cell size is chosen
+    such that on average factor points fall into a cell.
+
+    Parameters
+    ----------
+    north_shifts : :class:`numpy.ndarray`
+        local coordinates [m] of the points
+    east_shifts : :class:`numpy.ndarray`
+        local coordinates [m] of the points
+    factor : float
+        average number of points per cell
+
+    Returns
+    -------
+    :class:`numpy.ndarray` of size (points, cells)
+    """
+    nmin, emin = north_shifts.min(), east_shifts.min()
+    area = (north_shifts.max() - nmin) * (east_shifts.max() - emin)
+    cell_size = num.sqrt(area * factor / north_shifts.size)
+    if cell_size == 0.:
+        return get_group_operator(num.zeros(north_shifts.size, dtype='int'))
+
+    icells_north = ((north_shifts - nmin) // cell_size).astype('int64')
+    icells_east = ((east_shifts - emin) // cell_size).astype('int64')
+    return get_group_operator(
+        icells_north * (icells_east.max() + 1) + icells_east)
+
+
 def check_problem_stores(problem, datatypes):
     """
     Check GF stores for empty traces.
@@ -107,9 +107,19 @@ def load_SAR_data(datadir, names):
     return diffgs
 
 
-def load_kite_scenes(datadir, names):
+def load_kite_scenes(datadir, names, covariance_taper=None):
     """
     Load SAR data from the kite format.
+
+    Parameters
+    ----------
+    datadir : str
+        directory of the kite scenes
+    names : list
+        of str, filenames of the kite scenes
+    covariance_taper : :class:`config.GeodeticCovarianceTaperConfig`
+        optional, if given the data-covariances are imported as
+        :class:`heart.TaperedCovariance`
     """
     try:
         from kite import Scene
@@ -122,7 +132,8 @@ def load_kite_scenes(datadir, names):
     for k in names:
         try:
             sc = Scene.load(os.path.join(datadir, k))
-            diffgs.append(heart.DiffIFG.from_kite_scene(sc))
+            diffgs.append(heart.DiffIFG.from_kite_scene(
+                sc, covariance_taper=covariance_taper))
             tobeloaded_names.discard(k)
         except ImportError:
             logger.warning('File %s not conform with kite format!' % k)
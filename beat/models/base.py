@@ -63,6 +63,19 @@ class Composite(object):
             var for var in varnames
             if var in bconfig.static_dist_vars]
 
+    def set_resolution(self, factor):
+        """
+        Set the resolution of the datasets in the misfit. Composites that
+        support reduced resolutions update their weights (in place).
+
+        Parameters
+        ----------
+        factor : int
+            decimation factor of the datasets, 1 for full resolution
+        """
+        logger.debug(
+            'Composite "%s" does not support reduced resolution.' % self.name)
+
     def get_hyper_formula(self, hyperparams):
         """
         Get likelihood formula for the hyper model built. Has to be called
@@ -107,8 +120,8 @@ def sample(step, problem):
     Parameters
     ----------
 
-    step : :class:`SMC` or :class:`pymc3.metropolis.Metropolis`
-        from problem.init_sampler()
+    step : :class:`SMC`, :class:`Metropolis` or
+        :class:`HamiltonianMonteCarlo` from problem.init_sampler()
     problem : :class:`Problem` with characteristics of problem to solve
     """
     pc = problem.config.problem_config
@@ -139,8 +152,8 @@ def sample(step, problem):
     else:
         start = None
 
-    if sc.name == 'Metropolis':
-        logger.info('... Starting Metropolis ...\n')
+    if sc.name in ['Metropolis', 'HMC']:
+        logger.info('... Starting %s ...\n' % sc.name)
 
         ensuredir(problem.outfolder)
 
@@ -161,6 +174,36 @@ def sample(step, problem):
     elif sc.name == 'SMC':
         logger.info('... Starting SMC ...\n')
 
+        if pa.adaptive_n_steps:
+            stage_controller = sampler.StageLengthController(
+                min_steps=pa.min_n_steps,
+                max_steps=pa.max_n_steps,
+                decorrelation_factor=pa.decorrelation_factor)
+        else:
+            stage_controller = None
+
+        if pa.resolution_factors:
+            resolution = sampler.ResolutionSchedule(
+                problem,
+                factors=pa.resolution_factors,
+                betas=pa.resolution_betas)
+        else:
+            resolution = None
+
+        if pa.emulator != 'none':
+            emulator = sampler.LikelihoodEmulator(
+                step,
+                likelihood_names=[
+                    composite._like_name
+                    for composite in problem.composites.values()
+                    if composite._like_name is not None],
+                mode=pa.emulator,
+                exact_stages=pa.emulator_exact_stages,
+                emulator=sampler.GaussianProcessEmulator(
+                    max_samples=pa.emulator_max_samples))
+        else:
+            emulator = None
+
         sampler.smc_sample(
             pa.n_steps,
             step=step,
@@ -173,7 +216,12 @@ def sample(step, problem):
             buffer_thinning=sc.buffer_thinning,
             homepath=problem.outfolder,
             buffer_size=sc.buffer_size,
-            rm_flag=pa.rm_flag)
+            rm_flag=pa.rm_flag,
+            population_batch=pa.population_batch,
+            prefetch=problem.prefetch_synthetics,
+            stage_controller=stage_controller,
+            emulator=emulator,
+            resolution=resolution)
 
     elif sc.name == 'PT':
         logger.info('... Starting Parallel Tempering ...\n')
@@ -193,7 +241,8 @@ def sample(step, problem):
             model=problem.model,
             resample=pa.resample,
             rm_flag=pa.rm_flag,
-            record_worker_chains=pa.record_worker_chains)
+            record_worker_chains=pa.record_worker_chains,
+            communicator=pa.communicator)
 
     else:
         logger.error('Sampler "%s" not implemented.' % sc.name)
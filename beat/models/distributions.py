@@ -7,6 +7,7 @@ from theano import shared
 from theano import config as tconfig
 
 from beat.utility import Counter
+from beat.theanof import ToeplitzQuadraticForm
 
 
 logger = getLogger('distributions')
@@ -18,6 +19,8 @@ log_2pi = num.log(2 * num.pi)
 __all__ = [
     'multivariate_normal',
     'multivariate_normal_chol',
+    'multivariate_normal_spectral',
+    'multivariate_normal_toeplitz',
     'hyper_normal',
     'get_hyper_name']
 
@@ -74,7 +77,10 @@ def multivariate_normal_chol(
     """
     Calculate posterior Likelihood of a Multivariate Normal distribution.
     Assumes weights to be the inverse cholesky decomposed lower triangle
-    of the Covariance matrix.
+    of the Covariance matrix. For reduced (e.g. decimated) data, the
+    weights may be rectangular, i.e. the inverse cholesky decomposition of
+    the reduced Covariance matrix times the transposed reduction operator,
+    the number of observations is given by the number of rows.
     Can only be executed in a `with model context`.
 
     Parameters
@@ -115,8 +121,7 @@ def multivariate_normal_chol(
     count = Counter()
 
     for l, data in enumerate(datasets):
-        M = tt.cast(shared(
-            data.samples, name='nsamples', borrow=True), 'int16')
+        M = tt.cast(weights[l].shape[0], tconfig.floatX)
         hp_name = get_hyper_name(data)
 
         if hp_specific:
@@ -137,6 +142,117 @@ def multivariate_normal_chol(
     return logpts
 
 
+def multivariate_normal_spectral(
+        datasets, weights, hyperparams, residuals, hp_specific=False):
+    """
+    Calculate posterior Likelihood of a Multivariate Normal distribution
+    of residuals given as coefficients of an orthonormal basis, e.g. the
+    in-band spectral coefficients of seismic traces.
+    Assumes the coefficients to be uncorrelated and the weights to be
+    their inverse standard deviations.
+    Can only be executed in a `with model context`.
+
+    Parameters
+    ----------
+    datasets : list
+        of :class:`heart.SeismicDataset`
+    weights : list
+        of :class:`theano.shared`
+        Vectors of the inverse standard deviations of the coefficients
+    hyperparams : dict
+        of :class:`theano.`
+    residual : list or array of model residual coefficients
+    hp_specific : boolean
+        if true, the hyperparameters have to be arrays size equal to
+        the number of datasets, if false size: 1.
+
+    Returns
+    -------
+    array_like
+    """
+    n_t = len(datasets)
+    logpts = tt.zeros((n_t), tconfig.floatX)
+    count = Counter()
+
+    for l, data in enumerate(datasets):
+        M = tt.cast(weights[l].shape[0], tconfig.floatX)
+        hp_name = get_hyper_name(data)
+
+        if hp_specific:
+            hp = hyperparams[hp_name][count(hp_name)]
+        else:
+            hp = hyperparams[hp_name]
+
+        tmp = weights[l] * residuals[l]
+        norm = (M * (2 * hp + log_2pi))
+        logpts = tt.set_subtensor(
+            logpts[l:l + 1],
+            (-0.5) * (
+                -2 * tt.log(weights[l]).sum() +
+                norm +
+                (1 / tt.exp(hp * 2)) *
+                (tt.dot(tmp, tmp))))
+
+    return logpts
+
+
+def multivariate_normal_toeplitz(
+        datasets, weights, hyperparams, residuals, hp_specific=False):
+    """
+    Calculate posterior Likelihood of a Multivariate Normal distribution
+    with scaled Toeplitz covariance matrices, e.g. for stationary noise.
+    Assumes the weights to be the structured weights of
+    :class:`heart.ToeplitzCovariance`, so that no dense weight matrices
+    are needed.
+    Can only be executed in a `with model context`.
+
+    Parameters
+    ----------
+    datasets : list
+        of :class:`heart.SeismicDataset`
+    weights : list
+        of :class:`theano.shared`
+        (3 x samples) generators of the inverse Toeplitz matrix and inverse
+        standard deviations, see
+        :attr:`heart.ToeplitzCovariance.toeplitz_weight`
+    hyperparams : dict
+        of :class:`theano.`
+    residual : list or array of model residuals
+    hp_specific : boolean
+        if true, the hyperparameters have to be arrays size equal to
+        the number of datasets, if false size: 1.
+
+    Returns
+    -------
+    array_like
+    """
+    quadratic_form = ToeplitzQuadraticForm()
+
+    n_t = len(datasets)
+    logpts = tt.zeros((n_t), tconfig.floatX)
+    count = Counter()
+
+    for l, data in enumerate(datasets):
+        M = tt.cast(weights[l].shape[1], tconfig.floatX)
+        hp_name = get_hyper_name(data)
+
+        if hp_specific:
+            hp = hyperparams[hp_name][count(hp_name)]
+        else:
+            hp = hyperparams[hp_name]
+
+        norm = (M * (2 * hp + log_2pi))
+        logpts = tt.set_subtensor(
+            logpts[l:l + 1],
+            (-0.5) * (
+                data.covariance.slog_pdet +
+                norm +
+                (1 / tt.exp(hp * 2)) *
+                quadratic_form(weights[l], residuals[l])))
+
+    return logpts
+
+
 def hyper_normal(datasets, hyperparams, llks, hp_specific=False):
     """
     Calculate posterior Likelihood only dependent on hyperparameters.
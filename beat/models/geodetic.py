@@ -4,6 +4,7 @@ import copy
 from time import time
 
 import numpy as num
+from scipy import sparse
 
 from theano.printing import Print
 from theano import shared
@@ -16,6 +17,7 @@ from beat import theanof, utility
 from beat.ffi import load_gf_library, get_gf_prefix
 from beat import config as bconfig
 from beat import heart, covariance as cov
+from beat.okada import OkadaEngine
 from beat.models.base import ConfigInconsistentError, Composite
 from beat.models.distributions import multivariate_normal_chol
 from beat.interseismic import geo_backslip_synthetics, seperate_point
@@ -113,15 +115,25 @@ class GeodeticComposite(Composite):
             logger.info('No data-covariance estimation! Using imported'
                         ' covariances \n')
 
+        self.sparse_weights = any(
+            isinstance(data.covariance, heart.TaperedCovariance)
+            for data in self.datasets)
+        if self.sparse_weights:
+            logger.info('Using sparse weights for tapered covariances!')
+            from theano.sparse import shared as weight_shared
+        else:
+            weight_shared = shared
+
         self.weights = []
+        self.decimation_operators = [None] * self.n_t
         for i, data in enumerate(self.datasets):
-            if int(data.covariance.data.sum()) == data.ncoords:
+            if not isinstance(data.covariance, heart.TaperedCovariance) and \
+                    int(data.covariance.data.sum()) == data.ncoords:
                 logger.warn('Data covariance is identity matrix!'
                             ' Please double check!!!')
 
-            choli = data.covariance.chol_inverse
-            self.weights.append(
-                shared(choli, name='geo_weight_%i' % i, borrow=True))
+            self.weights.append(weight_shared(
+                self.get_weight(i), name='geo_weight_%i' % i, borrow=True))
             data.covariance.update_slog_pdet()
 
         if gc.fit_plane:
@@ -275,6 +287,75 @@ class GeodeticComposite(Composite):
             'Initialized %i hierarchical parameters '
             '(ramps).' % len(self.hierarchicals))
 
+    def get_weight(self, i):
+        """
+        Get the weight of a dataset with respect to its current resolution.
+
+        Parameters
+        ----------
+        i : int
+            index of the dataset
+
+        Returns
+        -------
+        :class:`numpy.ndarray`, inverse cholesky decomposition of the
+        covariance matrix or the reduced inverse cholesky decomposition if
+        the dataset is decimated, :class:`scipy.sparse.csr_matrix` if any
+        dataset has a :class:`heart.TaperedCovariance`
+        """
+        covariance = self.datasets[i].covariance
+        if self.decimation_operators[i] is not None:
+            weight = covariance.reduced_chol_inverse(
+                self.decimation_operators[i])
+        elif isinstance(covariance, heart.TaperedCovariance):
+            if covariance.has_prediction_covariances:
+                raise ConfigInconsistentError(
+                    'Model prediction covariances are not supported with'
+                    ' tapered data-covariances!')
+
+            weight = covariance.sparse_weight
+        else:
+            weight = covariance.chol_inverse
+
+        if self.sparse_weights:
+            return sparse.csr_matrix(weight)
+        else:
+            return weight
+
+    def set_resolution(self, factor):
+        """
+        Set the resolution of the datasets in the misfit, the data points
+        are averaged within grid cells of on average factor points.
+        Updates the weights (in place).
+
+        Parameters
+        ----------
+        factor : int
+            decimation factor, 1 for full resolution
+        """
+        logger.info('Setting geodetic decimation factor to %i' % factor)
+        if self.sparse_weights and factor != 1:
+            raise ConfigInconsistentError(
+                'Resolution schedules are not supported with tapered'
+                ' data-covariances!')
+
+        for i, data in enumerate(self.datasets):
+            if factor > 1:
+                north_shifts, east_shifts = data.update_local_coords(
+                    self.event)
+                self.decimation_operators[i] = \
+                    heart.spatial_decimation_operator(
+                        north_shifts, east_shifts, factor)
+                logger.info(
+                    'Dataset "%s" reduced from %i to %i points' % (
+                        data.name, data.samples,
+                        self.decimation_operators[i].shape[1]))
+            else:
+                self.decimation_operators[i] = None
+
+            self.weights[i].set_value(self.get_weight(i))
+            data.covariance.update_slog_pdet(self.decimation_operators[i])
+
     def remove_ramps(self, residuals, point=None, operation='-'):
         """
         Remove an orbital ramp from the residual displacements
@@ -321,9 +402,9 @@ class GeodeticComposite(Composite):
         """
         results = self.assemble_results(point)
         for l, result in enumerate(results):
-            choli = self.datasets[l].covariance.chol_inverse
-            tmp = choli.dot(result.processed_res)
-            _llk = num.asarray([num.dot(tmp, tmp)])
+            _llk = num.asarray([
+                self.datasets[l].covariance.inverse_quadratic_form(
+                    result.processed_res)])
             self._llks[l].set_value(_llk)
 
 
@@ -351,8 +432,15 @@ class GeodeticSourceComposite(GeodeticComposite):
         super(GeodeticSourceComposite, self).__init__(
             gc, project_dir, event, hypers=hypers)
 
-        self.engine = LocalEngine(
-            store_superdirs=[gc.gf_config.store_superdir])
+        if gc.gf_config.code == 'okada':
+            logger.info(
+                'Using analytical Okada solution for a homogeneous halfspace'
+                ' with poisson ratio: %f' % gc.gf_config.poisson_ratio)
+            self.engine = OkadaEngine(
+                poisson_ratio=gc.gf_config.poisson_ratio)
+        else:
+            self.engine = LocalEngine(
+                store_superdirs=[gc.gf_config.store_superdir])
 
         self.sources = sources
 
@@ -435,7 +523,7 @@ class GeodeticSourceComposite(GeodeticComposite):
 
         logpts = multivariate_normal_chol(
             self.datasets, self.weights, hyperparams, residuals,
-            hp_specific=hp_specific)
+            hp_specific=hp_specific, sparse=self.sparse_weights)
 
         llk = Deterministic(self._like_name, logpts)
         return llk.sum()
@@ -454,7 +542,32 @@ class GeodeticGeometryComposite(GeodeticSourceComposite):
             self.get_synths = theanof.GeoSynthesizer(
                 engine=self.engine,
                 sources=self.sources,
-                targets=self.targets)
+                targets=self.targets,
+                nprocs=self.config.nthreads)
+
+    def prefetch_synthetics(self, points):
+        """
+        Calculate the synthetics of a population of points in the solution
+        space with one engine call and keep them in the synthesizer for the
+        subsequent likelihood evaluations.
+
+        Parameters
+        ----------
+        points : list
+            of :func:`pymc3.Point` Dictionaries with model parameters
+        """
+        inputs_population = []
+        for point in points:
+            inputs = {}
+            for vname in self.get_synths.varnames:
+                if vname in point:
+                    inputs[vname] = point[vname]
+                else:
+                    inputs[vname] = self.fixed_rvs[vname]
+
+            inputs_population.append(inputs)
+
+        self.get_synths.prefetch(inputs_population)
 
     def get_synthetics(self, point, **kwargs):
         """
@@ -472,6 +585,7 @@ class GeodeticGeometryComposite(GeodeticSourceComposite):
         """
         self.point2sources(point)
 
+        kwargs.setdefault('nprocs', self.config.nthreads)
         displacements = heart.geo_synthetics(
             engine=self.engine,
             targets=self.targets,
@@ -505,6 +619,11 @@ class GeodeticGeometryComposite(GeodeticSourceComposite):
         crust_inds = range(*gc.gf_config.n_variations)
         thresh = 5
         if len(crust_inds) > thresh:
+            if self.sparse_weights:
+                raise ConfigInconsistentError(
+                    'Velocity model covariances are not supported with'
+                    ' tapered data-covariances!')
+
             logger.info('Updating geodetic velocity model-covariances ...')
             for i, data in enumerate(self.datasets):
                 crust_targets = heart.init_geodetic_targets(
@@ -522,14 +641,13 @@ class GeodeticGeometryComposite(GeodeticSourceComposite):
                     dataset=data,
                     plot=plot,
                     event=self.event,
-                    n_jobs=1)
-
-                cov_pv = utility.ensure_cov_psd(cov_pv)
-                data.covariance.pred_v = cov_pv
-                choli = data.covariance.chol_inverse
+                    n_jobs=1,
+                    factorized=True)
 
-                self.weights[i].set_value(choli)
-                data.covariance.update_slog_pdet()
+                data.covariance.pred_v_factor = cov_pv
+                self.weights[i].set_value(self.get_weight(i))
+                data.covariance.update_slog_pdet(
+                    self.decimation_operators[i])
         else:
             logger.info(
                 'Not updating geodetic velocity model-covariances because '
@@ -718,7 +836,7 @@ class GeodeticDistributerComposite(GeodeticComposite):
 
         logpts = multivariate_normal_chol(
             self.datasets, self.weights, hyperparams, residuals,
-            hp_specific=hp_specific)
+            hp_specific=hp_specific, sparse=self.sparse_weights)
 
         llk = Deterministic(self._like_name, logpts)
 
@@ -785,6 +903,11 @@ class GeodeticDistributerComposite(GeodeticComposite):
         crust_inds = range(*gc.gf_config.n_variations)
         thresh = 5
         if len(crust_inds) > thresh:
+            if self.sparse_weights:
+                raise ConfigInconsistentError(
+                    'Velocity model covariances are not supported with'
+                    ' tapered data-covariances!')
+
             logger.info('Updating geodetic velocity model-covariances ...')
 
             crust_inds = list(range(*self.config.gf_config.n_variations))
@@ -816,14 +939,12 @@ class GeodeticDistributerComposite(GeodeticComposite):
 
             for i, data in enumerate(self.datasets):
                 logger.debug('Track %s' % data.name)
-                cov_pv = num.cov(crust_synths[i], rowvar=0)
-
-                cov_pv = utility.ensure_cov_psd(cov_pv)
-                data.covariance.pred_v = cov_pv
-                choli = data.covariance.chol_inverse
+                cov_pv = cov.sample_covariance_factor(crust_synths[i])
+                data.covariance.pred_v_factor = cov_pv
 
-                self.weights[i].set_value(choli)
-                data.covariance.update_slog_pdet()
+                self.weights[i].set_value(self.get_weight(i))
+                data.covariance.update_slog_pdet(
+                    self.decimation_operators[i])
         else:
             logger.info(
                 'Not updating geodetic velocity model-covariances because '
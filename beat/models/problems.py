@@ -1,6 +1,7 @@
 import os
 import time
 import copy
+from collections import OrderedDict
 
 from pymc3 import Uniform, Model, Deterministic, Potential
 
@@ -78,6 +79,7 @@ class Problem(object):
     def __init__(self, config, hypers=False):
 
         self.model = None
+        self._composite_llks = OrderedDict()
 
         self._like_name = 'like'
 
@@ -123,7 +125,19 @@ class Problem(object):
             raise Exception(
                 'Model has to be built before initialising the sampler.')
 
+        if sc.name in ['Metropolis', 'PT'] and \
+                sc.parameters.proposal_dist in sampler.population_proposals:
+            raise ValueError(
+                'Proposal distribution "%s" is only supported by the SMC'
+                ' sampler!' % sc.parameters.proposal_dist)
+
         with self.model:
+            if hypers:
+                surrogate = None
+            else:
+                surrogate = self.get_surrogate_llk(
+                    sc.parameters.surrogate_datatypes)
+
             if sc.name == 'Metropolis':
                 logger.info(
                     '... Initiate Metropolis ... \n'
@@ -147,6 +161,7 @@ class Problem(object):
                         tune_interval=sc.parameters.tune_interval,
                         likelihood_name=self._like_name,
                         proposal_name=sc.parameters.proposal_dist,
+                        surrogate=surrogate,
                         backend=sc.backend)
                 t2 = time.time()
                 logger.info('Compilation time: %f' % (t2 - t1))
@@ -166,8 +181,9 @@ class Problem(object):
                     n_chains=sc.parameters.n_chains,
                     tune_interval=sc.parameters.tune_interval,
                     coef_variation=sc.parameters.coef_variation,
-                    proposal_dist=sc.parameters.proposal_dist,
+                    proposal_name=sc.parameters.proposal_dist,
                     likelihood_name=self._like_name,
+                    surrogate=surrogate,
                     backend=sc.backend)
                 t2 = time.time()
                 logger.info('Compilation time: %f' % (t2 - t1))
@@ -185,7 +201,44 @@ class Problem(object):
                     likelihood_name=self._like_name,
                     tune_interval=sc.parameters.tune_interval,
                     proposal_name=sc.parameters.proposal_dist,
+                    surrogate=surrogate,
+                    backend=sc.backend)
+
+            elif sc.name == 'HMC':
+                if not hypers and \
+                        self.config.problem_config.mode != \
+                        bconfig.ffi_mode_str:
+                    raise ValueError(
+                        'HMC sampler is only supported for the "%s" mode!' %
+                        bconfig.ffi_mode_str)
+
+                logger.info(
+                    '... Initiate Hamiltonian Monte Carlo ... \n'
+                    ' n_leapfrog=%i, tune_interval=%i, n_jobs=%i \n' % (
+                        sc.parameters.n_leapfrog,
+                        sc.parameters.tune_interval,
+                        sc.parameters.n_jobs))
+
+                # the rupture front calculation is not differentiable
+                gradient_vars = [
+                    var for var in self.model.vars
+                    if var.name in bconfig.static_dist_vars or
+                    var.name in self.hypernames]
+
+                t1 = time.time()
+                step = sampler.HamiltonianMonteCarlo(
+                    n_chains=sc.parameters.n_chains,
+                    gradient_vars=gradient_vars,
+                    n_leapfrog=sc.parameters.n_leapfrog,
+                    step_size=sc.parameters.step_size,
+                    target_accept=sc.parameters.target_accept,
+                    tune_interval=sc.parameters.tune_interval,
+                    likelihood_name=self._like_name,
+                    proposal_name=sc.parameters.proposal_dist,
+                    surrogate=surrogate,
                     backend=sc.backend)
+                t2 = time.time()
+                logger.info('Compilation time: %f' % (t2 - t1))
 
             else:
                 raise ValueError(
@@ -212,6 +265,7 @@ class Problem(object):
             self.init_hyperparams()
 
             total_llk = tt.zeros((1), tconfig.floatX)
+            self._composite_llks = OrderedDict()
 
             for datatype, composite in self.composites.items():
                 if datatype in bconfig.modes_catalog[pc.mode].keys():
@@ -224,8 +278,9 @@ class Problem(object):
                     input_rvs = self.rvs
                     fixed_rvs = self.fixed_params
 
-                total_llk += composite.get_formula(
+                self._composite_llks[datatype] = composite.get_formula(
                     input_rvs, fixed_rvs, self.hyperparams, pc)
+                total_llk += self._composite_llks[datatype]
 
             # deterministic RV to write out llks to file
             like = Deterministic('tmp', total_llk)
@@ -234,6 +289,59 @@ class Problem(object):
             llk = Potential(self._like_name, like)
             logger.info('Model building was successful! \n')
 
+    def get_surrogate_llk(self, datatypes):
+        """
+        Get the likelihood of a subset of the composites, to be used as a
+        cheap surrogate for the model likelihood, e.g. the geodetic
+        likelihood in joint inversions with seismic data.
+
+        Parameters
+        ----------
+        datatypes : list
+            of str of the composites to include
+
+        Returns
+        -------
+        :class:`theano.tensor.Tensor` or None if no datatypes are given
+        """
+        if len(datatypes) == 0:
+            return None
+
+        if self.model is None:
+            raise AttributeError('Model needs to be built!')
+
+        surrogate_llk = tt.zeros((1), tconfig.floatX)
+        for datatype in datatypes:
+            if datatype not in self._composite_llks:
+                raise ValueError(
+                    'Surrogate datatype "%s" not in problem! Options: %s' % (
+                        datatype, list2string(
+                            list(self._composite_llks.keys()))))
+
+            surrogate_llk += self._composite_llks[datatype]
+
+        if set(datatypes) == set(self._composite_llks.keys()):
+            logger.warning(
+                'Surrogate contains all datatypes, prescreening proposals'
+                ' will not save forward model evaluations!')
+
+        return surrogate_llk
+
+    def prefetch_synthetics(self, points):
+        """
+        Calculate the synthetics of all composites for a population of points
+        in the solution space in batches, ahead of the individual likelihood
+        evaluations of the points.
+
+        Parameters
+        ----------
+        points : list
+            of :func:`pymc3.Point` Dictionaries with model parameters
+        """
+        for composite in self.composites.values():
+            if hasattr(composite, 'prefetch_synthetics'):
+                composite.prefetch_synthetics(points)
+
     def plant_lijection(self):
         """
         Add list to array bijection to model object by monkey-patching.
@@ -513,6 +621,19 @@ class Problem(object):
             if hasattr(composite, 'update_weights'):
                 composite.update_weights(point, n_jobs=n_jobs)
 
+    def set_resolution(self, factor):
+        """
+        Set the resolution of the datasets of all composites in the misfit.
+        Shared variables are updated in place.
+
+        Parameters
+        ----------
+        factor : int
+            decimation factor of the datasets, 1 for full resolution
+        """
+        for composite in self.composites.values():
+            composite.set_resolution(factor)
+
     def get_synthetics(self, point, **kwargs):
         """
         Get synthetics for given point in solution space.
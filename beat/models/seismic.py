@@ -13,12 +13,14 @@ from theano.printing import Print
 from pyrocko.gf import LocalEngine
 from pyrocko.trace import Trace
 
-from beat import theanof, utility
+from beat import theanof, utility, parallel
 from beat.ffi import load_gf_library, get_gf_prefix
 from beat import config as bconfig
 from beat import heart, covariance as cov
 from beat.models.base import ConfigInconsistentError, Composite
-from beat.models.distributions import multivariate_normal_chol, get_hyper_name
+from beat.models.distributions import multivariate_normal_chol, \
+    multivariate_normal_spectral, multivariate_normal_toeplitz, \
+    get_hyper_name
 
 from pymc3 import Uniform, Deterministic
 from collections import OrderedDict
@@ -82,7 +84,8 @@ class SeismicComposite(Composite):
             pre_arrival_time=sc.noise_estimator.pre_arrival_time,
             engine=self.engine,
             event=self.event,
-            chop_bounds=['b', 'c'])
+            chop_bounds=['b', 'c'],
+            structured=sc.noise_estimator.structured)
 
         self.wavemaps = []
         for i, wc in enumerate(sc.waveforms):
@@ -131,18 +134,35 @@ class SeismicComposite(Composite):
         else:
             results = [None] * len(self.wavemaps)
 
-        for wmap, wmap_results in zip(self.wavemaps, results):
+        def get_data_covariances(args):
+            wmap, wmap_results = args
             logger.info(
                 'Retrieving seismic data-covariances with structure "%s" '
                 'for %s ...' % (
                     self.config.noise_estimator.structure, wmap._mapid))
 
-            cov_ds_seismic = self.noise_analyser.get_data_covariances(
+            return self.noise_analyser.get_data_covariances(
                 wmap=wmap, results=wmap_results,
                 sample_rate=self.config.gf_config.sample_rate)
 
+        # wavemaps are independent, estimates are mostly numpy
+        cov_ds_wmaps = parallel.thread_map(
+            get_data_covariances, list(zip(self.wavemaps, results)),
+            nthreads=self.config.nthreads)
+
+        for wmap, cov_ds_seismic in zip(self.wavemaps, cov_ds_wmaps):
             for j, trc in enumerate(wmap.datasets):
-                if trc.covariance is None:
+                if self.noise_analyser.structured:
+                    if isinstance(trc.covariance, heart.ToeplitzCovariance):
+                        # keep covariance object, its slog_pdet is in the
+                        # likelihood
+                        trc.covariance.autocovariance = \
+                            cov_ds_seismic[j].autocovariance
+                        trc.covariance.stds = cov_ds_seismic[j].stds
+                        trc.covariance.update_slog_pdet()
+                    else:
+                        trc.covariance = cov_ds_seismic[j]
+                elif trc.covariance is None:
                     trc.covariance = heart.Covariance(data=cov_ds_seismic[j])
                 else:
                     trc.covariance.data = cov_ds_seismic[j]
@@ -202,9 +222,13 @@ class SeismicComposite(Composite):
         Initialise shared weights in wavemaps.
         """
         for wmap in self.wavemaps:
+            if wmap.config.domain == 'spectrum':
+                wmap.init_spectral_basis(
+                    sample_rate=self.config.gf_config.sample_rate)
+
             weights = []
             for j, trc in enumerate(wmap.datasets):
-                icov = trc.covariance.chol_inverse
+                icov = wmap.get_weight(trc.covariance)
                 weights.append(
                     shared(
                         icov,
@@ -213,6 +237,60 @@ class SeismicComposite(Composite):
 
             wmap.add_weights(weights)
 
+    def set_resolution(self, factor):
+        """
+        Set the resolution of the data windows in the misfit, blocks of
+        factor samples are averaged. Updates the weights (in place).
+
+        Parameters
+        ----------
+        factor : int
+            decimation factor, 1 for full resolution
+        """
+        logger.info('Setting seismic decimation factor to %i' % factor)
+        for wmap in self.wavemaps:
+            if wmap.structured_noise and factor != 1:
+                raise ConfigInconsistentError(
+                    'Resolution schedules are not supported with structured'
+                    ' data-covariances!')
+
+            wmap.set_decimation(
+                factor, sample_rate=self.config.gf_config.sample_rate)
+
+            for weight, dataset in zip(wmap.weights, wmap.datasets):
+                weight.set_value(wmap.get_weight(dataset.covariance))
+                dataset.covariance.update_slog_pdet(wmap.decimation_operator)
+
+    def get_wavemap_likelihood(self, wmap, hyperparams, residuals):
+        """
+        Get the likelihoods of the datasets of a waveform mapping in the
+        domain of its misfit.
+
+        Parameters
+        ----------
+        wmap : :class:`heart.WaveformMapping`
+        hyperparams : dict
+            of :class:`pymc3.distribution.Distribution`
+        residuals : :class:`theano.tensor.Tensor`
+            of size (targets, samples), residual time windows
+
+        Returns
+        -------
+        :class:`theano.tensor.Tensor` of size targets
+        """
+        hp_specific = self.config.dataset_specific_residual_noise_estimation
+        if wmap.spectral_basis is not None:
+            likelihood = multivariate_normal_spectral
+        elif wmap.structured_noise:
+            likelihood = multivariate_normal_toeplitz
+        else:
+            likelihood = multivariate_normal_chol
+
+        return likelihood(
+            wmap.datasets, wmap.weights, hyperparams,
+            wmap.get_misfit_residuals(residuals),
+            hp_specific=hp_specific)
+
     def get_all_station_names(self):
         """
         Returns list of station names in the order of wavemaps.
@@ -362,9 +440,9 @@ class SeismicComposite(Composite):
         """
         results = self.assemble_results(point, chop_bounds=['b', 'c'])
         for k, result in enumerate(results):
-            choli = self.datasets[k].covariance.chol_inverse
-            tmp = choli.dot(result.processed_res.ydata)
-            _llk = num.asarray([num.dot(tmp, tmp)])
+            _llk = num.asarray([
+                self.datasets[k].covariance.inverse_quadratic_form(
+                    result.processed_res.ydata)])
             self._llks[k].set_value(_llk)
 
     def get_standardized_residuals(self, point):
@@ -420,6 +498,8 @@ class SeismicGeometryComposite(SeismicComposite):
         if true initialise object for hyper parameter optimization
     """
 
+    _wavemaps_synthesizer = 'wavemaps'
+
     def __init__(self, sc, project_dir, sources, event, hypers=False):
 
         super(SeismicGeometryComposite, self).__init__(
@@ -472,6 +552,29 @@ class SeismicGeometryComposite(SeismicComposite):
             utility.update_source(
                 source, input_depth=input_depth, **source_points[i])
 
+    def get_time_shifts(self, point, wavemaps, concatenate=num.concatenate):
+        """
+        Get the station correction time shifts for the targets of the
+        waveform mappings.
+
+        Parameters
+        ----------
+        point : dict
+            with the station corrections of the waveform mappings, e.g.
+            :func:`pymc3.Point` or the hierarchical random variables
+        wavemaps : list
+            of :class:`heart.WaveformMapping`
+        concatenate : function
+            to concatenate the time shifts of the waveform mappings
+
+        Returns
+        -------
+        time shifts for the targets of the waveform mappings
+        """
+        return concatenate([
+            point[wmap.time_shifts_id][wmap.station_correction_idxs]
+            for wmap in wavemaps])
+
     def get_formula(
             self, input_rvs, fixed_rvs, hyperparams, problem_config):
         """
@@ -492,7 +595,6 @@ class SeismicGeometryComposite(SeismicComposite):
         -------
         posterior_llk : :class:`theano.tensor.Tensor`
         """
-        hp_specific = self.config.dataset_specific_residual_noise_estimation
         tpoint = problem_config.get_test_point()
 
         self.input_rvs = input_rvs
@@ -516,39 +618,71 @@ class SeismicGeometryComposite(SeismicComposite):
                 'station corrections.' % len(self.get_all_station_names()))
 
         for wmap in self.wavemaps:
-            if len(self.hierarchicals) > 0:
-                time_shifts = self.hierarchicals[
-                    wmap.time_shifts_id][wmap.station_correction_idxs]
-                self.input_rvs[self.correction_name] = time_shifts
-
-            wc = wmap.config
-
             logger.info(
                 'Preparing data of "%s" for optimization' % wmap._mapid)
             wmap.prepare_data(
                 source=self.event, engine=self.engine, outmode='array')
 
-            logger.info(
-                'Initializing synthesizer for "%s"' % wmap._mapid)
-            self.synthesizers[wmap._mapid] = theanof.SeisSynthesizer(
-                engine=self.engine,
-                sources=self.sources,
-                targets=wmap.targets,
-                event=self.event,
-                arrival_taper=wc.arrival_taper,
-                arrival_times=wmap._arrival_times,
-                wavename=wmap.name,
-                filterer=wc.filterer,
-                pre_stack_cut=self.config.pre_stack_cut,
-                station_corrections=self.config.station_corrections)
+        if self.config.pre_stack_cut:
+            wsynths = []
+            for wmap in self.wavemaps:
+                if len(self.hierarchicals) > 0:
+                    self.input_rvs[self.correction_name] = \
+                        self.get_time_shifts(
+                            self.hierarchicals, [wmap],
+                            concatenate=tt.concatenate)
 
-            synths, _ = self.synthesizers[wmap._mapid](self.input_rvs)
+                wc = wmap.config
 
+                logger.info(
+                    'Initializing synthesizer for "%s"' % wmap._mapid)
+                self.synthesizers[wmap._mapid] = theanof.SeisSynthesizer(
+                    engine=self.engine,
+                    sources=self.sources,
+                    targets=wmap.targets,
+                    event=self.event,
+                    arrival_taper=wc.arrival_taper,
+                    arrival_times=wmap._arrival_times,
+                    wavename=wmap.name,
+                    filterer=wmap.synthetics_filterer,
+                    pre_stack_cut=self.config.pre_stack_cut,
+                    station_corrections=self.config.station_corrections,
+                    nprocs=self.config.nthreads)
+
+                synths, _ = self.synthesizers[wmap._mapid](self.input_rvs)
+                wsynths.append(synths)
+        else:
+            if len(self.hierarchicals) > 0:
+                self.input_rvs[self.correction_name] = self.get_time_shifts(
+                    self.hierarchicals, self.wavemaps,
+                    concatenate=tt.concatenate)
+
+            logger.info('Initializing synthesizer for all wavemaps')
+            self.synthesizers[self._wavemaps_synthesizer] = \
+                theanof.MultiSeisSynthesizer(
+                    engine=self.engine,
+                    sources=self.sources,
+                    targets=[wmap.targets for wmap in self.wavemaps],
+                    event=self.event,
+                    arrival_tapers=[
+                        wmap.config.arrival_taper for wmap in self.wavemaps],
+                    arrival_times=[
+                        wmap._arrival_times for wmap in self.wavemaps],
+                    wavenames=[wmap.name for wmap in self.wavemaps],
+                    filterers=[
+                        wmap.synthetics_filterer for wmap in self.wavemaps],
+                    station_corrections=self.config.station_corrections,
+                    nprocs=self.config.nthreads)
+
+            outputs = self.synthesizers[self._wavemaps_synthesizer](
+                self.input_rvs)
+            wsynths = outputs[::2]
+
+        for wmap, synths in zip(self.wavemaps, wsynths):
             residuals = wmap.shared_data_array - synths
 
-            logpts = multivariate_normal_chol(
-                wmap.datasets, wmap.weights, hyperparams, residuals,
-                hp_specific=hp_specific)
+            logpts = self.get_wavemap_likelihood(
+                wmap, hyperparams, residuals)
 
             wlogpts.append(logpts)
 
@@ -560,6 +694,39 @@ class SeismicGeometryComposite(SeismicComposite):
         llk = Deterministic(self._like_name, tt.concatenate((wlogpts)))
         return llk.sum()
 
+    def prefetch_synthetics(self, points):
+        """
+        Calculate the synthetics of a population of points in the solution
+        space with one engine call per waveform mapping and keep them in
+        the synthesizer for the subsequent likelihood evaluations.
+
+        Parameters
+        ----------
+        points : list
+            of :func:`pymc3.Point` Dictionaries with model parameters
+        """
+        if self.config.pre_stack_cut:
+            logger.debug(
+                'Population synthetics not supported with "pre_stack_cut"!')
+            return
+
+        synthesizer = self.synthesizers[self._wavemaps_synthesizer]
+        inputs_population = []
+        for point in points:
+            inputs = {}
+            for vname in synthesizer.varnames:
+                if vname == self.correction_name:
+                    inputs[vname] = self.get_time_shifts(
+                        point, self.wavemaps)
+                elif vname in point:
+                    inputs[vname] = point[vname]
+                else:
+                    inputs[vname] = self.fixed_rvs[vname]
+
+            inputs_population.append(inputs)
+
+        synthesizer.prefetch(inputs_population)
+
     def get_synthetics(self, point, **kwargs):
         """
         Get synthetics for given point in solution space.
@@ -578,6 +745,7 @@ class SeismicGeometryComposite(SeismicComposite):
         outmode = kwargs.pop('outmode', 'stacked_traces')
         chop_bounds = kwargs.pop('chop_bounds', ['a', 'd'])
         order = kwargs.pop('order', 'list')
+        kwargs.setdefault('nprocs', self.config.nthreads)
 
         self.point2sources(point)
 
@@ -608,7 +776,7 @@ class SeismicGeometryComposite(SeismicComposite):
                 targets=wmap.targets,
                 arrival_taper=wc.arrival_taper,
                 wavename=wmap.name,
-                filterer=wc.filterer,
+                filterer=wmap.synthetics_filterer,
                 pre_stack_cut=sc.pre_stack_cut,
                 arrival_times=arrival_times,
                 outmode=outmode,
@@ -656,6 +824,11 @@ class SeismicGeometryComposite(SeismicComposite):
         crust_inds = range(*sc.gf_config.n_variations)
         thresh = 5
         if len(crust_inds) > thresh:
+            if self.config.noise_estimator.structured:
+                raise ConfigInconsistentError(
+                    'Velocity model covariances are not supported with'
+                    ' structured data-covariances!')
+
             logger.info('Updating seismic velocity model-covariances ...')
             if self.config.noise_estimator.structure == 'non-toeplitz':
                 logger.warning(
@@ -694,20 +867,20 @@ class SeismicGeometryComposite(SeismicComposite):
                             arrival_taper=wc.arrival_taper,
                             arrival_time=arrival_times[tidx],
                             filterer=wc.filterer,
-                            plot=plot, n_jobs=n_jobs)
-                        cov_pv = utility.ensure_cov_psd(cov_pv)
+                            plot=plot, n_jobs=n_jobs, factorized=True)
 
                         self.engine.close_cashed_stores()
 
                         dataset = wmap.datasets[tidx]
-                        dataset.covariance.pred_v = cov_pv
+                        dataset.covariance.pred_v_factor = cov_pv
 
                         t0 = time()
-                        choli = dataset.covariance.chol_inverse
+                        choli = wmap.get_weight(dataset.covariance)
                         t1 = time()
                         logger.debug('Calculate weight time %f' % (t1 - t0))
                         wmap.weights[tidx].set_value(choli)
-                        dataset.covariance.update_slog_pdet()
+                        dataset.covariance.update_slog_pdet(
+                            wmap.decimation_operator)
         else:
             logger.info(
                 'Not updating seismic velocity model-covariances because '
@@ -832,7 +1005,6 @@ class SeismicDistributerComposite(SeismicComposite):
             crust_inds=[self.config.gf_config.reference_model_idx],
             make_shared=False)
 
-        hp_specific = self.config.dataset_specific_residual_noise_estimation
         tpoint = problem_config.get_test_point()
 
         self.input_rvs = input_rvs
@@ -922,9 +1094,8 @@ class SeismicDistributerComposite(SeismicComposite):
             residuals = wmap.shared_data_array - synthetics
 
             logger.debug('Calculating likelihoods ...')
-            logpts = multivariate_normal_chol(
-                wmap.datasets, wmap.weights, hyperparams, residuals,
-                hp_specific=hp_specific)
+            logpts = self.get_wavemap_likelihood(
+                wmap, hyperparams, residuals)
 
             wlogpts.append(logpts)
 
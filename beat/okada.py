@@ -0,0 +1,434 @@
+"""
+Module for the analytical calculation of static surface displacements due to
+rectangular dislocations in a homogeneous elastic halfspace.
+Allows the fast calculation of geodetic synthetics without Greens Function
+stores, e.g. for first inversions.
+
+The displacements of all sources at all observation points are calculated
+in one array computation. The formulas are the ones of Okada (1992)
+evaluated at the free surface, which reduce to the ones of Okada (1985).
+
+References
+==========
+Okada 1985, Surface deformation due to shear and tensile faults in a
+half-space, BSSA
+Okada 1992, Internal deformation due to shear and tensile faults in a
+half-space, BSSA
+"""
+import logging
+
+import numpy as num
+
+from pyrocko import orthodrome
+
+
+logger = logging.getLogger('okada')
+
+d2r = num.pi / 180.
+
+# faults with smaller cosine of the dip are treated as vertical, the terms
+# of the general solution suffer from numerical cancellation otherwise
+cos_dip_eps = 1e-5
+
+
+__all__ = [
+    'OkadaEngine',
+    'okada_surface_displacements',
+    'get_okada_source_parameters']
+
+
+# relative offsets of the reference point from the fault center along
+# strike and down-dip in units of half length and half width
+map_anchor = {
+    'center': (0.0, 0.0),
+    'center_left': (-1.0, 0.0),
+    'center_right': (1.0, 0.0),
+    'top': (0.0, -1.0),
+    'top_left': (-1.0, -1.0),
+    'top_right': (1.0, -1.0),
+    'bottom': (0.0, 1.0),
+    'bottom_left': (-1.0, 1.0),
+    'bottom_right': (1.0, 1.0)}
+
+
+def _okada_corner(xi, eta, q, sd, cd, vertical, mu_ratio):
+    """
+    Displacement terms of Okada (1985) for one corner of the Chinnery
+    notation, for strike-slip, dip-slip and tensile dislocations.
+
+    Returns
+    -------
+    list of 9 :class:`numpy.ndarray` ux, uy, uz for strike-slip, dip-slip
+    and tensile dislocations in the fault coordinate system
+    """
+    R = num.sqrt(xi ** 2 + eta ** 2 + q ** 2)
+    X = num.sqrt(xi ** 2 + q ** 2)
+    yb = eta * cd + q * sd
+    db = eta * sd - q * cd
+    re = R + eta
+    rx = R + xi
+    rd = R + db
+    cds = num.where(vertical, 1., cd)
+
+    with num.errstate(divide='ignore', invalid='ignore'):
+        # singular terms, Okada 1992 (eq. 38 ff.)
+        sing_re = re <= 0.
+        inv_re = num.where(sing_re, 0., 1. / re)
+        log_re = num.where(sing_re, -num.log(R - eta), num.log(re))
+        inv_rx = num.where(rx <= 0., 0., 1. / rx)
+        theta = num.where(q == 0., 0., num.arctan(xi * eta / (q * R)))
+
+        I4 = num.where(
+            vertical,
+            -mu_ratio * q / rd,
+            mu_ratio / cds * (num.log(rd) - sd * log_re))
+        I5 = num.where(
+            vertical,
+            -mu_ratio * xi * sd / rd,
+            mu_ratio * 2. / cds * num.arctan(
+                (eta * (X + q * cd) + X * (R + X) * sd) /
+                (xi * (R + X) * cds)))
+        I5 = num.where(xi == 0., 0., I5)
+        I3 = num.where(
+            vertical,
+            0.5 * mu_ratio * (eta / rd + yb * q / rd ** 2 - log_re),
+            mu_ratio * (yb / (cds * rd) - log_re) + sd / cds * I4)
+        I2 = -mu_ratio * log_re - I3
+        I1 = num.where(
+            vertical,
+            -0.5 * mu_ratio * xi * q / rd ** 2,
+            -mu_ratio * xi / (cds * rd) - sd / cds * I5)
+
+        qre = q * inv_re / R
+        qrx = q * inv_rx / R
+
+    return [
+        xi * qre + theta + I1 * sd,
+        yb * qre + q * cd * inv_re + I2 * sd,
+        db * qre + q * sd * inv_re + I4 * sd,
+        q / R - I3 * sd * cd,
+        yb * qrx + cd * theta - I1 * sd * cd,
+        db * qrx + sd * theta - I5 * sd * cd,
+        q * q * inv_re / R - I3 * sd ** 2,
+        -db * qrx - sd * (xi * qre - theta) - I1 * sd ** 2,
+        yb * qrx + cd * (xi * qre - theta) - I5 * sd ** 2]
+
+
+def okada_surface_displacements(
+        norths, easts, depths, strikes, dips, lengths, widths, rakes, slips,
+        openings=None, poisson_ratio=0.25):
+    """
+    Calculate surface displacements due to rectangular dislocations in a
+    homogeneous elastic halfspace.
+
+    Parameters
+    ----------
+    norths : :class:`numpy.ndarray` (n_sources, n_points)
+        north coordinates [m] of the observation points relative to the
+        fault centers
+    easts : :class:`numpy.ndarray` (n_sources, n_points)
+        east coordinates [m] of the observation points relative to the
+        fault centers
+    depths : :class:`numpy.ndarray` (n_sources)
+        depths [m] of the fault centers
+    strikes : :class:`numpy.ndarray` (n_sources)
+        strike angles [deg]
+    dips : :class:`numpy.ndarray` (n_sources)
+        dip angles [deg]
+    lengths : :class:`numpy.ndarray` (n_sources)
+        fault lengths [m] along strike
+    widths : :class:`numpy.ndarray` (n_sources)
+        fault widths [m] along dip
+    rakes : :class:`numpy.ndarray` (n_sources)
+        rake angles [deg]
+    slips : :class:`numpy.ndarray` (n_sources)
+        shear slips [m]
+    openings : :class:`numpy.ndarray` (n_sources)
+        optional, tensile openings [m]
+    poisson_ratio : float
+        of the halfspace
+
+    Returns
+    -------
+    :class:`numpy.ndarray` (n_sources, n_points, 3) of displacements
+    [m] (ux-North, uy-East, uz-Up)
+    """
+    def column(values):
+        return num.asarray(values, dtype=num.float64).reshape((-1, 1))
+
+    strike = column(strikes) * d2r
+    dip = column(dips) * d2r
+    rake = column(rakes) * d2r
+    L = column(lengths)
+    W = column(widths)
+    slip = column(slips)
+
+    if openings is None:
+        opening = num.zeros_like(slip)
+    else:
+        opening = column(openings)
+
+    norths = num.atleast_2d(norths)
+    easts = num.atleast_2d(easts)
+
+    ss = num.sin(strike)
+    cs = num.cos(strike)
+    sd = num.sin(dip)
+    cd = num.cos(dip)
+    vertical = num.abs(cd) < cos_dip_eps
+    cd = num.where(vertical, 0., cd)
+
+    # depth of the lower fault edge and observations relative to the
+    # projection of its center to the surface
+    d = column(depths) + sd * W / 2.
+    ec = easts + cs * cd * W / 2.
+    nc = norths - ss * cd * W / 2.
+
+    x = cs * nc + ss * ec + L / 2.
+    y = ss * nc - cs * ec + cd * W
+    p = y * cd + d * sd
+    q = y * sd - d * cd
+
+    mu_ratio = 1. - 2. * poisson_ratio
+
+    # Chinnery notation
+    terms = num.zeros((9,) + x.shape)
+    for xi, eta, sign in (
+            (x, p, 1.), (x, p - W, -1.), (x - L, p, -1.), (x - L, p - W, 1.)):
+        terms += sign * num.array(
+            _okada_corner(xi, eta, q, sd, cd, vertical, mu_ratio))
+
+    u1 = num.cos(rake) * slip / (2. * num.pi)
+    u2 = num.sin(rake) * slip / (2. * num.pi)
+    u3 = opening / (2. * num.pi)
+
+    ux = -u1 * terms[0] - u2 * terms[3] + u3 * terms[6]
+    uy = -u1 * terms[1] - u2 * terms[4] + u3 * terms[7]
+    uz = -u1 * terms[2] - u2 * terms[5] + u3 * terms[8]
+
+    displacements = num.empty(x.shape + (3,))
+    displacements[:, :, 0] = cs * ux + ss * uy
+    displacements[:, :, 1] = ss * ux - cs * uy
+    displacements[:, :, 2] = uz
+    return displacements
+
+
+def get_okada_source_parameters(sources):
+    """
+    Get the parameters of rectangular sources for the Okada solution.
+    The source reference points are converted to the fault centers with
+    respect to the source anchors.
+
+    Parameters
+    ----------
+    sources : list
+        of :class:`pyrocko.gf.seismosizer.RectangularSource`
+
+    Returns
+    -------
+    dict of :class:`numpy.ndarray` (n_sources) with keys: norths, easts,
+    depths, strikes, dips, lengths, widths, rakes, slips, openings
+
+    Notes
+    -----
+    The tensile opening is taken from the "opening" [m] of the
+    :class:`beat.pscmp.PsCmpRectangularSource` or from the
+    "opening_fraction" of the slip of the pyrocko
+    :class:`pyrocko.gf.seismosizer.RectangularSource`, of which the
+    remaining fraction is shear slip.
+    """
+    params = {key: num.zeros(len(sources)) for key in [
+        'norths', 'easts', 'depths', 'strikes', 'dips', 'lengths', 'widths',
+        'rakes', 'slips', 'openings']}
+
+    for i, source in enumerate(sources):
+        for attribute in ['strike', 'dip', 'length', 'width', 'slip']:
+            if getattr(source, attribute, None) is None:
+                raise TypeError(
+                    'Okada solution needs rectangular sources with given'
+                    ' "%s", got %s!' % (attribute, source.__class__.__name__))
+
+        anchor = getattr(source, 'anchor', 'center')
+        if anchor not in map_anchor:
+            raise ValueError('Source anchor "%s" not supported!' % anchor)
+
+        anch_x, anch_y = map_anchor[anchor]
+        strike = source.strike * d2r
+        dip = source.dip * d2r
+        along_strike = -anch_x * 0.5 * source.length
+        down_dip = -anch_y * 0.5 * source.width
+
+        params['norths'][i] = source.north_shift + \
+            along_strike * num.cos(strike) - \
+            down_dip * num.sin(strike) * num.cos(dip)
+        params['easts'][i] = source.east_shift + \
+            along_strike * num.sin(strike) + \
+            down_dip * num.cos(strike) * num.cos(dip)
+        params['depths'][i] = source.depth + down_dip * num.sin(dip)
+        params['strikes'][i] = source.strike
+        params['dips'][i] = source.dip
+        params['lengths'][i] = source.length
+        params['widths'][i] = source.width
+        params['rakes'][i] = source.rake
+
+        opening = getattr(source, 'opening', None)
+        if opening is None:
+            opening_fraction = getattr(source, 'opening_fraction', 0.)
+            params['slips'][i] = source.slip * (1. - abs(opening_fraction))
+            params['openings'][i] = source.slip * opening_fraction
+        else:
+            params['slips'][i] = source.slip
+            params['openings'][i] = opening
+
+    return params
+
+
+class OkadaResult(object):
+    """
+    Static result for one source and target, in the format of the
+    :class:`pyrocko.gf.seismosizer.StaticResult`.
+    """
+
+    def __init__(self, result):
+        self.result = result
+
+
+class OkadaResponse(object):
+    """
+    Response of the :class:`OkadaEngine`, in the format of the
+    :class:`pyrocko.gf.seismosizer.Response` for static targets.
+    """
+
+    def __init__(self, results):
+        self._results = results
+
+    def static_results(self):
+        return self._results
+
+
+class OkadaEngine(object):
+    """
+    Replacement for the :class:`pyrocko.gf.seismosizer.LocalEngine` for
+    static targets, calculating the surface displacements of rectangular
+    sources analytically for a homogeneous elastic halfspace. No Greens
+    Function stores are needed.
+
+    Parameters
+    ----------
+    poisson_ratio : float
+        of the halfspace
+    block_size : int
+        maximum number of source-observation pairs that are calculated in
+        one array computation, limits memory usage. The sources and, for
+        large numbers of observation points, also the points are split
+        into blocks.
+    """
+
+    def __init__(self, poisson_ratio=0.25, block_size=2 ** 20):
+        self.poisson_ratio = poisson_ratio
+        self.block_size = block_size
+
+    def close_cashed_stores(self):
+        pass
+
+    def get_displacements(self, sources, targets):
+        """
+        Calculate the surface displacements of all sources at all the
+        observation points of the targets.
+
+        Parameters
+        ----------
+        sources : list
+            of :class:`pyrocko.gf.seismosizer.RectangularSource`
+        targets : list
+            of :class:`pyrocko.gf.targets.StaticTarget`
+
+        Returns
+        -------
+        :class:`numpy.ndarray` (n_sources, n_points, 3) of displacements
+        [m] (ux-North, uy-East, uz-Up), observation points of all targets
+        are concatenated
+        """
+        params = get_okada_source_parameters(sources)
+
+        lats = num.concatenate([target.lats for target in targets])
+        lons = num.concatenate([target.lons for target in targets])
+        shifts = []
+        for attribute in ['north_shifts', 'east_shifts']:
+            shifts.append(num.concatenate([
+                num.zeros(target.lats.size)
+                if getattr(target, attribute, None) is None
+                else getattr(target, attribute) for target in targets]))
+
+        ns = len(sources)
+        npoints = lats.size
+        norths = num.empty((ns, npoints))
+        easts = num.empty((ns, npoints))
+
+        references = {}
+        for i, source in enumerate(sources):
+            key = (source.lat, source.lon)
+            if key not in references:
+                references[key] = orthodrome.latlon_to_ne_numpy(
+                    source.lat, source.lon, lats, lons)
+
+            north, east = references[key]
+            norths[i] = north + shifts[0] - params['norths'][i]
+            easts[i] = east + shifts[1] - params['easts'][i]
+
+        displacements = num.empty((ns, npoints, 3))
+        point_step = max(1, min(npoints, self.block_size))
+        source_step = max(1, self.block_size // point_step)
+        for start in range(0, ns, source_step):
+            slc = slice(start, start + source_step)
+            for pstart in range(0, npoints, point_step):
+                pslc = slice(pstart, pstart + point_step)
+                displacements[slc, pslc] = okada_surface_displacements(
+                    norths=norths[slc, pslc],
+                    easts=easts[slc, pslc],
+                    depths=params['depths'][slc],
+                    strikes=params['strikes'][slc],
+                    dips=params['dips'][slc],
+                    lengths=params['lengths'][slc],
+                    widths=params['widths'][slc],
+                    rakes=params['rakes'][slc],
+                    slips=params['slips'][slc],
+                    openings=params['openings'][slc],
+                    poisson_ratio=self.poisson_ratio)
+
+        return displacements
+
+    def process(self, sources, targets, nthreads=1):
+        """
+        Calculate the static displacements for all combinations of sources
+        and targets.
+
+        Parameters
+        ----------
+        sources : list
+            of :class:`pyrocko.gf.seismosizer.RectangularSource`
+        targets : list
+            of :class:`pyrocko.gf.targets.StaticTarget`
+        nthreads : int
+            dummy for compatibility with the pyrocko engine
+
+        Returns
+        -------
+        :class:`OkadaResponse`
+        """
+        displacements = self.get_displacements(sources, targets)
+
+        target_offsets = num.cumsum(
+            [0] + [target.lats.size for target in targets])
+
+        results = []
+        for i in range(len(sources)):
+            for j in range(len(targets)):
+                disp = displacements[
+                    i, target_offsets[j]:target_offsets[j + 1]]
+                results.append(OkadaResult({
+                    'displacement.n': disp[:, 0],
+                    'displacement.e': disp[:, 1],
+                    'displacement.d': -disp[:, 2]}))
+
+        return OkadaResponse(results)
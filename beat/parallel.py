@@ -1,5 +1,6 @@
 import multiprocessing
 from multiprocessing import reduction
+from multiprocessing.pool import ThreadPool
 from logging import getLogger
 import traceback
 from functools import wraps
@@ -9,6 +10,9 @@ import numpy as num
 from collections import OrderedDict
 from io import BytesIO
 import sys
+import os
+import atexit
+import pickle
 
 
 logger = getLogger('parallel')
@@ -17,6 +21,9 @@ logger = getLogger('parallel')
 _shared_memory = OrderedDict()
 _tobememshared = set([])
 
+# thread pools for the forward model calculations
+_thread_pools = {}
+
 
 @classmethod
 def dumps(cls, obj, protocol=None):
@@ -175,12 +182,388 @@ def _pay_worker(worker):
     return overseer(worker.timeout)(worker.run)()
 
 
+class PersistentPool(object):
+    """
+    Pool of worker processes that is forked on first use and kept alive
+    for repeated executions of :func:`paripool`, e.g. across sampling stages.
+    The initializer is run once in each worker process and may be used to
+    keep large objects (compiled models, GF stores) resident in the workers.
+
+    Parameters
+    ----------
+    nprocs : int
+        number of processors to be used in paralell process
+    initializer : function
+        to init each worker process with
+    initargs : tuple
+        of arguments for the initializer, these are inherited by forking
+        and not pickled
+    """
+
+    def __init__(self, nprocs=None, initializer=None, initargs=()):
+        if nprocs is None:
+            nprocs = multiprocessing.cpu_count()
+
+        self.nprocs = nprocs
+        self.initializer = initializer
+        self.initargs = initargs
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            logger.info('Forking pool of %i workers ...' % self.nprocs)
+            # workers inherit initargs, they are not pickled
+            self._pool = multiprocessing.get_context('fork').Pool(
+                processes=self.nprocs,
+                initializer=self.initializer,
+                initargs=self.initargs)
+
+        return self._pool
+
+    @property
+    def running(self):
+        return self._pool is not None
+
+    def close(self):
+        """
+        Close the worker processes, next usage will fork again.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+            # reset process counter for tqdm progressbar
+            multiprocessing.process._process_counter = count(1)
+
+    def terminate(self):
+        """
+        Kill the worker processes, next usage will fork again.
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    def __getstate__(self):
+        raise TypeError('PersistentPool cannot be pickled!')
+
+
+ANY_SOURCE = -1
+ANY_TAG = -1
+
+
+class SharedMemoryChannel(object):
+    """
+    Ring buffer in shared memory that holds fixed size float64 messages
+    and their headers (source, tag, size, kind). Many processes may write
+    to the channel, only one process (the owner) may read from it.
+    The shared memory is allocated with the 'fork' start method, the
+    processes have to be forked after the channel has been created.
+
+    Float arrays, e.g. chain states, are copied into one slot without
+    pickling. Python objects, e.g. the initial work packages, are pickled
+    and the bytes are spread over as many consecutive slots as needed.
+    Messages without content, e.g. signals, only occupy a header.
+
+    Parameters
+    ----------
+    n_slots : int
+        number of messages the channel can hold before writing blocks
+    slot_size : int
+        maximum number of floats per message
+    """
+
+    _array_message = 0
+    _object_message = 1
+
+    def __init__(self, n_slots, slot_size):
+        self.n_slots = n_slots
+        self.slot_size = slot_size
+
+        ctx = multiprocessing.get_context('fork')
+        self._data = ctx.RawArray('d', n_slots * slot_size)
+        self._header = ctx.RawArray('q', n_slots * 4)
+        self._head = ctx.RawValue('q', 0)
+        self._tail = ctx.RawValue('q', 0)
+
+        self._lock = ctx.Lock()
+        self._items = ctx.Semaphore(0)
+        self._spaces = ctx.Semaphore(n_slots)
+
+    def _slot(self, idx):
+        i = idx % self.n_slots
+        data = num.frombuffer(self._data).reshape(
+            (self.n_slots, self.slot_size))[i]
+        header = num.frombuffer(self._header, dtype='int64').reshape(
+            (self.n_slots, 4))[i]
+        return data, header
+
+    def _write_slot(self, source, tag, size, kind, payload=None):
+        """
+        Write header and payload to the next slot, caller has to hold the
+        lock to keep the slots of one message consecutive.
+        """
+        self._spaces.acquire()
+        idx = self._head.value
+        data, header = self._slot(idx)
+        if payload is not None:
+            if kind == self._array_message:
+                data[:payload.size] = payload
+            else:
+                data.view('uint8')[:payload.size] = payload
+
+        header[:] = (source, tag, size, kind)
+        self._head.value = idx + 1
+        self._items.release()
+
+    def _read_slot(self):
+        """
+        Read header and data of the oldest slot and release it.
+        """
+        idx = self._tail.value
+        data, header = self._slot(idx)
+        source, tag, size, kind = header.tolist()
+        data = data.copy()
+
+        self._tail.value = idx + 1
+        self._spaces.release()
+        return source, tag, size, kind, data
+
+    def put(self, source, tag, array=None, obj=None):
+        """
+        Write message to the channel, blocks if the channel is full.
+
+        Parameters
+        ----------
+        source : int
+            id of the sending process
+        tag : int
+            message tag
+        array : :class:`numpy.ndarray`
+            of floats to be sent
+        obj : object
+            python object to be sent, if array is None
+        """
+        if array is not None:
+            array = num.atleast_1d(array).ravel()
+            if array.size > self.slot_size:
+                raise ValueError(
+                    'Message size %i exceeds slot size %i!' % (
+                        array.size, self.slot_size))
+
+            with self._lock:
+                self._write_slot(
+                    source, tag, array.size, self._array_message, array)
+
+        elif obj is None:
+            with self._lock:
+                self._write_slot(source, tag, 0, self._object_message)
+
+        else:
+            payload = num.frombuffer(
+                pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL),
+                dtype='uint8')
+            slot_nbytes = self.slot_size * 8
+            with self._lock:
+                for i in range(0, payload.size, slot_nbytes):
+                    self._write_slot(
+                        source, tag, payload.size, self._object_message,
+                        payload[i:i + slot_nbytes])
+
+    def get(self, block=True, timeout=None):
+        """
+        Read the oldest message from the channel.
+
+        Parameters
+        ----------
+        block : bool
+            if True, waits until a message is available
+        timeout : float
+            in [s], if no message arrived until then None is returned
+
+        Returns
+        -------
+        tuple of source, tag, array, object
+        """
+        if not self._items.acquire(block, timeout):
+            return None
+
+        source, tag, size, kind, data = self._read_slot()
+        if kind == self._array_message:
+            return source, tag, data[:size], None
+
+        if size == 0:
+            return source, tag, None, None
+
+        # remaining slots of the object are written already or in progress
+        slot_nbytes = self.slot_size * 8
+        chunks = [data.view('uint8')[:min(size, slot_nbytes)]]
+        nbytes = chunks[0].size
+        while nbytes < size:
+            self._items.acquire()
+            _, _, _, _, data = self._read_slot()
+            chunks.append(
+                data.view('uint8')[:min(size - nbytes, slot_nbytes)])
+            nbytes += chunks[-1].size
+
+        obj = pickle.loads(num.concatenate(chunks).tobytes())
+        return source, tag, None, obj
+
+
+class LocalStatus(object):
+    """
+    Status of a received message of the :class:`LocalCommunicator`,
+    compatible to :class:`mpi4py.MPI.Status`.
+    """
+
+    def __init__(self):
+        self.source = ANY_SOURCE
+        self.tag = ANY_TAG
+
+    def Get_source(self):
+        return self.source
+
+    def Get_tag(self):
+        return self.tag
+
+
+class LocalRequest(object):
+    """
+    Request of a non-blocking send of the :class:`LocalCommunicator`,
+    compatible to :class:`mpi4py.MPI.Request`. Messages are copied to
+    shared memory immediately, so the request is always complete.
+    """
+
+    def Wait(self, status=None):
+        return True
+
+    def Test(self, status=None):
+        return True
+
+
+class LocalCommunicator(object):
+    """
+    Communicator for processes on a single machine that exchange messages
+    through shared memory channels instead of MPI. Implements the subset
+    of the :class:`mpi4py.MPI.Comm` interface that is used by the samplers
+    i.e. `send`, `recv` for python objects and `Send`, `Isend`, `Recv`,
+    `Iprobe` for float buffers. Messages that do not match source or tag
+    of a receive call are kept until they are requested.
+
+    Parameters
+    ----------
+    channels : list
+        of :class:`SharedMemoryChannel`, one for each process
+    rank : int
+        id of the process that owns the communicator
+    check_peers : function
+        called without arguments while waiting for messages, may raise an
+        error if other processes died
+    """
+
+    def __init__(self, channels, rank, check_peers=None):
+        self.channels = channels
+        self.rank = rank
+        self.check_peers = check_peers
+        self._pending = []
+
+    @property
+    def size(self):
+        return len(self.channels)
+
+    def Barrier(self):
+        pass
+
+    def send(self, obj, dest, tag=0):
+        self.channels[dest].put(self.rank, tag, obj=obj)
+
+    def Send(self, buf, dest, tag=0):
+        if isinstance(buf, (list, tuple)):
+            buf = buf[0]
+
+        self.channels[dest].put(
+            self.rank, tag, array=num.asarray(buf, dtype='float64'))
+
+    def _match(self, message, source, tag):
+        return (source == ANY_SOURCE or message[0] == source) and \
+            (tag == ANY_TAG or message[1] == tag)
+
+    def _receive(self, source, tag, status):
+        message = None
+        for i, pending in enumerate(self._pending):
+            if self._match(pending, source, tag):
+                message = self._pending.pop(i)
+                break
+
+        while message is None:
+            new = self.channels[self.rank].get(timeout=1.)
+            if new is None:
+                if self.check_peers is not None:
+                    self.check_peers()
+
+            elif self._match(new, source, tag):
+                message = new
+            else:
+                self._pending.append(new)
+
+        if status is not None:
+            status.source, status.tag = message[0:2]
+
+        return message
+
+    def Isend(self, buf, dest, tag=0):
+        self.Send(buf, dest, tag)
+        return LocalRequest()
+
+    def Iprobe(self, source=ANY_SOURCE, tag=ANY_TAG, status=None):
+        """
+        Check without blocking, if a matching message is available.
+        """
+        message = None
+        for pending in self._pending:
+            if self._match(pending, source, tag):
+                message = pending
+                break
+
+        while message is None:
+            new = self.channels[self.rank].get(block=False)
+            if new is None:
+                return False
+
+            self._pending.append(new)
+            if self._match(new, source, tag):
+                message = new
+
+        if status is not None:
+            status.source, status.tag = message[0:2]
+
+        return True
+
+    def recv(self, buf=None, source=ANY_SOURCE, tag=ANY_TAG, status=None):
+        _, _, array, obj = self._receive(source, tag, status)
+        if array is not None:
+            return array
+
+        return obj
+
+    def Recv(self, buf, source=ANY_SOURCE, tag=ANY_TAG, status=None):
+        if isinstance(buf, (list, tuple)):
+            buf = buf[0]
+
+        _, _, array, _ = self._receive(source, tag, status)
+        if array is not None:
+            buf[:array.size] = array
+
+
 def paripool(
         function, workpackage, nprocs=None, chunksize=1, timeout=0xFFFF,
-        initializer=None, initargs=(), worker_initializer=None, winitargs=()):
+        initializer=None, initargs=(), worker_initializer=None, winitargs=(),
+        pool=None):
     """
     Initialises a pool of workers and executes a function in parallel by
     forking the process. Does forking once during initialisation.
+    If a :class:`PersistentPool` is given, its workers are used and
+    they are kept alive after execution.
 
     Parameters
     ----------
@@ -203,6 +586,9 @@ def paripool(
         to initialize each worker process
     winitargs : tuple
         of argument to worker_initializer
+    pool : :class:`PersistentPool`
+        optional, workers are initialised by the pool, so it must not be
+        combined with an initializer
     """
 
     def start_message(*globals):
@@ -211,6 +597,11 @@ def paripool(
     def callback(result):
         logger.info('\n Feierabend! Done with the work!')
 
+    if pool is not None and initializer is not None:
+        raise ValueError(
+            'An initializer cannot be used with a persistent pool, the pool'
+            ' has to be created with the initializer!')
+
     if nprocs is None:
         nprocs = multiprocessing.cpu_count()
 
@@ -224,10 +615,15 @@ def paripool(
             yield [function(*work)]
 
     else:
-        pool = multiprocessing.Pool(
-            processes=nprocs,
-            initializer=initializer,
-            initargs=initargs)
+        if pool is None:
+            persistent = False
+            pool = PersistentPool(
+                nprocs=nprocs,
+                initializer=initializer,
+                initargs=initargs)
+        else:
+            persistent = True
+            nprocs = pool.nprocs
 
         logger.info('Worker timeout after %i second(s)' % timeout)
 
@@ -247,7 +643,7 @@ def paripool(
         logger.info('Chunksize: %i' % chunksize)
 
         try:
-            yield pool.map_async(
+            yield pool.pool.map_async(
                 _pay_worker, workers,
                 chunksize=chunksize, callback=callback).get(pool_timeout)
         except multiprocessing.TimeoutError:
@@ -258,10 +654,66 @@ def paripool(
             traceback.print_exc()
             pool.terminate()
         else:
-            pool.close()
-            pool.join()
-            # reset process counter for tqdm progressbar
-            multiprocessing.process._process_counter = count(1)
+            if not persistent:
+                pool.close()
+
+
+def get_thread_pool(nthreads):
+    """
+    Get a pool of threads, which is kept for subsequent calls.
+    Pools are specific to the process, forked processes create their own.
+
+    Parameters
+    ----------
+    nthreads : int
+        number of threads of the pool
+
+    Returns
+    -------
+    :class:`multiprocessing.pool.ThreadPool`
+    """
+    key = (os.getpid(), nthreads)
+    if key not in _thread_pools:
+        logger.debug('Starting pool of %i threads ...' % nthreads)
+        _thread_pools[key] = ThreadPool(processes=nthreads)
+
+    return _thread_pools[key]
+
+
+def thread_map(function, workpackage, nthreads=1):
+    """
+    Execute a function on each work package in a pool of threads.
+    Useful for functions that spend most of their time in numpy or C
+    extensions that release the GIL.
+
+    Parameters
+    ----------
+    function : function
+        python function to be executed in parallel
+    workpackage : list
+        of arguments to the function
+    nthreads : int
+        number of threads to be used
+
+    Returns
+    -------
+    list of function results in the order of the workpackage
+    """
+    if nthreads <= 1 or len(workpackage) <= 1:
+        return [function(work) for work in workpackage]
+
+    return get_thread_pool(nthreads).map(function, workpackage)
+
+
+@atexit.register
+def close_thread_pools():
+    """
+    Terminate the thread pools of this process.
+    """
+    pid = os.getpid()
+    for key in list(_thread_pools.keys()):
+        if key[0] == pid:
+            _thread_pools.pop(key).terminate()
 
 
 def memshare(parameternames):
@@ -503,7 +503,7 @@ def plot_cov(target, point_size=20):
     ax = plt.axes()
     im = ax.scatter(
         target.lons, target.lats, point_size,
-        num.array(target.covariance.pred_v.sum(axis=0)).flatten(),
+        num.array(target.covariance.pred_v_dense.sum(axis=0)).flatten(),
         edgecolors='none')
     plt.colorbar(im)
     plt.title('Prediction Covariance [m2] %s' % target.name)
@@ -546,7 +546,7 @@ def get_result_point(stage, config, point_llk='max'):
     """
     if point_llk != 'None':
         sampler_name = config.sampler_config.name
-        if sampler_name == 'Metropolis':
+        if sampler_name in ['Metropolis', 'HMC']:
             if stage.step is None:
                 raise AttributeError(
                     'Loading Metropolis results requires'
@@ -2337,6 +2337,21 @@ def traceplot(trace, varnames=None, transform=lambda x: x, figsize=None,
     return fig, axs, varbins
 
 
+def get_metropolis_chain_length(sc):
+    """
+    Number of samples of each Metropolis (or HMC) chain in the traces.
+
+    Parameters
+    ----------
+    sc : :class:`config.SamplerConfig`
+
+    Returns
+    -------
+    int
+    """
+    return int(num.ceil(sc.parameters.n_steps / float(sc.buffer_thinning)))
+
+
 def select_transform(sc, n_steps=None):
     """
     Select transform function to be applied after loading the sampling results.
@@ -2379,7 +2394,7 @@ def select_transform(sc, n_steps=None):
 
     if sc.name == 'SMC':
         return last_sample
-    elif sc.name == 'Metropolis' or sc.name == 'PT':
+    elif sc.name in ['Metropolis', 'PT', 'HMC']:
         return burn_sample
 
 
@@ -2428,8 +2443,8 @@ def draw_posteriors(problem, plot_options):
     for s in list_indexes:
         if s == 0:
             draws = 1
-        elif s == -1 and not hypers and sc.name == 'Metropolis':
-            draws = sc.parameters.n_steps * (sc.parameters.n_stages - 1) + 1
+        elif s == -1 and not hypers and sc.name in ['Metropolis', 'HMC']:
+            draws = get_metropolis_chain_length(sc)
         else:
             draws = None
 
@@ -2452,7 +2467,7 @@ def draw_posteriors(problem, plot_options):
                 model=problem.model, stage_number=s,
                 load='trace', chains=[-1])
 
-            if sc.name == 'Metropolis' and po.post_llk != 'all':
+            if sc.name in ['Metropolis', 'HMC'] and po.post_llk != 'all':
                 chains = select_metropolis_chains(
                     problem, stage.mtrace, po.post_llk)
                 logger.info('plotting result: %s of Metropolis chain %i' % (
@@ -2525,8 +2540,9 @@ def draw_correlation_hist(problem, plot_options):
         raise TypeError('Need at least two parameters to compare!'
                         'Found only %i variables! ' % len(varnames))
 
-    if po.load_stage is None and not hypers and sc.name == 'Metropolis':
-        draws = sc.parameters.n_steps * (sc.parameters.n_stages - 1) + 1
+    if po.load_stage is None and not hypers and \
+            sc.name in ['Metropolis', 'HMC']:
+        draws = get_metropolis_chain_length(sc)
     else:
         draws = None
 
@@ -2534,7 +2550,7 @@ def draw_correlation_hist(problem, plot_options):
 
     stage = load_stage(problem, stage_number=po.load_stage, load='trace', chains=[-1])
 
-    if sc.name == 'Metropolis' and po.post_llk != 'all':
+    if sc.name in ['Metropolis', 'HMC'] and po.post_llk != 'all':
         chains = select_metropolis_chains(problem, stage.mtrace, po.post_llk)
         logger.info('plotting result: %s of Metropolis chain %i' % (
             po.post_llk, chains))
@@ -3135,8 +3151,8 @@ def draw_slip_dist(problem, po):
     fault = gc.load_fault_geometry()
 
     sc = problem.config.sampler_config
-    if po.load_stage is None and sc.name == 'Metropolis':
-        draws = sc.parameters.n_steps * (sc.parameters.n_stages - 1) + 1
+    if po.load_stage is None and sc.name in ['Metropolis', 'HMC']:
+        draws = get_metropolis_chain_length(sc)
     else:
         draws = None
 
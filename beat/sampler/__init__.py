@@ -2,4 +2,6 @@ from .metropolis import * # noqa
 from .smc import * # noqa
 from .pt import * # noqa
 from .base import * # noqa
+from .surrogate import * # noqa
+from .hmc import * # noqa
 from .distributed import * # noqa
\ No newline at end of file
@@ -1,19 +1,22 @@
 import logging
 from copy import deepcopy
+from itertools import count
 import os
 import shutil
 
 from beat import parallel
 from beat.backend import check_multitrace, load_multitrace, backend_catalog, \
-                         MemoryChain
-from beat.utility import list2string
+                         MemoryChain, dump_stage_draws
+from beat.config import stage_draws_outname, worker_state_outname
+from beat.utility import list2string, dump_objects, load_objects
 
 from numpy.random import seed, randint
 from numpy.random import normal, standard_cauchy, standard_exponential, \
-    poisson
+    poisson, uniform
 import numpy as np
 
 from theano import function
+from theano import config as tconfig
 
 from pymc3.model import modelcontext, Point
 from pymc3 import CompoundStep
@@ -29,8 +32,11 @@ logger = logging.getLogger('sampler')
 __all__ = [
     'choose_proposal',
     'iter_parallel_chains',
+    'iter_population_chains',
+    'init_persistent_pool',
     'init_stage',
-    'available_proposals']
+    'available_proposals',
+    'population_proposals']
 
 
 def multivariate_t_rvs(mean, cov, df=np.inf, size=1):
@@ -72,6 +78,76 @@ def multivariate_t_rvs(mean, cov, df=np.inf, size=1):
     return m + z / np.sqrt(x)[:, None]
 
 
+def autocorrelation(x):
+    """
+    Estimate the normalised autocorrelation function of a 1-d series
+    using the FFT.
+
+    Parameters
+    ----------
+    x : :class:`numpy.ndarray` 1-d
+        e.g. samples of one chain
+
+    Returns
+    -------
+    :class:`numpy.ndarray` 1-d
+        autocorrelation for lags 0 to x.size - 1
+    """
+    x = np.atleast_1d(x).astype('float64')
+    n = x.size
+    nfft = 2 ** int(np.ceil(np.log2(2 * n)))
+    f = np.fft.rfft(x - x.mean(), n=nfft)
+    acf = np.fft.irfft(f * np.conjugate(f), n=nfft)[:n]
+    return acf / acf[0]
+
+
+def integrated_autocorrelation_time(x, c=5.):
+    """
+    Estimate the integrated autocorrelation time of a 1-d series with the
+    automated windowing procedure after Sokal (1989).
+    Series without variation (no accepted steps) return their length.
+
+    Parameters
+    ----------
+    x : :class:`numpy.ndarray` 1-d
+        e.g. samples of one chain
+    c : float
+        window factor
+
+    Returns
+    -------
+    float, autocorrelation time in samples
+    """
+    x = np.atleast_1d(x)
+    if x.size < 2 or np.allclose(x, x[0]):
+        return float(x.size)
+
+    taus = 2. * np.cumsum(autocorrelation(x)) - 1.
+    window = np.arange(taus.size) < c * taus
+    if window.all():
+        return float(taus[-1])
+    else:
+        return float(taus[np.argmin(window)])
+
+
+def effective_sample_size(x, c=5.):
+    """
+    Estimate the effective sample size of a 1-d series.
+
+    Parameters
+    ----------
+    x : :class:`numpy.ndarray` 1-d
+        e.g. samples of one chain
+    c : float
+        window factor for the autocorrelation time estimate
+
+    Returns
+    -------
+    float, effective number of independent samples
+    """
+    return np.atleast_1d(x).size / integrated_autocorrelation_time(x, c=c)
+
+
 class Proposal(object):
     """
     Proposal distributions modified from pymc3 to initially create all the
@@ -182,6 +258,108 @@ class MultivariateCauchyProposal(Proposal):
             cov=self.scale, df=1, size=num_draws)
 
 
+class DifferentialEvolutionProposal(Proposal):
+    """
+    Differential evolution proposal (DE-MC, ter Braak 2006) that draws
+    difference vectors of two randomly chosen members of a population of
+    points, which is kept fixed during sampling.
+    Supports the snooker update (ter Braak & Vrugt 2008) that moves along
+    the line between the current point and a population member.
+
+    Parameters
+    ----------
+    scale : :class:`numpy.ndarray`
+        population of points in array space, (n_population, n_dim)
+    gamma : float
+        factor for the difference vectors, default: 2.38 / sqrt(2 * n_dim)
+    mode_jump_prob : float
+        probability of proposals with gamma = 1., to jump between modes
+    noise : float
+        standard deviation of additional Gaussian noise, relative to the
+        standard deviation of the population
+    snooker_prob : float
+        probability of snooker updates
+    """
+    def __init__(self, scale, gamma=None, mode_jump_prob=0.1, noise=1e-3,
+                 snooker_prob=0.1):
+        super(DifferentialEvolutionProposal, self).__init__(scale)
+        self.scale = np.atleast_2d(self.scale)
+
+        n_dim = self.scale.shape[1]
+        if gamma is None:
+            gamma = 2.38 / np.sqrt(2 * n_dim)
+
+        self.gamma = gamma
+        self.mode_jump_prob = mode_jump_prob
+        self.snooker_prob = snooker_prob
+        self.noise_scale = noise * self.scale.std(axis=0)
+
+    @property
+    def n_population(self):
+        return self.scale.shape[0]
+
+    def _draw_pairs(self, size):
+        r1 = randint(self.n_population, size=size)
+        r2 = (r1 + randint(1, self.n_population, size=size)) % \
+            self.n_population
+        return r1, r2
+
+    def __call__(self, num_draws=None):
+        size = num_draws or 1
+        n_dim = self.scale.shape[1]
+
+        delta = normal(size=(size, n_dim)) * self.noise_scale
+        if self.n_population > 1:
+            gamma = np.full(size, self.gamma)
+            gamma[uniform(size=size) < self.mode_jump_prob] = 1.
+            r1, r2 = self._draw_pairs(size)
+            delta += gamma[:, np.newaxis] * (
+                self.scale[r1, :] - self.scale[r2, :])
+
+        if num_draws is None:
+            return delta[0]
+        else:
+            return delta
+
+    def snooker(self, q0):
+        """
+        Snooker update of the given point.
+
+        Parameters
+        ----------
+        q0 : :class:`numpy.ndarray`
+            current point in array space
+
+        Returns
+        -------
+        delta : :class:`numpy.ndarray`
+            step from the current to the proposed point
+        log_jacobian : float
+            logarithm of the Jacobian of the update, has to be added to the
+            log acceptance ratio
+        """
+        if self.n_population < 3:
+            return np.zeros_like(q0), 0.
+
+        z = self.scale[randint(self.n_population), :]
+        direction = q0 - z
+        norm0 = np.sqrt(direction.dot(direction))
+        if norm0 == 0.:
+            return np.zeros_like(q0), 0.
+
+        r1, r2 = self._draw_pairs(1)
+        projection = (self.scale[r1[0], :] - self.scale[r2[0], :]).dot(
+            direction) / norm0 ** 2
+        delta = uniform(1.2, 2.2) * projection * direction
+
+        norm1 = np.sqrt((q0 + delta - z).dot(q0 + delta - z))
+        if norm1 == 0.:
+            return np.zeros_like(q0), 0.
+
+        log_jacobian = (q0.size - 1) * (np.log(norm1) - np.log(norm0))
+        return delta, log_jacobian
+
+
 proposal_distributions = {
     'Cauchy': CauchyProposal,
     'Poisson': PoissonProposal,
@@ -189,11 +367,15 @@ proposal_distributions = {
     'Laplace': LaplaceProposal,
     'MultivariateNormal': MultivariateNormalProposal,
     'MultivariateCauchy': MultivariateCauchyProposal,
+    'DifferentialEvolution': DifferentialEvolutionProposal,
     'DiscreteBoundedUniform': DiscreteBoundedUniformProposal}
 
 
 multivariate_proposals = ['MultivariateCauchy', 'MultivariateNormal']
 
+# proposals that are initialised with the sampler population as scale
+population_proposals = ['DifferentialEvolution']
+
 
 def available_proposals():
     return list(proposal_distributions.keys())
@@ -263,15 +445,31 @@ def _sample(draws, step=None, start=None, trace=None, chain=0, tune=None,
         logger.debug('Accessing shared memory')
         parallel.borrow_all_memories(shared_params, parallel._shared_memory)
 
-    sampling = _iter_sample(draws, step, start, trace, chain,
-                            tune, model, random_seed)
+    draw_offset = 0
+    overwrite = True
+    checkpoint = load_chain_checkpoint(trace, step, chain, draws)
+    if checkpoint is not None:
+        logger.info(
+            'Resuming chain %i from sample %i' % (chain, checkpoint['draw']))
+        start = checkpoint['point']
+        step.apply_sampler_state(checkpoint['chain_state'])
+        step.chain_previous_lpoint[chain] = checkpoint['lpoint']
+        np.random.set_state(checkpoint['rng_state'])
+        trace.stored_rows = checkpoint['n_stored']
+        draw_offset = checkpoint['draw']
+        random_seed = -1
+        overwrite = False
+
+    sampling = _iter_sample(draws - draw_offset, step, start, trace, chain,
+                            tune, model, random_seed, overwrite=overwrite,
+                            draw_offset=draw_offset)
 
     n = parallel.get_process_id()
 
     if progressbar:
         sampling = tqdm(
             sampling,
-            total=draws,
+            total=draws - draw_offset,
             desc='chain: %i worker %i' % (chain, n),
             position=n,
             leave=False,
@@ -297,14 +495,174 @@ def _sample(draws, step=None, start=None, trace=None, chain=0, tune=None,
     return chain
 
 
+# step and model kept resident in the persistent worker processes
+_worker_step = None
+_worker_model = None
+
+# id and chain attributes of the stage state applied to the worker step
+_worker_state_id = None
+_worker_chain_state = None
+
+# ids of the stage states dispatched by the master process
+_worker_state_ids = count()
+
+
+def _init_persistent_worker(step, model):
+    """
+    Initialise the sampler step and model of a persistent worker process.
+    """
+    global _worker_step, _worker_model
+    _worker_step = step
+    _worker_model = model
+
+
+def _sample_persistent(draws, state_path, state_id, start, chain_lpoint,
+                       chain, trace_kwargs, progressbar, random_seed):
+    """
+    Sample one chain with the step object that is resident in the
+    persistent worker process. The stage state is loaded once per stage,
+    the chain attributes are reset for every chain.
+    """
+    global _worker_state_id, _worker_chain_state
+
+    step = _worker_step
+    if state_id != _worker_state_id:
+        state = load_objects(state_path)
+        step.apply_sampler_state(state)
+        _worker_chain_state = {
+            k: v for k, v in state.items()
+            if k in step._chain_state_attributes}
+        _worker_state_id = state_id
+
+    step.apply_sampler_state(deepcopy(_worker_chain_state))
+    step.chain_previous_lpoint[chain] = chain_lpoint
+
+    trace = backend_catalog[step.backend](
+        model=_worker_model, **trace_kwargs)
+
+    return _sample(
+        draws, step, start, trace, chain, None, progressbar,
+        _worker_model, random_seed)
+
+
+def init_persistent_pool(step, model, n_jobs):
+    """
+    Initialise a pool of worker processes that keeps the sampler step,
+    the compiled model and the data resident across sampling stages.
+
+    Parameters
+    ----------
+    step : step object of the sampler class, e.g.:
+        :class:`beat.sampler.Metropolis`, :class:`beat.sampler.SMC`
+    model : :class:`pymc3.model.Model` instance
+    n_jobs : int
+        number of worker processes
+
+    Returns
+    -------
+    :class:`beat.parallel.PersistentPool` or None if n_jobs < 2
+    """
+    if n_jobs > 1:
+        return parallel.PersistentPool(
+            nprocs=n_jobs,
+            initializer=_init_persistent_worker,
+            initargs=(step, model))
+    else:
+        return None
+
+
+def get_chain_checkpoint(step, point, chain, draw, draws):
+    """
+    Return the sampler state of a chain at the given sample.
+
+    Parameters
+    ----------
+    step : step object of the sampler class, e.g.:
+        :class:`beat.sampler.Metropolis`, :class:`beat.sampler.SMC`
+    point : :func:`pymc3.Point`
+        current point of the chain
+    chain : int
+        Chain number
+    draw : int
+        number of samples of the chain drawn so far
+    draws : int
+        total number of samples of the chain
+
+    Returns
+    -------
+    dict of chain checkpoint
+    """
+    try:
+        lpoint = step.chain_previous_lpoint[chain]
+    except IndexError:
+        lpoint = []
+
+    return dict(
+        stage=step.stage,
+        beta=step.beta,
+        draw=draw,
+        draws=draws,
+        point=deepcopy(point),
+        lpoint=deepcopy(lpoint),
+        chain_state=deepcopy(step.get_chain_state()))
+
+
+def load_chain_checkpoint(trace, step, chain, draws):
+    """
+    Load the checkpoint of an incomplete chain, if it is consistent with the
+    current sampler state and the samples written to the trace.
+
+    Parameters
+    ----------
+    trace : :class:`beat.backend.FileChain`
+    step : step object of the sampler class, e.g.:
+        :class:`beat.sampler.Metropolis`, :class:`beat.sampler.SMC`
+    chain : int
+        Chain number
+    draws : int
+        total number of samples of the chain
+
+    Returns
+    -------
+    dict of chain checkpoint or None if chain cannot be resumed
+    """
+    if not hasattr(trace, 'load_checkpoint'):
+        return None
+
+    checkpoint = trace.load_checkpoint(chain)
+    if checkpoint is None:
+        return None
+
+    if checkpoint['stage'] != step.stage or \
+            checkpoint['beta'] != step.beta or \
+            checkpoint['draws'] != draws or \
+            not 0 < checkpoint['draw'] < draws:
+        logger.debug('Checkpoint of chain %i not applicable.' % chain)
+        return None
+
+    trace.setup(draws, chain, overwrite=False)
+    n_stored = len(trace)
+    trace.clear_data()
+    if n_stored != checkpoint['n_stored']:
+        logger.warning(
+            'Samples of chain %i (%i) inconsistent with checkpoint (%i)!'
+            ' Restarting chain.' % (chain, n_stored, checkpoint['n_stored']))
+        return None
+
+    return checkpoint
+
+
 def _iter_sample(draws, step, start=None, trace=None, chain=0, tune=None,
                  model=None, random_seed=-1, overwrite=True,
-                 update_proposal=False, keep_last=False):
+                 update_proposal=False, keep_last=False, draw_offset=0):
     """
     Modified from :func:`pymc3.sampling._iter_sample`
 
     tune: int
         adaptiv step-size scaling is stopped after this chain sample
+    draw_offset : int
+        number of samples of the chain that have been drawn before,
+        when resuming a chain from its checkpoint
     """
 
     model = modelcontext(model)
@@ -340,6 +698,8 @@ def _iter_sample(draws, step, start=None, trace=None, chain=0, tune=None,
         try:
             trace.buffer_write(out_list, step.cumulative_samples)
         except BufferError:     # buffer full
+            trace.checkpoint = get_chain_checkpoint(
+                step, point, chain, draw_offset + i + 1, draw_offset + draws)
             last_sample = deepcopy(trace.buffer[-1])
             if update_proposal:     # only valid for PT for now
                 if step.proposal_name in multivariate_proposals:
@@ -393,7 +753,7 @@ def init_chain_hypers(problem):
 def iter_parallel_chains(
         draws, step, stage_path, progressbar, model, n_jobs,
         chains=None, initializer=None, initargs=(),
-        buffer_size=5000, buffer_thinning=1, chunksize=None):
+        buffer_size=5000, buffer_thinning=1, chunksize=None, pool=None):
     """
     Do Metropolis sampling over all the chains with each chain being
     sampled 'draws' times. Parallel execution according to n_jobs.
@@ -430,6 +790,10 @@ def iter_parallel_chains(
         every nth sample of the buffer is written to disk
     chunksize : int
         number of chains to sample within each process
+    pool : :class:`beat.parallel.PersistentPool`
+        optional, workers that have the step and model resident, see
+        :func:`init_persistent_pool`. Only the changed sampler state is
+        send to the workers, once per call.
 
     Returns
     -------
@@ -454,21 +818,45 @@ def iter_parallel_chains(
         if n_chains > 100:
             setup_chain_counter(n_chains, n_jobs)
 
-        logger.info('Initialising %i chain traces ...' % n_chains)
-        for chain in chains:
-            trace_list.append(
-                backend_catalog[step.backend](
-                    dir_path=stage_path, model=model,
-                    buffer_thinning=buffer_thinning,
-                    buffer_size=buffer_size, progressbar=progressbar))
-
         max_int = np.iinfo(np.int32).max
         random_seeds = [randint(max_int) for _ in range(n_chains)]
 
-        work = [(draws, step, step.population[step.resampling_indexes[chain]],
-                trace, chain, None, progressbar, model, rseed)
-                for chain, rseed, trace in zip(
-                    chains, random_seeds, trace_list)]
+        if pool is not None and n_jobs > 1:
+            # traces are created in the workers to avoid pickling the model
+            if not os.path.exists(stage_path):
+                os.mkdir(stage_path)
+
+            trace_kwargs = dict(
+                dir_path=stage_path,
+                buffer_thinning=buffer_thinning,
+                buffer_size=buffer_size, progressbar=progressbar)
+
+            # the stage state is send to each worker only once
+            state_path = os.path.join(stage_path, worker_state_outname)
+            dump_objects(state_path, step.get_worker_state())
+            state_id = next(_worker_state_ids)
+
+            work = [(draws, state_path, state_id,
+                     step.population[step.resampling_indexes[chain]],
+                     step.chain_previous_lpoint[chain], chain,
+                     trace_kwargs, progressbar, rseed)
+                    for chain, rseed in zip(chains, random_seeds)]
+            task = _sample_persistent
+        else:
+            logger.info('Initialising %i chain traces ...' % n_chains)
+            for chain in chains:
+                trace_list.append(
+                    backend_catalog[step.backend](
+                        dir_path=stage_path, model=model,
+                        buffer_thinning=buffer_thinning,
+                        buffer_size=buffer_size, progressbar=progressbar))
+
+            work = [(draws, step,
+                     step.population[step.resampling_indexes[chain]],
+                     trace, chain, None, progressbar, model, rseed)
+                    for chain, rseed, trace in zip(
+                        chains, random_seeds, trace_list)]
+            task = _sample
 
         tps = step.time_per_sample(np.minimum(n_jobs, 10))
         logger.info('Serial time per sample: %f' % tps)
@@ -506,12 +894,13 @@ def iter_parallel_chains(
             logger.info('Not using shared memory.')
 
         p = parallel.paripool(
-            _sample, work,
+            task, work,
             chunksize=chunksize,
             timeout=timeout,
             nprocs=n_jobs,
             initializer=initializer,
-            initargs=initargs)
+            initargs=initargs,
+            pool=pool)
 
         logger.info('Sampling ...')
 
@@ -537,6 +926,167 @@ def iter_parallel_chains(
     return mtrace
 
 
+def iter_population_chains(
+        draws, step, stage_path, progressbar, model,
+        chains=None, buffer_size=5000, buffer_thinning=1, prefetch=None,
+        stage_controller=None):
+    """
+    Do Metropolis sampling over all the chains synchronously within one
+    process. At each step, the proposals of all chains are drawn and
+    prescreened first, the forward model is evaluated for the surviving
+    proposals of the whole population in one batch (if 'prefetch' is
+    given), subsequently the Metropolis select is done for each chain.
+
+    Parameters
+    ----------
+    draws : int
+        number of steps that are taken within each Markov Chain
+    step : step object of the sampler class, e.g.:
+        :class:`beat.sampler.Metropolis`, :class:`beat.sampler.SMC`,
+        has to sample all free variables of the model
+    stage_path : str
+        with absolute path to the directory where to store the sampling results
+    progressbar : boolean
+        flag for displaying a progressbar
+    model : :class:`pymc3.model.Model` instance
+        holds definition of the forward problem
+    chains : list
+        of integers to the chain numbers, if None then all chains from the
+        step object are sampled
+    buffer_size : int
+        this is the number of samples after which the buffer is written to disk
+        or if the chain end is reached
+    buffer_thinning : int
+        every nth sample of the buffer is written to disk
+    prefetch : function
+        that calculates the synthetics for a list of
+        :func:`pymc3.Point` in one batch,
+        e.g. :meth:`beat.models.Problem.prefetch_synthetics`, if None
+        the forward model is evaluated for each chain separately
+    stage_controller : :class:`beat.sampler.smc.StageLengthController`
+        optional, if given sampling is stopped before 'draws' once the
+        chains are decorrelated
+
+    Returns
+    -------
+    MultiTrace object
+    """
+    varnames = [var.name for var in model.unobserved_RVs]
+
+    if chains is None:
+        chains = list(range(step.n_chains))
+
+    draws = int(draws)
+
+    if len(step.shared) > 0:
+        raise ValueError(
+            'Population sampling requires all model variables to be sampled'
+            ' by the step, got shared variables: %s' % list2string(
+                list(step.shared.keys())))
+
+    if len(chains) > 0:
+        # proposals of a previous, early stopped stage must not be continued
+        step.stage_sample = 0
+        step.proposal_samples_array = step.proposal_dist(
+            step.n_steps).astype(tconfig.floatX)
+
+        draws_path = os.path.join(stage_path, stage_draws_outname)
+        if len(chains) == step.n_chains and os.path.exists(draws_path):
+            os.remove(draws_path)
+
+        logger.info('Initialising %i chain traces ...' % len(chains))
+        traces = []
+        q0s = []
+        chain_states = []
+        for chain in chains:
+            trace = backend_catalog[step.backend](
+                dir_path=stage_path, model=model,
+                buffer_thinning=buffer_thinning,
+                buffer_size=buffer_size, progressbar=progressbar)
+            trace.setup(draws, chain, overwrite=True)
+            traces.append(trace)
+
+            start = Point(
+                step.population[step.resampling_indexes[chain]], model=model)
+            q0s.append(step.bij.map(start))
+            chain_states.append(step.get_chain_state())
+
+        sampling = range(draws)
+        if progressbar:
+            sampling = tqdm(
+                sampling, total=draws, desc='population', ncols=65)
+
+        if stage_controller is not None:
+            llks = np.zeros((draws, len(chains)))
+
+        logger.info('Sampling population ...')
+        n_draws = draws
+        for i in sampling:
+            if step.stage == 0:
+                qs = q0s
+                screens = [(True, 0.)] * len(chains)
+            else:
+                qs = []
+                screens = []
+                surrogates = []
+                for j, chain in enumerate(chains):
+                    step.chain_index = chain
+                    step.apply_sampler_state(chain_states[j])
+                    q = step.propose(q0s[j])
+                    qs.append(q)
+                    # bounds and prescreen before the batch forward model
+                    screens.append(step.screen(q0s[j], q))
+                    surrogates.append(step._proposed_surrogate)
+                    chain_states[j] = step.get_chain_state()
+
+            if prefetch is not None and not step.emulate:
+                prefetch([
+                    step.bij.rmap(q) for q, (passed, _) in zip(qs, screens)
+                    if passed])
+
+            for j, (chain, trace) in enumerate(zip(chains, traces)):
+                step.chain_index = chain
+                step.apply_sampler_state(chain_states[j])
+                if step.stage == 0:
+                    q_new, out_list = step.astep(q0s[j])
+                else:
+                    step._proposed_surrogate = surrogates[j]
+                    q_new, out_list = step.select(
+                        q0s[j], qs[j], screened=screens[j])
+
+                chain_states[j] = step.get_chain_state()
+                q0s[j] = q_new
+
+                try:
+                    trace.buffer_write(out_list, step.cumulative_samples)
+                except BufferError:     # buffer full
+                    trace.checkpoint = get_chain_checkpoint(
+                        step, step.bij.rmap(q_new), chain, i + 1, draws)
+                    trace.record_buffer()
+
+                if stage_controller is not None:
+                    llks[i, j] = np.ravel(out_list[step._llk_index])[0]
+
+            if stage_controller is not None and \
+                    (i + 1) % stage_controller.check_interval == 0:
+                if stage_controller.is_decorrelated(llks[:i + 1]):
+                    logger.info(
+                        'Chains decorrelated after %i steps,'
+                        ' stopping stage.' % (i + 1))
+                    n_draws = i + 1
+                    break
+
+        for trace in traces:
+            trace.draws = n_draws
+            trace.record_buffer()
+
+        if n_draws != draws:
+            dump_stage_draws(stage_path, n_draws)
+
+    return load_multitrace(
+        dirname=stage_path, varnames=varnames, backend=step.backend)
+
+
 def logp_forw(out_vars, vars, shared):
     """
     Compile Theano function of the model and the input and output variables.
@@ -589,11 +1139,16 @@ def init_stage(
 
 def update_last_samples(
         homepath, step,
-        progressbar=False, model=None, n_jobs=1, rm_flag=False):
+        progressbar=False, model=None, n_jobs=1, rm_flag=False, pool=None,
+        prefix='trans'):
     """
     Resampling the last stage samples with the updated covariances and
     accept the new sample.
 
+    The samples are written to the directory 'prefix_stage_<stage>', so
+    that several updates of the same stage do not overwrite each other,
+    e.g. 'trans' for covariance and 'resolution' for resolution updates.
+
     Return
     ------
     mtrace : multitrace
@@ -604,7 +1159,7 @@ def update_last_samples(
     draws = 1
     step.stage = 0
     trans_stage_path = os.path.join(
-        homepath, 'trans_stage_%i' % tmp_stage)
+        homepath, '%s_stage_%i' % (prefix, tmp_stage))
     logger.info('in %s' % trans_stage_path)
 
     if os.path.exists(trans_stage_path) and rm_flag:
@@ -621,7 +1176,8 @@ def update_last_samples(
         'progressbar': progressbar,
         'model': model,
         'n_jobs': n_jobs,
-        'chains': chains}
+        'chains': chains,
+        'pool': pool}
 
     mtrace = iter_parallel_chains(**sample_args)
 
@@ -0,0 +1,345 @@
+"""
+Hamiltonian Monte Carlo sampling of the variables the model likelihood is
+differentiable to, e.g. the slip distribution of the linear finite fault
+problem, within a Gibbs scheme. The remaining variables, e.g. the rupture
+nucleation point and velocities that enter the non-differentiable rupture
+front calculation, are updated by Metropolis steps with the differentiable
+variables kept fixed.
+"""
+import logging
+
+import numpy as num
+
+import theano.tensor as tt
+
+from pymc3.vartypes import discrete_types
+from pymc3.model import modelcontext
+from pymc3.step_methods.metropolis import metrop_select
+from pymc3.theanof import inputvars
+
+from beat.utility import list2string
+from .base import logp_forw, population_proposals
+from .metropolis import Metropolis
+
+
+logger = logging.getLogger('hmc')
+
+
+__all__ = [
+    'HamiltonianMonteCarlo',
+    'get_array_bounds']
+
+
+def get_array_bounds(ordering, model):
+    """
+    Get the lower and upper bounds of the uniform priors of the variables
+    in array space.
+
+    Parameters
+    ----------
+    ordering : :class:`pymc3.blocking.ArrayOrdering`
+        of the sampled variables
+    model : :class:`pymc3.Model`
+
+    Returns
+    -------
+    lower : :class:`numpy.ndarray`
+        -inf where the variable is unbounded
+    upper : :class:`numpy.ndarray`
+        inf where the variable is unbounded
+    """
+    lower = num.full(ordering.size, -num.inf)
+    upper = num.full(ordering.size, num.inf)
+
+    for name, slc, shp, _ in ordering.vmap:
+        dist = model.named_vars[name].distribution
+        for attribute, bounds in (('lower', lower), ('upper', upper)):
+            if hasattr(dist, attribute):
+                bounds[slc] = num.broadcast_to(
+                    getattr(dist, attribute).eval(), shp).ravel()
+
+    return lower, upper
+
+
+class HamiltonianMonteCarlo(Metropolis):
+    """
+    Hamiltonian Monte Carlo sampler (Neal 2011) within a Gibbs scheme.
+
+    Each step consists of a Hamiltonian trajectory for the gradient
+    variables and a Metropolis step for the remaining variables.
+    Trajectories are reflected at the bounds of the uniform priors.
+    The leapfrog step size is tuned towards the target acceptance rate.
+
+    Parameters
+    ----------
+    vars : list
+        List of variables for sampler
+    out_vars : list
+        List of output variables for trace recording. If empty unobserved_RVs
+        are taken.
+    gradient_vars : list
+        of variables that are updated by Hamiltonian trajectories, the model
+        likelihood has to be differentiable with respect to them;
+        if None all continuous variables are taken
+    n_leapfrog : int
+        maximum number of leapfrog steps of a trajectory, the number of steps
+        is drawn uniformly between 1 and n_leapfrog
+    step_size : float
+        initial leapfrog step size relative to the prior standard deviations
+    target_accept : float
+        acceptance rate of the trajectories the step size is tuned towards
+    model : :class:`pymc3.Model`
+        Optional model for sampling step.
+        Defaults to None (taken from context).
+    kwargs : see :class:`beat.sampler.Metropolis`
+        for the Metropolis steps of the remaining variables
+    """
+
+    _chain_state_attributes = Metropolis._chain_state_attributes + [
+        'step_size',
+        'accept_prob_sum']
+
+    def __init__(self, vars=None, out_vars=None, gradient_vars=None,
+                 n_leapfrog=20, step_size=0.1, target_accept=0.8,
+                 model=None, **kwargs):
+
+        model = modelcontext(model)
+
+        if vars is None:
+            vars = model.vars
+
+        vars = inputvars(vars)
+
+        if out_vars is None:
+            out_vars = model.unobserved_RVs
+
+        if gradient_vars is None:
+            gradient_vars = [
+                var for var in vars if var.dtype not in discrete_types]
+
+        gradient_varnames = [var.name for var in gradient_vars]
+
+        if len(gradient_varnames) == 0:
+            raise ValueError('Need at least one gradient variable!')
+
+        for var in vars:
+            if var.name in gradient_varnames and var.dtype in discrete_types:
+                raise TypeError(
+                    'Gradient variable "%s" has to be continuous!' % var.name)
+
+        proposal_name = kwargs.get('proposal_name', 'MultivariateNormal')
+        if proposal_name in population_proposals:
+            raise ValueError(
+                'Population proposal "%s" is not supported for the Metropolis'
+                ' steps of the Gibbs scheme!' % proposal_name)
+
+        super(HamiltonianMonteCarlo, self).__init__(
+            vars=vars, out_vars=out_vars, model=model, **kwargs)
+
+        # gradient variables in the order of the array space
+        gradient_vars = [var for var in vars if var.name in gradient_varnames]
+
+        self.gradient_mask = num.zeros(self.ordering.size, dtype=bool)
+        for var in gradient_vars:
+            self.gradient_mask[self.ordering.by_name[var.name].slc] = True
+
+        self.n_metropolis = int((~self.gradient_mask).sum())
+
+        lower, upper = get_array_bounds(self.ordering, model)
+        self.lower = lower[self.gradient_mask]
+        self.upper = upper[self.gradient_mask]
+
+        # diagonal mass matrix from the prior variances
+        inv_mass = (self.upper - self.lower) ** 2 / 12.
+        inv_mass[~num.isfinite(inv_mass)] = 1.
+        self.inv_mass = inv_mass
+
+        self.n_leapfrog = n_leapfrog
+        self.step_size = step_size
+        self.target_accept = target_accept
+        self.accept_prob_sum = 0.
+
+        # likelihood gradients at the current points of the chains, with the
+        # chain_previous_lpoint they belong to, which is replaced on
+        # acceptance of a Metropolis step
+        self._chain_gradients = {}
+
+        llk = out_vars[self._llk_index]
+        dllk = tt.concatenate([
+            tt.flatten(grad) for grad in tt.grad(
+                llk.sum(), gradient_vars, disconnected_inputs='ignore')])
+
+        shared = {
+            model.named_vars[name]: share
+            for name, share in self.shared.items()}
+        self.logp_dlogp = logp_forw(list(out_vars) + [dllk], vars, shared)
+
+        logger.info(
+            'Hamiltonian Monte Carlo for: %s' % list2string(gradient_varnames))
+        if self.n_metropolis:
+            logger.info(
+                'Metropolis steps for: %s' % list2string(
+                    [var.name for var in vars
+                     if var.name not in gradient_varnames]))
+
+    def _sampler_state_blacklist(self):
+        bl = super(HamiltonianMonteCarlo, self)._sampler_state_blacklist()
+        bl.extend(['logp_dlogp', '_chain_gradients'])
+        return bl
+
+    def astep(self, q0):
+        if self.stage == 0:
+            return super(HamiltonianMonteCarlo, self).astep(q0)
+
+        q_new, l_new = self.hmc_step(q0)
+
+        if self.n_metropolis:
+            q = self.propose(q_new)
+            q_new, l_new = self.select(q_new, q)
+        else:
+            self.increment_counters()
+
+        return q_new, l_new
+
+    def propose(self, q0):
+        """
+        Propose a new point for the Metropolis step of the current chain,
+        the gradient variables are kept fixed.
+        """
+        q = super(HamiltonianMonteCarlo, self).propose(q0)
+        q[self.gradient_mask] = q0[self.gradient_mask]
+        return q
+
+    def reflect(self, x, p):
+        """
+        Reflect the positions at the prior bounds and invert the respective
+        momenta.
+
+        Parameters
+        ----------
+        x : :class:`numpy.ndarray`
+            positions of the gradient variables
+        p : :class:`numpy.ndarray`
+            momenta of the gradient variables
+
+        Returns
+        -------
+        x, p
+        """
+        while True:
+            below = x < self.lower
+            above = x > self.upper
+            if not (below.any() or above.any()):
+                return x, p
+
+            x[below] = 2. * self.lower[below] - x[below]
+            x[above] = 2. * self.upper[above] - x[above]
+            p[below] *= -1.
+            p[above] *= -1.
+
+    def leapfrog(self, q, p, dllk, n_steps):
+        """
+        Integrate the Hamiltonian dynamics of the gradient variables.
+
+        Parameters
+        ----------
+        q : :class:`numpy.ndarray`
+            starting point in array space
+        p : :class:`numpy.ndarray`
+            starting momenta of the gradient variables
+        dllk : :class:`numpy.ndarray`
+            gradient of the likelihood at the starting point
+        n_steps : int
+            number of leapfrog steps
+
+        Returns
+        -------
+        q : :class:`numpy.ndarray`
+            end point in array space
+        p : :class:`numpy.ndarray`
+            end momenta
+        out : list
+            output variables and likelihood gradient at the end point
+        """
+        q = q.copy()
+        p = p + 0.5 * self.step_size * self.beta * dllk
+        for i in range(n_steps):
+            x = q[self.gradient_mask] + self.step_size * self.inv_mass * p
+            x, p = self.reflect(x, p)
+            q[self.gradient_mask] = x
+
+            out = self.logp_dlogp(q)
+            if i < n_steps - 1:
+                p += self.step_size * self.beta * out[-1]
+
+        p += 0.5 * self.step_size * self.beta * out[-1]
+        return q, p, out
+
+    def energy(self, llk, p):
+        return -self.beta * llk + 0.5 * (self.inv_mass * p ** 2).sum()
+
+    def hmc_step(self, q0):
+        """
+        Hamiltonian trajectory of the gradient variables of the current
+        chain, including tuning of the leapfrog step size.
+
+        Parameters
+        ----------
+        q0 : :class:`numpy.ndarray`
+            current point of the chain in array space
+
+        Returns
+        -------
+        q_new : :class:`numpy.ndarray`
+            new point of the chain in array space
+        l_new : list
+            of output variables at the new point including the likelihoods
+        """
+        if not self.steps_until_tune and self.tune:
+            accept_rate = self.accept_prob_sum / float(self.tune_interval)
+            self.step_size *= num.exp(2. * (accept_rate - self.target_accept))
+            logger.debug(
+                'Tuning: Chain_%i step_%i, step size: %f' % (
+                    self.chain_index, self.stage_sample, self.step_size))
+
+            self.accept_prob_sum = 0.
+            if not self.n_metropolis:
+                self.steps_until_tune = self.tune_interval
+
+        try:
+            l0 = self.chain_previous_lpoint[self.chain_index]
+        except IndexError:
+            l0 = None
+
+        cached = self._chain_gradients.get(self.chain_index)
+        if cached is not None and cached[0] is l0:
+            dllk0 = cached[1]
+        else:
+            out0 = self.logp_dlogp(q0)
+            l0, dllk0 = out0[:-1], out0[-1]
+
+        llk0 = num.sum(l0[self._llk_index])
+
+        p0 = num.random.normal(
+            scale=1. / num.sqrt(self.inv_mass), size=self.inv_mass.size)
+        n_steps = num.random.randint(1, self.n_leapfrog + 1)
+
+        q, p, out = self.leapfrog(q0, p0, dllk0, n_steps)
+        lp = out[:-1]
+
+        log_accept = self.energy(llk0, p0) - self.energy(
+            num.sum(lp[self._llk_index]), p)
+        if not num.isfinite(log_accept):
+            log_accept = -num.inf
+
+        self.accept_prob_sum += num.exp(num.minimum(log_accept, 0.))
+
+        q_new, accepted = metrop_select(log_accept, q, q0)
+        if accepted:
+            l_new, dllk_new = lp, out[-1]
+        else:
+            l_new, dllk_new = l0, dllk0
+
+        self.chain_previous_lpoint[self.chain_index] = l_new
+        self._chain_gradients[self.chain_index] = (l_new, dllk_new)
+        return q_new, l_new
@@ -28,7 +28,8 @@ from pyrocko import util
 from beat import backend, utility
 from beat.covariance import init_proposal_covariance
 from .base import iter_parallel_chains, choose_proposal, logp_forw, \
-    init_stage, update_last_samples, multivariate_proposals
+    init_stage, update_last_samples, multivariate_proposals, \
+    population_proposals, init_persistent_pool
 
 
 __all__ = [
@@ -74,6 +75,10 @@ class Metropolis(backend.ArrayStepSharedLLK):
         :module:`pymc3.step_methods.metropolis` for options
     tune : boolean
         Flag for adaptive scaling based on the acceptance rate
+    surrogate : :class:`theano.tensor.Tensor`
+        cheap approximation to the model likelihood, if given proposals are
+        prescreened with it (delayed acceptance) and the full likelihood is
+        only evaluated for proposals that pass
     model : :class:`pymc3.Model`
         Optional model for sampling step.
         Defaults to None (taken from context).
@@ -81,10 +86,29 @@ class Metropolis(backend.ArrayStepSharedLLK):
 
     default_blocked = True
 
+    _chain_state_attributes = [
+        'scaling',
+        'accepted',
+        'steps_until_tune',
+        'stage_sample',
+        'cumulative_samples',
+        'proposal_samples_array',
+        'proposal_log_jacobian',
+        'prescreen_rejected']
+
+    _population_attributes = [
+        'population',
+        'array_population',
+        'chain_previous_lpoint',
+        'resampling_indexes',
+        'likelihoods',
+        'weights']
+
     def __init__(self, vars=None, out_vars=None, covariance=None, scale=1.,
                  n_chains=100, tune=True, tune_interval=100, model=None,
                  check_bound=True, likelihood_name='like', backend='csv',
-                 proposal_name='MultivariateNormal', **kwargs):
+                 proposal_name='MultivariateNormal', surrogate=None,
+                 **kwargs):
 
         model = modelcontext(model)
 
@@ -139,6 +163,15 @@ class Metropolis(backend.ArrayStepSharedLLK):
         self.logp_forw = logp_forw(out_vars, vars, shared)
         self.check_bnd = logp_forw([model.varlogpt], vars, shared)
 
+        if surrogate is not None:
+            self.logp_surrogate = logp_forw([surrogate], vars, shared)
+        else:
+            self.logp_surrogate = None
+
+        self.prescreen_rejected = 0
+        self.emulator = None
+        self.emulate = False
+
         super(Metropolis, self).__init__(vars, out_vars, shared)
 
         # init proposal
@@ -158,8 +191,12 @@ class Metropolis(backend.ArrayStepSharedLLK):
         self.proposal_dist = choose_proposal(
             self.proposal_name, scale=scale)
         self.proposal_samples_array = self.proposal_dist(n_chains)
+        self.proposal_log_jacobian = 0.
 
         self.chain_previous_lpoint = [[]] * self.n_chains
+        # surrogate likelihoods of the previous points of the chains
+        self._chain_surrogates = {}
+        self._proposed_surrogate = None
         self._tps = None
 
     def _sampler_state_blacklist(self):
@@ -168,12 +205,15 @@ class Metropolis(backend.ArrayStepSharedLLK):
         """
         bl = ['check_bnd',
               'logp_forw',
+              'logp_surrogate',
               'proposal_samples_array',
               'vars',
               'bij',
               'lij',
               'ordering',
               'lordering',
+              '_chain_surrogates',
+              '_proposed_surrogate',
               '_BlockedStep__newargs']
         return bl
 
@@ -189,6 +229,21 @@ class Metropolis(backend.ArrayStepSharedLLK):
         blacklist = self._sampler_state_blacklist()
         return {k: v for k, v in self.__dict__.items() if k not in blacklist}
 
+    def get_worker_state(self):
+        """
+        Return dictionary of sampler state without the population
+        attributes, to update the steps resident in persistent worker
+        processes.
+
+        Returns
+        -------
+        dict of sampler state
+        """
+        # shared variables are linked to the compiled model of the worker
+        blacklist = self._population_attributes + ['shared']
+        return {k: v for k, v in self.get_sampler_state().items()
+                if k not in blacklist}
+
     def apply_sampler_state(self, state):
         """
         Update sampler state to given state
@@ -214,6 +269,17 @@ class Metropolis(backend.ArrayStepSharedLLK):
             self._tps =  tps.mean()
         return self._tps
 
+    def get_chain_state(self):
+        """
+        Return dictionary of the sampler attributes that are specific to
+        the chain that is currently sampled.
+
+        Returns
+        -------
+        dict of chain state
+        """
+        return {k: getattr(self, k) for k in self._chain_state_attributes}
+
     def astep(self, q0):
         if self.stage == 0:
             l_new = self.logp_forw(q0)
@@ -226,124 +292,295 @@ class Metropolis(backend.ArrayStepSharedLLK):
             q_new = q0
 
         else:
-            if self.stage_sample == 0:
-                self.proposal_samples_array = self.proposal_dist(
-                    self.n_steps).astype(tconfig.floatX)
+            q = self.propose(q0)
+            q_new, l_new = self.select(q0, q)
 
-            if not self.steps_until_tune and self.tune:
-                # Tune scaling parameter
-                logger.debug('Tuning: Chain_%i step_%i' % (
-                    self.chain_index, self.stage_sample))
+        return q_new, l_new
 
-                self.scaling = utility.scalar2floatX(
-                    step_tune(
-                        self.scaling,
-                        self.accepted / float(self.tune_interval)))
+    def propose(self, q0):
+        """
+        Tune the step size and propose a new point for the current chain.
 
-                # Reset counter
-                self.steps_until_tune = self.tune_interval
-                self.accepted = 0
+        Parameters
+        ----------
+        q0 : :class:`numpy.ndarray`
+            current point of the chain in array space
 
-            logger.debug(
-                'Get delta: Chain_%i step_%i' % (
-                    self.chain_index, self.stage_sample))
+        Returns
+        -------
+        q : :class:`numpy.ndarray`
+            proposed point in array space
+        """
+        if self.stage_sample == 0:
+            self.proposal_samples_array = self.proposal_dist(
+                self.n_steps).astype(tconfig.floatX)
+
+        if not self.steps_until_tune and self.tune:
+            # Tune scaling parameter
+            logger.debug('Tuning: Chain_%i step_%i' % (
+                self.chain_index, self.stage_sample))
+
+            self.scaling = utility.scalar2floatX(
+                step_tune(
+                    self.scaling,
+                    self.accepted / float(self.tune_interval)))
+
+            # Reset counter
+            self.steps_until_tune = self.tune_interval
+            self.accepted = 0
+
+        logger.debug(
+            'Get delta: Chain_%i step_%i' % (
+                self.chain_index, self.stage_sample))
+        self.proposal_log_jacobian = 0.
+        if self.proposal_name in population_proposals and \
+                num.random.uniform() < self.proposal_dist.snooker_prob:
+            delta, self.proposal_log_jacobian = self.proposal_dist.snooker(q0)
+        else:
             delta = self.proposal_samples_array[self.stage_sample, :] * \
                 self.scaling
 
-            if self.any_discrete:
-                if self.all_discrete:
-                    delta = num.round(delta, 0)
-                    q0 = q0.astype(int)
-                    q = (q0 + delta).astype(int)
-                else:
-                    delta[self.discrete] = num.round(
-                        delta[self.discrete], 0).astype(int)
-                    q = q0 + delta
-                    q = q[self.discrete].astype(int)
+        if self.any_discrete:
+            if self.all_discrete:
+                delta = num.round(delta, 0)
+                q0 = q0.astype(int)
+                q = (q0 + delta).astype(int)
             else:
-
+                delta[self.discrete] = num.round(
+                    delta[self.discrete], 0).astype(int)
                 q = q0 + delta
+                q = q[self.discrete].astype(int)
+        else:
+
+            q = q0 + delta
+
+        return q
+
+    def forward(self, q):
+        """
+        Evaluate the output variables at the point in array space with the
+        forward model or, if enabled, with the likelihood emulator.
+        """
+        if self.emulate:
+            return self.emulator.forward(q)
+        else:
+            return self.logp_forw(q)
+
+    def prescreen(self, q0, q):
+        """
+        First stage of the delayed acceptance Metropolis algorithm
+        (Christen & Fox 2005). The proposed point is selected based on the
+        cheap surrogate likelihood, only if it passes the full likelihood
+        needs to be evaluated.
+
+        Parameters
+        ----------
+        q0 : :class:`numpy.ndarray`
+            current point of the chain in array space
+        q : :class:`numpy.ndarray`
+            proposed point in array space
+
+        Returns
+        -------
+        passed : bool
+            True if the full likelihood has to be evaluated
+        log_correction : float
+            to be added to the tempered log-likelihood ratio in the
+            second stage, to keep the posterior exact
+        """
+        self._proposed_surrogate = None
+        if self.emulator is not None and not self.emulate:
+            surrogate = self.emulator
+        elif self.logp_surrogate is not None:
+            surrogate = self.logp_surrogate
+        else:
+            return True, self.proposal_log_jacobian
+
+        logger.debug('Prescreen: Chain_%i step_%i' % (
+            self.chain_index, self.stage_sample))
+
+        # valid as long as the previous point of the chain is unchanged
+        lpoint = self.chain_previous_lpoint[self.chain_index]
+        cached = self._chain_surrogates.get(self.chain_index)
+        if cached is not None and cached[0] is lpoint and \
+                cached[1] is surrogate:
+            surrogate_q0 = cached[2]
+        else:
+            surrogate_q0 = surrogate(q0)[0]
+            self._chain_surrogates[self.chain_index] = (
+                lpoint, surrogate, surrogate_q0)
+
+        self._proposed_surrogate = (surrogate, surrogate(q)[0])
+        surrogate_ratio = self.beta * (
+            self._proposed_surrogate[1] - surrogate_q0)
+        _, passed = metrop_select(
+            surrogate_ratio + self.proposal_log_jacobian, q, q0)
+
+        if not passed:
+            self.prescreen_rejected += 1
 
-            try:
-                l0 = self.chain_previous_lpoint[self.chain_index]
-                llk0 = l0[self._llk_index]
-            except IndexError:
-                l0 = self.logp_forw(q0)
-                self.chain_previous_lpoint[self.chain_index] = l0
-                llk0 = l0[self._llk_index]
+        return passed, -surrogate_ratio
 
-            if self.check_bound:
-                logger.debug('Checking bound: Chain_%i step_%i' % (
+    def accept_surrogate(self, lpoint):
+        """
+        Keep the surrogate likelihood of the accepted proposal as the one
+        of the previous point of the current chain.
+
+        Parameters
+        ----------
+        lpoint : list
+            of output variables at the accepted point
+        """
+        if self._proposed_surrogate is not None:
+            self._chain_surrogates[self.chain_index] = (
+                lpoint, ) + self._proposed_surrogate
+
+    def screen(self, q0, q):
+        """
+        Check the prior bounds of the proposed point and run the first
+        stage of the delayed acceptance, without evaluating the forward
+        model.
+
+        Parameters
+        ----------
+        q0 : :class:`numpy.ndarray`
+            current point of the chain in array space
+        q : :class:`numpy.ndarray`
+            proposed point in array space
+
+        Returns
+        -------
+        passed : bool
+            True if the full likelihood has to be evaluated
+        log_correction : float
+            see :meth:`prescreen`
+        """
+        if self.check_bound:
+            logger.debug('Checking bound: Chain_%i step_%i' % (
+                self.chain_index, self.stage_sample))
+            if not num.isfinite(self.check_bnd(q)):
+                self._proposed_surrogate = None
+                return False, 0.
+
+        return self.prescreen(q0, q)
+
+    def select(self, q0, q, screened=None):
+        """
+        Evaluate the proposed point, do the Metropolis select and update
+        the sample counters of the current chain.
+
+        Parameters
+        ----------
+        q0 : :class:`numpy.ndarray`
+            current point of the chain in array space
+        q : :class:`numpy.ndarray`
+            proposed point in array space
+        screened : tuple
+            of (passed, log_correction) if :meth:`screen` was already run
+            for the proposed point, e.g. for the whole population before
+            the forward model is evaluated in one batch
+
+        Returns
+        -------
+        q_new : :class:`numpy.ndarray`
+            new point of the chain in array space
+        l_new : list
+            of output variables at the new point including the likelihoods
+        """
+        try:
+            l0 = self.chain_previous_lpoint[self.chain_index]
+            llk0 = l0[self._llk_index]
+        except IndexError:
+            l0 = self.forward(q0)
+            self.chain_previous_lpoint[self.chain_index] = l0
+            llk0 = l0[self._llk_index]
+
+        if screened is None:
+            screened = self.screen(q0, q)
+
+        passed, log_correction = screened
+
+        if self.check_bound:
+            if passed:
+                logger.debug('Calc llk: Chain_%i step_%i' % (
                     self.chain_index, self.stage_sample))
-                varlogp = self.check_bnd(q)
 
-                if num.isfinite(varlogp):
-                    logger.debug('Calc llk: Chain_%i step_%i' % (
-                        self.chain_index, self.stage_sample))
+                lp = self.forward(q)
 
-                    lp = self.logp_forw(q)
+                logger.debug('Select llk: Chain_%i step_%i' % (
+                    self.chain_index, self.stage_sample))
 
-                    logger.debug('Select llk: Chain_%i step_%i' % (
-                        self.chain_index, self.stage_sample))
+                tempered_llk_ratio = self.beta * (
+                        lp[self._llk_index] - l0[self._llk_index])
+                q_new, accepted = metrop_select(
+                    tempered_llk_ratio + log_correction, q, q0)
 
-                    tempered_llk_ratio = self.beta * (
-                            lp[self._llk_index] - l0[self._llk_index])
-                    q_new, accepted = metrop_select(
-                        tempered_llk_ratio, q, q0)
-
-                    if accepted:
-                        logger.debug('Accepted: Chain_%i step_%i' % (
-                            self.chain_index, self.stage_sample))
-                        logger.debug('proposed: %f previous: %f' % (
-                            lp[self._llk_index], llk0))
-                        self.accepted += 1
-                        l_new = lp
-                        self.chain_previous_lpoint[self.chain_index] = l_new
-                    else:
-                        logger.debug('Rejected: Chain_%i step_%i' % (
-                            self.chain_index, self.stage_sample))
-                        logger.debug('proposed: %f previous: %f' % (
-                            lp[self._llk_index], l0[self._llk_index]))
-                        l_new = l0
+                if accepted:
+                    logger.debug('Accepted: Chain_%i step_%i' % (
+                        self.chain_index, self.stage_sample))
+                    logger.debug('proposed: %f previous: %f' % (
+                        lp[self._llk_index], llk0))
+                    self.accepted += 1
+                    l_new = lp
+                    self.chain_previous_lpoint[self.chain_index] = l_new
+                    self.accept_surrogate(l_new)
                 else:
-                    q_new = q0
+                    logger.debug('Rejected: Chain_%i step_%i' % (
+                        self.chain_index, self.stage_sample))
+                    logger.debug('proposed: %f previous: %f' % (
+                        lp[self._llk_index], l0[self._llk_index]))
                     l_new = l0
-
             else:
+                q_new = q0
+                l_new = l0
+
+        else:
+            if passed:
                 logger.debug('Calc llk: Chain_%i step_%i' % (
                     self.chain_index, self.stage_sample))
 
-                lp = self.logp_forw(q)
+                lp = self.forward(q)
 
                 logger.debug('Select: Chain_%i step_%i' % (
                     self.chain_index, self.stage_sample))
                 q_new, accepted = metrop_select(
-                    self.beta * (lp[self._llk_index] - llk0),
+                    self.beta * (lp[self._llk_index] - llk0) +
+                    log_correction,
                     q, q0)
 
                 if accepted:
                     self.accepted += 1
                     l_new = lp
                     self.chain_previous_lpoint[self.chain_index] = l_new
+                    self.accept_surrogate(l_new)
                 else:
                     l_new = l0
+            else:
+                q_new = q0
+                l_new = l0
 
-            logger.debug(
-                'Counters: Chain_%i step_%i' % (
-                    self.chain_index, self.stage_sample))
-            self.steps_until_tune -= 1
-            self.stage_sample += 1
-            self.cumulative_samples += 1
+        self.increment_counters()
 
-            # reset sample counter
-            if self.stage_sample == self.n_steps:
-                self.stage_sample = 0
+        return q_new, l_new
 
-            logger.debug(
-                'End step: Chain_%i step_%i' % (
-                    self.chain_index, self.stage_sample))
+    def increment_counters(self):
+        """
+        Update the sample counters of the current chain after a step.
+        """
+        logger.debug(
+            'Counters: Chain_%i step_%i' % (
+                self.chain_index, self.stage_sample))
+        self.steps_until_tune -= 1
+        self.stage_sample += 1
+        self.cumulative_samples += 1
 
-        return q_new, l_new
+        # reset sample counter
+        if self.stage_sample == self.n_steps:
+            self.stage_sample = 0
+
+        logger.debug(
+            'End step: Chain_%i step_%i' % (
+                self.chain_index, self.stage_sample))
 
 
 def get_final_stage(homepath, n_stages, model):
@@ -439,6 +676,8 @@ def metropolis_sample(
 
         step.stage = stage
 
+        pool = init_persistent_pool(step, model, n_jobs)
+
         sample_args = {
             'draws': draws,
             'step': step,
@@ -448,7 +687,8 @@ def metropolis_sample(
             'n_jobs': n_jobs,
             'buffer_size': buffer_size,
             'buffer_thinning': buffer_thinning,
-            'chains': chains}
+            'chains': chains,
+            'pool': pool}
 
         mtrace = iter_parallel_chains(**sample_args)
 
@@ -462,15 +702,22 @@ def metropolis_sample(
         if update is not None:
             logger.info('Updating Covariances ...')
             update.update_weights(pdict['dist_mean'], n_jobs=n_jobs)
+            if pool is not None:
+                # workers need to be forked again with updated weights
+                pool.close()
 
             mtrace = update_last_samples(
-                homepath, step, progressbar, model, n_jobs, rm_flag)
+                homepath, step, progressbar, model, n_jobs, rm_flag,
+                pool=pool)
 
         elif update is not None and stage == 0:
             update.engine.close_cashed_stores()
 
         step.chain_previous_lpoint = step.get_chain_previous_lpoint(mtrace)
 
+        if pool is not None:
+            pool.close()
+
         outparam_list = [step.get_sampler_state(), update]
         stage_handler.dump_atmip_params(step.stage, outparam_list)
 
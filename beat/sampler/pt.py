@@ -1,16 +1,18 @@
 #!/usr/bin/env python
 """
-Parallel Tempering algorithm with mpi4py
+Parallel Tempering algorithm with mpi4py or local shared memory communication
 """
 import os
 import sys
+import multiprocessing
+from platform import node
 
 # disable internal(fine) blas parallelisation as we parallelise over chains
 os.environ["OMP_NUM_THREADS"] = "1"
 
-from mpi4py import MPI
 import numpy as num
 
+from beat import parallel
 from beat.utility import load_objects, list2string, setup_logging, \
     dump_objects
 from beat.sampler import distributed
@@ -22,8 +24,6 @@ from beat.config import sample_p_outname
 
 from logging import getLogger, getLevelName
 
-from theano import config as tconfig
-
 from collections import OrderedDict
 from copy import deepcopy
 
@@ -33,11 +33,30 @@ from pickle import HIGHEST_PROTOCOL
 logger = getLogger('pt')
 
 
-MPI.pickle.PROTOCOL = HIGHEST_PROTOCOL
+try:
+    from mpi4py import MPI
+    MPI.pickle.PROTOCOL = HIGHEST_PROTOCOL
+except ImportError:
+    MPI = None
+    logger.debug('mpi4py not installed, only local PT sampling available.')
+
+communicators = ['mpi', 'local']
+
+
+def double_buffer(array):
+    """
+    Message buffer specification of a float64 array for Send and Recv,
+    explicitly typed as MPI.DOUBLE if mpi4py is available.
+    """
+    if MPI is None:
+        return array
+
+    return [array, MPI.DOUBLE]
 
 
 __all__ = [
     'pt_sample',
+    'run_local_sampler',
     'sample_pt_chain',
     'TemperingManager',
     'SamplingHistory',
@@ -450,6 +469,46 @@ class TemperingManager(object):
         else:
             return m1, m2
 
+    def propose_chain_swaps(self, states):
+        """
+        Propose swaps between the chain states of workers with adjacent
+        betas among the given workers, all in one batch. If the number of
+        workers is odd, a randomly chosen worker at either end of the beta
+        order is left out and its state is kept for the next batch.
+
+        Parameters
+        ----------
+        states : dict
+            of worker sources and their chain end-points
+
+        Returns
+        -------
+        swapped : :class:`collections.OrderedDict`
+            of worker sources and their (swapped) chain states
+        left : :class:`collections.OrderedDict`
+            of worker source and chain state that has not been paired
+        """
+        sources = sorted(
+            states.keys(),
+            key=lambda source: self.worker2package(source)['step'].beta,
+            reverse=True)
+
+        left = OrderedDict()
+        if len(sources) % 2:
+            if num.random.randint(2):
+                source = sources.pop(0)
+            else:
+                source = sources.pop(-1)
+
+            left[source] = states[source]
+
+        swapped = OrderedDict()
+        for source1, source2 in zip(sources[0::2], sources[1::2]):
+            swapped[source1], swapped[source2] = self.propose_chain_swap(
+                states[source1], states[source2], source1, source2)
+
+        return swapped, left
+
     def register_swap(self, source1, source2, accepted):
         w1i = self.worker2index(source1)
         w2i = self.worker2index(source2)
@@ -475,9 +534,9 @@ def master_process(
 
     Parameters
     ----------
-    comm : mpi.communicator
+    comm : mpi.communicator or :class:`beat.parallel.LocalCommunicator`
     tags : message tags
-    status : mpt.status object
+    status : mpi.status object or :class:`beat.parallel.LocalStatus`
 
     the rest see pt_sample doc-string
     """
@@ -528,7 +587,7 @@ def master_process(
     logger.info('Sending work packages to workers...')
     manager.update_betas()
     for beta in manager.betas:
-        comm.recv(source=MPI.ANY_SOURCE, tag=tags.READY, status=status)
+        comm.recv(tag=tags.READY, status=status)
         source = status.Get_source()
 
         if record_worker_chains:
@@ -558,53 +617,62 @@ def master_process(
         'Tuning worker betas every %i samples. \n' % beta_tune_interval)
     logger.info('Sampling ...')
     logger.info('------------')
+    ready = OrderedDict()
+    requests = []
     while True:
-
-        m1 = num.empty(manager.step.lordering.size)
-        comm.Recv([m1, MPI.DOUBLE],
-                  source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=status)
-        source1 = status.Get_source()
-        logger.debug('Got sample 1 from worker %i' % source1)
-
-        m2 = num.empty(manager.step.lordering.size)
-        comm.Recv([m2, MPI.DOUBLE],
-                  source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=status)
-        source2 = status.Get_source()
-        logger.debug('Got sample 2 from worker %i' % source2)
-
-        # write results to trace if workers sample from posterior
-        for source, m in zip([source1, source2], [m1, m2]):
-            if source in posterior_workers:
+        # block until at least one worker is ready, then collect all others
+        # that are ready as well
+        block = True
+        while block or comm.Iprobe(status=status):
+            block = False
+            m = num.empty(manager.step.lordering.size, dtype='float64')
+            comm.Recv(double_buffer(m), status=status)
+            source = status.Get_source()
+            logger.debug('Got sample from worker %i' % source)
+            ready[source] = m
+
+            # write results to trace if workers sample from posterior
+            if source in posterior_workers and count_sample < n_samples:
                 count_sample += 1
                 counter(source)
-                #print(manager.worker_a2l(m, source))
                 master_trace.write(manager.worker_a2l(m, source), count_sample)
                 steps_until_tune += 1
 
-        m1, m2 = manager.propose_chain_swap(m1, m2, source1, source2)
-        # beta updating
-        if steps_until_tune >= beta_tune_interval:
-            manager.tune_betas()
-            steps_until_tune = 0
-
-        if count_sample < n_samples:
-            logger.debug('Sending states back to workers ...')
-            for source in [source1, source2]:
-                if not manager.worker_beta_updated(source1):
-                    comm.Send(
-                        [manager.get_beta(source), MPI.DOUBLE],
-                        dest=source, tag=tags.BETA)
-                    manager.worker_beta_updated(source, check=True)
-
-            comm.Send(m1, dest=source1, tag=tags.SAMPLE)
-            comm.Send(m2, dest=source2, tag=tags.SAMPLE)
-        else:
+        if count_sample >= n_samples:
             logger.info('Requested number of samples reached!')
             master_trace.record_buffer()
             manager.dump_history(
                 save_dir=stage_handler.stage_path(stage))
             break
 
+        if len(ready) < 2:
+            continue
+
+        swapped, ready = manager.propose_chain_swaps(ready)
+        # beta updating
+        if steps_until_tune >= beta_tune_interval:
+            manager.tune_betas()
+            steps_until_tune = 0
+
+        # previous batch has to be sent before buffers are released
+        for request in requests:
+            request.Wait()
+
+        logger.debug('Sending states back to workers ...')
+        requests = []
+        for source, m in swapped.items():
+            if not manager.worker_beta_updated(source):
+                requests.append(comm.Isend(
+                    double_buffer(manager.get_beta(source).astype('float64')),
+                    dest=source, tag=tags.BETA))
+                manager.worker_beta_updated(source, check=True)
+
+            requests.append(comm.Isend(
+                double_buffer(m), dest=source, tag=tags.SAMPLE))
+
+    for request in requests:
+        request.Wait()
+
     logger.info('Master finished! Chain complete!')
     logger.debug('Firing ...')
     for i in range(1, size):
@@ -623,11 +691,11 @@ def worker_process(comm, tags, status):
 
     Parameters
     ----------
-    comm : mpi.communicator
+    comm : mpi.communicator or :class:`beat.parallel.LocalCommunicator`
     tags : message tags
-    status : mpi.status object
+    status : mpi.status object or :class:`beat.parallel.LocalStatus`
     """
-    name = MPI.Get_processor_name()
+    name = node()
     logger.debug(
         "Entering worker process with rank %d on %s." % (comm.rank, name))
     comm.send(None, dest=0, tag=tags.READY)
@@ -643,14 +711,15 @@ def worker_process(comm, tags, status):
 
     # do initial sampling
     result = sample_pt_chain(**kwargs)
-    comm.Send([result, MPI.DOUBLE], dest=0, tag=tags.DONE)
+    comm.Send(
+        double_buffer(num.asarray(result, dtype='float64')),
+        dest=0, tag=tags.DONE)
 
     # enter repeated sampling
     while True:
         # TODO: make transd-compatible
-        data = num.empty(step.lordering.size, dtype=tconfig.floatX)
-        comm.Recv([data, MPI.DOUBLE],
-                  tag=MPI.ANY_TAG, source=0, status=status)
+        data = num.empty(step.lordering.size, dtype='float64')
+        comm.Recv(double_buffer(data), source=0, status=status)
 
         tag = status.Get_tag()
         if tag == tags.SAMPLE:
@@ -662,7 +731,9 @@ def worker_process(comm, tags, status):
             result = sample_pt_chain(**kwargs)
 
             logger.debug('Worker %i attempting to send ...' % comm.rank)
-            comm.Send([result, MPI.DOUBLE], dest=0, tag=tags.DONE)
+            comm.Send(
+                double_buffer(num.asarray(result, dtype='float64')),
+                dest=0, tag=tags.DONE)
             logger.debug('Worker %i sent message successfully ...' % comm.rank)
 
         elif tag == tags.BETA:
@@ -749,7 +820,7 @@ def pt_sample(
         beta_tune_interval=10000, n_workers_posterior=1, homepath='',
         progressbar=True, buffer_size=5000, buffer_thinning=1, model=None,
         rm_flag=False, resample=False, keep_tmp=False,
-        record_worker_chains=False):
+        record_worker_chains=False, communicator='mpi'):
     """
     Paralell Tempering algorithm
 
@@ -806,7 +877,22 @@ def pt_sample(
         backend trace objects (during sampler initialization).
         Very useful for debugging purposes. MUST be False for runs on
         distributed computing systems!
+    communicator : str
+        'mpi': master and workers are started with mpiexec and communicate
+        via MPI, may be distributed over several machines
+        'local': master and workers are local processes that exchange
+        chain states through shared memory, does not require MPI
     """
+    if communicator not in communicators:
+        raise ValueError(
+            'Communicator "%s" not supported! Options: %s' % (
+                communicator, list2string(communicators)))
+
+    if communicator == 'mpi' and MPI is None:
+        raise ImportError(
+            'mpi4py is required for communicator "mpi"!'
+            ' Use communicator "local" on a single machine.')
+
     if n_chains < 2:
         raise ValueError(
             'Parallel Tempering requires at least 2 Markov Chains!')
@@ -823,6 +909,11 @@ def pt_sample(
         n_workers_posterior, homepath, progressbar, buffer_size,
         buffer_thinning, resample, rm_flag, record_worker_chains]
 
+    if communicator == 'local':
+        run_local_sampler(
+            model=model, sampler_args=sampler_args, n_jobs=n_chains)
+        return
+
     project_dir = os.path.dirname(homepath)
     loglevel = getLevelName(logger.getEffectiveLevel()).lower()
 
@@ -836,6 +927,69 @@ def pt_sample(
         project_dir=project_dir)
 
 
+def _local_worker(comm, tags, model):
+    with model:
+        worker_process(comm, tags, parallel.LocalStatus())
+
+
+def run_local_sampler(model, sampler_args, n_jobs):
+    """
+    Run the Parallel Tempering master and workers as processes on the
+    local machine. The worker processes are forked and exchange chain states
+    with the master through shared memory channels, which avoids the
+    message serialization of MPI.
+
+    Parameters
+    ----------
+    model : :class:`pymc3.model.Model`
+        that holds the forward model graph
+    sampler_args : list
+        of sampler arguments of :func:`master_process`, order is important
+    n_jobs : int
+        number of processes including the master
+    """
+    tags = distributed.enum('READY', 'INIT', 'DONE', 'EXIT', 'SAMPLE', 'BETA')
+
+    step = sampler_args[0]
+    channels = [parallel.SharedMemoryChannel(
+        n_slots=2 * n_jobs, slot_size=step.lordering.size)]
+    for _ in range(1, n_jobs):
+        channels.append(parallel.SharedMemoryChannel(
+            n_slots=8, slot_size=step.lordering.size))
+
+    workers = []
+
+    def check_peers():
+        for worker in workers:
+            if worker.exitcode not in (None, 0):
+                raise RuntimeError(
+                    '%s died with exitcode %i!' % (
+                        worker.name, worker.exitcode))
+
+    # workers inherit the compiled model, channels have to be shared
+    ctx = multiprocessing.get_context('fork')
+    logger.info('Forking %i local PT workers ...' % (n_jobs - 1))
+    for rank in range(1, n_jobs):
+        worker = ctx.Process(
+            target=_local_worker,
+            args=(parallel.LocalCommunicator(channels, rank), tags, model),
+            name='PT worker %i' % rank)
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+
+    comm = parallel.LocalCommunicator(channels, 0, check_peers=check_peers)
+    try:
+        with model:
+            master_process(
+                comm, tags, parallel.LocalStatus(), model, *sampler_args)
+    finally:
+        for worker in workers:
+            worker.join(timeout=10.)
+            if worker.is_alive():
+                worker.terminate()
+
+
 def _sample():
     # Define MPI message tags
     tags = distributed.enum('READY', 'INIT', 'DONE', 'EXIT', 'SAMPLE', 'BETA')
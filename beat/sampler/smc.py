@@ -12,12 +12,15 @@ from pymc3.model import modelcontext
 
 from beat import backend, utility
 from .base import iter_parallel_chains, update_last_samples, init_stage, \
-    choose_proposal
+    choose_proposal, iter_population_chains, init_persistent_pool, \
+    integrated_autocorrelation_time, population_proposals
 from .metropolis import Metropolis
 
 
 __all__ = [
     'SMC',
+    'StageLengthController',
+    'ResolutionSchedule',
     'smc_sample']
 
 
@@ -50,12 +53,16 @@ class SMC(Metropolis):
     likelihood_name : string
         name of the :class:`pymc3.determinsitic` variable that contains the
         model likelihood - defaults to 'like'
-    proposal_dist :
-        :class:`pymc3.metropolis.Proposal`
+    proposal_name : str
         Type of proposal distribution, see
-        :module:`pymc3.step_methods.metropolis` for options
+        :func:`beat.sampler.base.available_proposals` for options.
+        'DifferentialEvolution' draws the proposal steps from differences
+        of the unique chain end points of the previous stage
     tune : boolean
         Flag for adaptive scaling based on the acceptance rate
+    surrogate : :class:`theano.tensor.Tensor`
+        cheap approximation to the model likelihood for delayed acceptance,
+        see :class:`beat.sampler.Metropolis`
     coef_variation : scalar, float
         Coefficient of variation, determines the change of beta
         from stage to stage, i.e.indirectly the number of stages,
@@ -101,6 +108,7 @@ class SMC(Metropolis):
 
         self.coef_variation = coef_variation
         self.likelihoods = np.zeros(n_chains)
+        self.previous_likelihoods = None
 
     def _sampler_state_blacklist(self):
         """
@@ -109,15 +117,47 @@ class SMC(Metropolis):
         bl = ['likelihoods',
               'check_bnd',
               'logp_forw',
+              'logp_surrogate',
               'bij',
               'lij',
               'ordering',
               'lordering',
               'proposal_samples_array',
               'vars',
+              '_chain_surrogates',
+              '_proposed_surrogate',
               '_BlockedStep__newargs']
         return bl
 
+    def importance_weights(self, beta, old_beta):
+        """
+        Calculate (unnormalised) importance weights of the current
+        population for the tempering from old_beta to beta. If the
+        likelihood function changed since the population was sampled, e.g.
+        the data resolution, the population is reweighted from the
+        previous likelihoods to the current ones.
+
+        Parameters
+        ----------
+        beta : float
+            tempering parameter of the target distribution
+        old_beta : float
+            tempering parameter the population was sampled with
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+        """
+        log_weights = (beta - old_beta) * (
+            self.likelihoods - self.likelihoods.max())
+
+        if self.previous_likelihoods is not None:
+            log_weights += old_beta * (
+                self.likelihoods - self.previous_likelihoods)
+            log_weights -= log_weights.max()
+
+        return np.exp(log_weights)
+
     def calc_beta(self):
         """
         Calculate next tempering beta and importance weights based on
@@ -139,9 +179,7 @@ class SMC(Metropolis):
 
         while up_beta - low_beta > 1e-6:
             current_beta = (low_beta + up_beta) / 2.
-            temp = np.exp(
-                (current_beta - self.beta) *
-                (self.likelihoods - self.likelihoods.max()))
+            temp = self.importance_weights(current_beta, self.beta)
             cov_temp = np.std(temp) / np.mean(temp)
             if cov_temp > self.coef_variation:
                 up_beta = current_beta
@@ -173,6 +211,20 @@ class SMC(Metropolis):
                 'Sample covariances contains Inf or NaN!')
         return cov
 
+    def update_proposal_dist(self):
+        """
+        Update the proposal distribution for the next stage. Population
+        proposals are based on the unique end points of the stage, all
+        others on the stage covariance.
+        """
+        if self.proposal_name in population_proposals:
+            # resampling duplicates points, which yield zero differences
+            scale = np.unique(self.array_population, axis=0)
+        else:
+            scale = self.covariance
+
+        self.proposal_dist = choose_proposal(self.proposal_name, scale=scale)
+
     def select_end_points(self, mtrace):
         """
         Read trace results (variables and model likelihood) and take end points
@@ -317,11 +369,210 @@ class SMC(Metropolis):
         self.__dict__.update(state)
 
 
+class ResolutionSchedule(object):
+    """
+    Coarse-to-fine schedule of the resolution of the datasets in the
+    likelihood of the SMC stages. The early stages with small beta barely
+    constrain the posterior, they are sampled with decimated datasets.
+    The resolution is increased as beta increases and the final stages are
+    sampled with the full resolution.
+
+    Parameters
+    ----------
+    problem : :class:`beat.models.Problem`
+        with the composites whose resolution is set, see
+        :meth:`beat.models.Problem.set_resolution`
+    factors : list
+        of int, decimation factors of the resolution levels from coarse to
+        fine
+    betas : list
+        of float, tempering parameters beta until which the respective
+        resolution level is used, increasing, below 1
+    """
+
+    def __init__(self, problem, factors, betas):
+
+        if len(factors) != len(betas):
+            raise ValueError(
+                'Number of decimation factors %i and betas %i of the'
+                ' resolution levels inconsistent!' % (
+                    len(factors), len(betas)))
+
+        if np.any(np.diff(betas) <= 0.) or (
+                len(betas) > 0 and (betas[0] <= 0. or betas[-1] >= 1.)):
+            raise ValueError(
+                'Betas of the resolution levels have to be increasing'
+                ' and between 0 and 1!')
+
+        self.problem = problem
+        self.factors = [int(factor) for factor in factors] + [1]
+        self.betas = np.asarray(betas, dtype='float64')
+        self.level = None
+
+    def get_level(self, beta):
+        """
+        Get the resolution level for a tempering parameter.
+
+        Parameters
+        ----------
+        beta : float
+
+        Returns
+        -------
+        int, index of the resolution level
+        """
+        return int(np.searchsorted(self.betas, beta, side='right'))
+
+    def update(self, beta):
+        """
+        Set the resolution of the problem for the tempering parameter, the
+        resolution is only ever increased.
+
+        Parameters
+        ----------
+        beta : float
+
+        Returns
+        -------
+        bool, True if the resolution changed
+        """
+        level = self.get_level(beta)
+        if self.level is not None and level <= self.level:
+            return False
+
+        logger.info(
+            'Resolution level %i of %i, decimation factor %i' % (
+                level + 1, len(self.factors), self.factors[level]))
+        changed = self.level is not None and \
+            self.factors[level] != self.factors[self.level]
+
+        self.problem.set_resolution(self.factors[level])
+        self.level = level
+        return changed
+
+
+class StageLengthController(object):
+    """
+    Adapts the number of Metropolis steps of the SMC stages to the mixing
+    of the chains. The population is considered decorrelated once the chains
+    ran 'decorrelation_factor' times the median integrated autocorrelation
+    time of the chain likelihoods.
+
+    With population batch sampling all chains are advanced synchronously, so
+    a stage is stopped as soon as the chains are decorrelated. Otherwise the
+    chains are sampled independently by the workers and each stage runs its
+    full number of steps, the adaptation only sets the number of steps of
+    the next stage from the traces of the current stage, see
+    :meth:`next_n_steps`.
+
+    Parameters
+    ----------
+    min_steps : int
+        minimum number of steps per chain and stage
+    max_steps : int
+        maximum number of steps per chain and stage
+    decorrelation_factor : float
+        number of autocorrelation times each chain has to be sampled
+    check_interval : int
+        number of steps after which the chains are checked for
+        decorrelation during a stage, only for population batch sampling
+    """
+
+    def __init__(self, min_steps=10, max_steps=1000, decorrelation_factor=5.,
+                 check_interval=10):
+
+        if min_steps > max_steps:
+            raise ValueError(
+                'Minimum number of steps has to be lower than the maximum!')
+
+        self.min_steps = int(min_steps)
+        self.max_steps = int(max_steps)
+        self.decorrelation_factor = decorrelation_factor
+        self.check_interval = int(check_interval)
+
+    def required_steps(self, llks, thinning=1):
+        """
+        Estimate the number of steps that are needed to decorrelate the
+        chains.
+
+        Parameters
+        ----------
+        llks : :class:`numpy.ndarray`
+            (n_samples x n_chains) of chain likelihoods
+        thinning : int
+            factor by which the samples are thinned
+
+        Returns
+        -------
+        int, number of steps
+        """
+        llks = np.atleast_2d(llks)
+        taus = np.array([
+            integrated_autocorrelation_time(llks[:, i])
+            for i in range(llks.shape[1])]) * thinning
+        acceptance = (np.diff(llks, axis=0) != 0.).mean()
+
+        n_steps = int(np.ceil(self.decorrelation_factor * np.median(taus)))
+
+        logger.info(
+            'Acceptance rate: %f, median autocorrelation time: %f,'
+            ' required steps: %i' % (acceptance, np.median(taus), n_steps))
+
+        return int(np.clip(n_steps, self.min_steps, self.max_steps))
+
+    def is_decorrelated(self, llks, thinning=1):
+        """
+        Check if the chains have been sampled long enough.
+
+        Parameters
+        ----------
+        llks : :class:`numpy.ndarray`
+            (n_samples x n_chains) of chain likelihoods
+        thinning : int
+            factor by which the samples are thinned
+
+        Returns
+        -------
+        bool
+        """
+        n_samples = llks.shape[0] * thinning
+        if n_samples < self.min_steps:
+            return False
+
+        return n_samples >= self.required_steps(llks, thinning=thinning)
+
+    def next_n_steps(self, mtrace, likelihood_name, thinning=1):
+        """
+        Estimate the number of steps for the next stage from the traces of
+        the current stage.
+
+        Parameters
+        ----------
+        mtrace : :class:`pymc3.backend.base.MultiTrace`
+        likelihood_name : str
+            name of the likelihood variable in the traces
+        thinning : int
+            factor by which the samples in the traces are thinned
+
+        Returns
+        -------
+        int, number of steps
+        """
+        chain_llks = [
+            np.atleast_2d(llks.T).T[:, 0] for llks in
+            mtrace.get_values(varname=likelihood_name, combine=False)]
+
+        n_samples = min([llks.size for llks in chain_llks])
+        llks = np.vstack([llks[:n_samples] for llks in chain_llks]).T
+        return self.required_steps(llks, thinning=thinning)
+
+
 def smc_sample(
         n_steps, step=None, start=None, homepath=None,
         stage=0, n_jobs=1, progressbar=False, buffer_size=5000,
         buffer_thinning=1, model=None, update=None, random_seed=None,
-        rm_flag=False):
+        rm_flag=False, population_batch=False, prefetch=None,
+        stage_controller=None, emulator=None, resolution=None):
     """
     Sequential Monte Carlo samlping
 
@@ -377,6 +628,31 @@ def smc_sample(
     rm_flag : bool
         If True existing stage result folders are being deleted prior to
         sampling.
+    population_batch : bool
+        If True all chains are sampled synchronously within one process and
+        the forward model is evaluated for the proposals of all chains in
+        one batch, n_jobs is then ignored for the stage sampling.
+        Otherwise, for n_jobs > 1 the worker processes are forked once and
+        kept alive across stages, only the changed sampler state is send
+        to them at each stage.
+    prefetch : function
+        that calculates the synthetics for a list of points in one batch,
+        e.g. :meth:`beat.models.Problem.prefetch_synthetics`,
+        only used if population_batch is True
+    stage_controller : :class:`StageLengthController`
+        optional, adapts the number of steps of each stage to the mixing of
+        the chains, n_steps is then the number of steps of the first stage.
+        With population_batch the stages are stopped as soon as the
+        chains are decorrelated, otherwise the number of steps of the next
+        stage is estimated from the traces of the current stage.
+    emulator : :class:`beat.sampler.surrogate.LikelihoodEmulator`
+        optional, trained on the traces of each stage that is sampled with
+        the forward model, used to prescreen the proposals or to replace
+        the forward model depending on its mode
+    resolution : :class:`ResolutionSchedule`
+        optional, samples the early stages with decimated datasets, at each
+        increase of the resolution the stage end points are evaluated with
+        the finer datasets and importance reweighted
 
     References
     ----------
@@ -417,6 +693,12 @@ def smc_sample(
                             'a variable %s '
                             'as defined in `step`.' % step.likelihood_name)
 
+    if population_batch:
+        logger.info('Sampling chains synchronously in population batches.')
+        iter_chains = iter_population_chains
+    else:
+        iter_chains = iter_parallel_chains
+
     stage_handler = backend.SampleStage(homepath, backend=step.backend)
 
     chains, step, update = init_stage(
@@ -429,12 +711,26 @@ def smc_sample(
         model=model,
         rm_flag=rm_flag)
 
+    if resolution is not None:
+        resolution.update(step.beta)
+
+    if population_batch:
+        pool = None
+    else:
+        # workers are forked once and kept alive across stages
+        pool = init_persistent_pool(step, model, n_jobs)
+
     with model:
         while step.beta < 1.:
             if step.stage == 0:
                 # Initial stage
                 logger.info('Sample initial stage: ...')
                 draws = 1
+            elif stage_controller is not None:
+                if population_batch:
+                    draws = stage_controller.max_steps
+                else:
+                    draws = step.n_steps
             else:
                 draws = n_steps
 
@@ -449,27 +745,71 @@ def smc_sample(
                 'stage_path': stage_handler.stage_path(step.stage),
                 'progressbar': progressbar,
                 'model': model,
-                'n_jobs': n_jobs,
                 'chains': chains,
                 'buffer_size': buffer_size,
                 'buffer_thinning': buffer_thinning}
 
-            mtrace = iter_parallel_chains(**sample_args)
+            if population_batch:
+                sample_args['prefetch'] = prefetch
+                sample_args['stage_controller'] = stage_controller
+            else:
+                sample_args['n_jobs'] = n_jobs
+                sample_args['pool'] = pool
+
+            mtrace = iter_chains(**sample_args)
+
+            if stage_controller is not None and draws > 1 and \
+                    not population_batch:
+                step.n_steps = stage_controller.next_n_steps(
+                    mtrace, step.likelihood_name, thinning=buffer_thinning)
+                logger.info(
+                    'Number of steps for next stage: %i' % step.n_steps)
 
             step.population, step.array_population, step.likelihoods = \
                 step.select_end_points(mtrace)
 
+            if emulator is not None and not step.emulate:
+                emulator.update(mtrace)
+                if emulator.mode == 'prescreen':
+                    step.emulator = emulator
+                elif step.stage + 1 >= emulator.exact_stages:
+                    logger.info(
+                        'Replacing forward model with likelihood emulator!'
+                        ' Results are approximate.')
+                    step.emulator = emulator
+                    step.emulate = True
+
             if update is not None:
                 logger.info('Updating Covariances ...')
                 map_pt = step.get_map_end_points()
                 update.update_weights(map_pt, n_jobs=n_jobs)
+                if pool is not None:
+                    # workers need to be forked again with updated weights
+                    pool.close()
+
                 mtrace = update_last_samples(
-                    homepath, step, progressbar, model, n_jobs, rm_flag)
+                    homepath, step, progressbar, model, n_jobs, rm_flag,
+                    pool=pool)
                 step.population, step.array_population, step.likelihoods = \
                     step.select_end_points(mtrace)
 
             step.beta, step.old_beta, step.weights = step.calc_beta()
 
+            if resolution is not None and resolution.update(step.beta):
+                logger.info('Evaluating end points at the finer resolution')
+                if pool is not None:
+                    # workers need to be forked again with updated weights
+                    pool.close()
+
+                step.beta = step.old_beta
+                step.previous_likelihoods = step.likelihoods
+                mtrace = update_last_samples(
+                    homepath, step, progressbar, model, n_jobs, rm_flag,
+                    pool=pool, prefix='resolution')
+                step.population, step.array_population, step.likelihoods = \
+                    step.select_end_points(mtrace)
+                step.beta, step.old_beta, step.weights = step.calc_beta()
+
             if step.beta > 1.:
                 logger.info('Beta > 1.: %f' % step.beta)
                 step.beta = 1.
@@ -481,11 +821,11 @@ def smc_sample(
                     chains = None
             else:
                 step.covariance = step.calc_covariance()
-                step.proposal_dist = choose_proposal(
-                    step.proposal_name, scale=step.covariance)
                 step.resampling_indexes = step.resample()
+                step.update_proposal_dist()
                 step.chain_previous_lpoint = \
                     step.get_chain_previous_lpoint(mtrace)
+                step.previous_likelihoods = None
 
                 outparam_list = [step.get_sampler_state(), update]
                 stage_handler.dump_atmip_params(step.stage, outparam_list)
@@ -498,21 +838,24 @@ def smc_sample(
         logger.info('Sample final stage with n_steps %i ' % draws)
         step.stage = -1
 
-        temp = np.exp((1 - step.old_beta) *
-                      (step.likelihoods - step.likelihoods.max()))
+        temp = step.importance_weights(1., step.old_beta)
         step.weights = temp / np.sum(temp)
+        step.previous_likelihoods = None
         step.covariance = step.calc_covariance()
-        step.proposal_dist = choose_proposal(
-            step.proposal_name, scale=step.covariance)
-
         step.resampling_indexes = step.resample()
+        step.update_proposal_dist()
         step.chain_previous_lpoint = step.get_chain_previous_lpoint(mtrace)
 
         sample_args['draws'] = draws
         sample_args['step'] = step
         sample_args['stage_path'] = stage_handler.stage_path(step.stage)
         sample_args['chains'] = chains
-        iter_parallel_chains(**sample_args)
+        if population_batch:
+            sample_args['stage_controller'] = None
+        iter_chains(**sample_args)
+
+        if pool is not None:
+            pool.close()
 
         outparam_list = [step.get_sampler_state(), update]
         stage_handler.dump_atmip_params(step.stage, outparam_list)
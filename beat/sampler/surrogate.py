@@ -0,0 +1,307 @@
+"""
+Emulators of the model likelihood that are trained on the samples of
+previous sampling stages, to prescreen proposals or to sample an
+approximate posterior without evaluating the forward model.
+"""
+import logging
+
+import numpy as num
+from scipy.linalg import cho_factor, cho_solve, LinAlgError
+
+from beat.utility import list2string
+
+
+logger = logging.getLogger('surrogate')
+
+
+__all__ = [
+    'GaussianProcessEmulator',
+    'LikelihoodEmulator',
+    'emulator_modes']
+
+
+emulator_modes = ['prescreen', 'approximate']
+
+
+def squared_distances(x1, x2):
+    """
+    Squared euclidean distances between the rows of two arrays.
+    """
+    d2 = (x1 ** 2).sum(axis=1)[:, num.newaxis] + \
+        (x2 ** 2).sum(axis=1)[num.newaxis, :] - 2. * x1.dot(x2.T)
+    return num.maximum(d2, 0.)
+
+
+class GaussianProcessEmulator(object):
+    """
+    Gaussian process regression with squared exponential kernel on
+    standardized inputs and outputs. The length scale is set to the median
+    distance of the training inputs.
+
+    Parameters
+    ----------
+    max_samples : int
+        maximum number of training samples, if exceeded the oldest samples
+        are discarded
+    lengthscale_factor : float
+        factor applied to the median distance of the training inputs
+    nugget : float
+        relative noise variance added to the kernel diagonal for
+        numerical stability
+    """
+
+    def __init__(self, max_samples=1000, lengthscale_factor=1., nugget=1e-6):
+        self.max_samples = max_samples
+        self.lengthscale_factor = lengthscale_factor
+        self.nugget = nugget
+
+        self.X = None
+        self.Y = None
+        self._alpha = None
+
+    @property
+    def n_samples(self):
+        if self.X is None:
+            return 0
+        else:
+            return self.X.shape[0]
+
+    @property
+    def fitted(self):
+        return self._alpha is not None
+
+    def _standardize(self, X):
+        return (X - self._x_mean) / self._x_std
+
+    def fit(self, X, Y):
+        """
+        Fit the emulator to the training samples.
+
+        Parameters
+        ----------
+        X : :class:`numpy.ndarray`
+            (n_samples, n_dim) of input points
+        Y : :class:`numpy.ndarray`
+            (n_samples, n_outputs) of output values
+        """
+        X = num.atleast_2d(X)
+        Y = num.asarray(Y).reshape((X.shape[0], -1))
+
+        if X.shape[0] > self.max_samples:
+            X = X[-self.max_samples:]
+            Y = Y[-self.max_samples:]
+
+        self.X = X
+        self.Y = Y
+
+        self._x_mean = X.mean(axis=0)
+        self._x_std = X.std(axis=0)
+        self._x_std[self._x_std == 0.] = 1.
+        self._y_mean = Y.mean(axis=0)
+        self._y_std = Y.std(axis=0)
+        self._y_std[self._y_std == 0.] = 1.
+
+        Xs = self._standardize(X)
+        d2 = squared_distances(Xs, Xs)
+        median = num.sqrt(num.median(d2[num.triu_indices_from(d2, k=1)]))
+        if not num.isfinite(median) or median == 0.:
+            median = 1.
+
+        self.lengthscale = self.lengthscale_factor * median
+        K = num.exp(-0.5 * d2 / self.lengthscale ** 2)
+
+        nugget = self.nugget
+        while True:
+            try:
+                factor = cho_factor(
+                    K + nugget * num.eye(K.shape[0]), lower=True)
+                break
+            except LinAlgError:
+                nugget *= 10.
+                if nugget > 1.:
+                    raise ValueError('Emulator kernel is not invertible!')
+
+        self._alpha = cho_solve(
+            factor, (Y - self._y_mean) / self._y_std)
+
+        logger.debug(
+            'Fitted emulator to %i samples, lengthscale: %f' % (
+                self.n_samples, self.lengthscale))
+
+    def update(self, X, Y):
+        """
+        Add training samples and refit the emulator.
+
+        Parameters
+        ----------
+        X : :class:`numpy.ndarray`
+            (n_samples, n_dim) of input points
+        Y : :class:`numpy.ndarray`
+            (n_samples, n_outputs) of output values
+        """
+        X = num.atleast_2d(X)
+        Y = num.asarray(Y).reshape((X.shape[0], -1))
+
+        if X.shape[0] > self.max_samples:
+            idxs = num.sort(num.random.choice(
+                X.shape[0], self.max_samples, replace=False))
+            X = X[idxs]
+            Y = Y[idxs]
+
+        if self.X is not None:
+            X = num.vstack((self.X, X))
+            Y = num.vstack((self.Y, Y))
+
+        self.fit(X, Y)
+
+    def predict(self, X):
+        """
+        Predict the outputs at the given points.
+
+        Parameters
+        ----------
+        X : :class:`numpy.ndarray`
+            (n_points, n_dim) of input points
+
+        Returns
+        -------
+        :class:`numpy.ndarray` (n_points, n_outputs)
+        """
+        if not self.fitted:
+            raise ValueError('Emulator has not been fitted!')
+
+        Xs = self._standardize(num.atleast_2d(X))
+        Ks = num.exp(
+            -0.5 * squared_distances(Xs, self._standardize(self.X)) /
+            self.lengthscale ** 2)
+        return Ks.dot(self._alpha) * self._y_std + self._y_mean
+
+
+class LikelihoodEmulator(object):
+    """
+    Emulator of the dataset likelihoods of a model, trained on the sampled
+    points and likelihoods stored in the traces of previous stages.
+
+    Parameters
+    ----------
+    step : :class:`beat.sampler.Metropolis` or :class:`beat.sampler.SMC`
+        sampler object, whose variable orderings are used
+    likelihood_names : list
+        of str, names of the variables with the dataset likelihoods,
+        e.g. 'geo_like', 'seis_like', their sum is the model likelihood
+    mode : str
+        'prescreen': proposals are prescreened with the emulated likelihood
+        'approximate': after 'exact_stages' the forward model is replaced
+        by the emulator, resulting in an approximate posterior
+    exact_stages : int
+        number of stages sampled with the forward model to train the
+        emulator before it replaces the forward model, if 'approximate'
+    emulator : :class:`GaussianProcessEmulator`
+        regression model, if None a default one is created
+    """
+
+    def __init__(self, step, likelihood_names, mode='prescreen',
+                 exact_stages=2, emulator=None):
+
+        if mode not in emulator_modes:
+            raise ValueError(
+                'Emulator mode "%s" not supported! Options: %s' % (
+                    mode, list2string(emulator_modes)))
+
+        if emulator is None:
+            emulator = GaussianProcessEmulator()
+
+        self.ordering = step.ordering
+        self.lordering = step.lordering
+        self.lij = step.lij
+        self.bij = step.bij
+        self.likelihood_name = step.likelihood_name
+        self.likelihood_names = likelihood_names
+        self.mode = mode
+        self.exact_stages = exact_stages
+        self.emulator = emulator
+
+    def get_training_data(self, mtrace):
+        """
+        Get the sampled points in array space and the dataset likelihoods
+        from the trace.
+
+        Parameters
+        ----------
+        mtrace : :class:`pymc3.backends.base.MultiTrace`
+
+        Returns
+        -------
+        X : :class:`numpy.ndarray` (n_samples, n_dim)
+        Y : :class:`numpy.ndarray` (n_samples, n_datasets)
+        """
+        X = None
+        for var, slc, _, _ in self.ordering.vmap:
+            values = mtrace.get_values(var, combine=True, squeeze=True)
+            values = num.atleast_1d(values).reshape((len(values), -1))
+            if X is None:
+                X = num.zeros((values.shape[0], self.ordering.size))
+
+            X[:, slc] = values
+
+        Y = num.hstack([
+            num.atleast_1d(
+                mtrace.get_values(name, combine=True, squeeze=True)).reshape(
+                    (X.shape[0], -1))
+            for name in self.likelihood_names])
+
+        return X, Y
+
+    def update(self, mtrace):
+        """
+        Add the samples of the trace to the training samples of the emulator
+        and refit it.
+
+        Parameters
+        ----------
+        mtrace : :class:`pymc3.backends.base.MultiTrace`
+        """
+        X, Y = self.get_training_data(mtrace)
+        self.emulator.update(X, Y)
+        logger.info(
+            'Updated likelihood emulator, training samples: %i' %
+            self.emulator.n_samples)
+
+    def __call__(self, q):
+        """
+        Emulated model likelihood at the point in array space, in the
+        output format of the compiled forward model
+        (see :func:`beat.sampler.base.logp_forw`).
+        """
+        return [num.atleast_1d(self.emulator.predict(q).sum())]
+
+    def forward(self, q):
+        """
+        Emulated output variables at the point in array space, replacement
+        for the compiled forward model. The sampled variables are taken
+        from the point, the dataset likelihoods are emulated and all other
+        output variables are filled with dummy values.
+
+        Parameters
+        ----------
+        q : :class:`numpy.ndarray`
+            point in array space
+
+        Returns
+        -------
+        lpoint : list of :class:`numpy.ndarray`
+        """
+        lpoint = self.lij.d2l(self.bij.rmap(q))
+        dataset_llks = self.emulator.predict(q)[0]
+
+        i = 0
+        for name in self.likelihood_names:
+            list_ind, _, shp, dtype, _ = self.lordering[name]
+            size = int(num.prod(shp))
+            lpoint[list_ind] = dataset_llks[i:i + size].reshape(
+                shp).astype(dtype)
+            i += size
+
+        list_ind, _, shp, dtype, _ = self.lordering[self.likelihood_name]
+        lpoint[list_ind] = num.full(shp, dataset_llks.sum(), dtype=dtype)
+        return lpoint
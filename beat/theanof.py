@@ -22,31 +22,227 @@ km = 1000.
 logger = logging.getLogger('theanof')
 
 
-class GeoSynthesizer(theano.Op):
+class PopulationSynthesizer(object):
+    """
+    Mixin for the forward model Ops. Allows to calculate the synthetics of
+    a whole population of input points in one batch ahead of the individual
+    evaluations of the Op, e.g. for all proposals of the SMC chains.
+    The batch results are kept until the Op is performed on the respective
+    inputs.
+    """
+
+    def _population_key(self, inputs):
+        return tuple(
+            num.asarray(i, dtype=theano.config.floatX).tobytes()
+            for i in inputs)
+
+    def _get_prefetched(self, inputs):
+        cache = self.__dict__.get('_population_cache', None)
+        if cache:
+            return cache.pop(self._population_key(inputs), None)
+
+        return None
+
+    def clear_population_cache(self):
+        self._population_cache = {}
+
+    def prefetch(self, inputs_population):
+        """
+        Calculate and cache synthetics for a population of inputs.
+
+        Parameters
+        ----------
+        inputs_population : list
+            of dicts with the input variable names of the Op as keys and
+            :class:`numpy.ndarray` values
+        """
+        inputs_list = [
+            [inputs[vname] for vname in self.varnames]
+            for inputs in inputs_population]
+
+        results = self.perform_population(inputs_list)
+
+        self._population_cache = {
+            self._population_key(inputs): result
+            for inputs, result in zip(inputs_list, results)}
+
+    def perform_population(self, inputs_list):
+        raise NotImplementedError('Needs to be implemented in subclass!')
+
+
+class SourceCacheSynthesizer(object):
+    """
+    Mixin for the forward model Ops. Keeps the synthetics of each source
+    of the last evaluation of the Op, so that only the synthetics of the
+    sources with changed parameters are calculated, e.g. for the proposals
+    of blocked or component-wise steps of multi-source models.
+    """
+
+    def _source_keys(self, inputs, exclude=('time_shift',), extra=b''):
+        keys = [[extra] for _ in self.sources]
+        for vname, i in zip(self.varnames, inputs):
+            if vname in exclude:
+                continue
+
+            values = num.asarray(i, dtype=theano.config.floatX)
+            for k, key in enumerate(keys):
+                key.append(values[k].tobytes())
+
+        return [tuple(key) for key in keys]
+
+    def clear_source_cache(self):
+        self._source_cache = None
+
+    def _get_source_contributions(self, keys, calculate):
+        """
+        Get the synthetics of each source from the cache, the synthetics of
+        sources with changed keys are updated.
+
+        Parameters
+        ----------
+        keys : list
+            of hashable source keys, one for each source
+        calculate : callable
+            returning the synthetics for each of a list of source indexes
+
+        Returns
+        -------
+        list of synthetics for each source
+        """
+        cache = self.__dict__.get('_source_cache', None)
+        if cache is None:
+            cache = [(None, None)] * len(keys)
+
+        changed = [k for k, key in enumerate(keys) if cache[k][0] != key]
+        if changed:
+            logger.debug(
+                'Calculating synthetics for sources %s' % utility.list2string(
+                    changed))
+            cache = list(cache)
+            for k, contribution in zip(changed, calculate(changed)):
+                cache[k] = (keys[k], contribution)
+
+            self._source_cache = cache
+
+        return [contribution for _, contribution in cache]
+
+    def _cached_seis_synthetics(
+            self, inputs, targets_list, arrival_tapers, wavenames, filterers,
+            arrival_times_list, pre_stack_cut=False):
+        """
+        Calculate seismic synthetics, the filtered, not yet windowed traces
+        are cached for each source. Unless the GF traces are cut before
+        stacking, inputs that differ only in the station corrections
+        ("time_shift") are windowed without calling the engine. The
+        windows start exactly at the shifted arrival times, including
+        fractions of a sample.
+
+        Sources need to be updated already with the inputs.
+
+        Returns
+        -------
+        list of tuples of synthetic waveforms :class:`numpy.ndarray`
+        (n x nsamples) and start times :class:`numpy.ndarray` (n x 1),
+        one tuple for each waveform mapping
+        """
+        taperers_list = []
+        for targets, arrival_taper, wavename, arrival_times in zip(
+                targets_list, arrival_tapers, wavenames, arrival_times_list):
+            taperers_list.append([heart.get_phase_taperer(
+                engine=self.engine,
+                source=self.sources[0],
+                wavename=wavename,
+                target=target,
+                arrival_taper=arrival_taper,
+                arrival_time=arrival_times[j])
+                for j, target in enumerate(targets)])
+
+        if pre_stack_cut:
+            # the cut GF traces depend on the arrival times
+            extra = num.concatenate(arrival_times_list).tobytes()
+            for targets, taperers in zip(targets_list, taperers_list):
+                for target, taperer in zip(targets, taperers):
+                    target.update_target_times(self.sources, taperer)
+        else:
+            extra = b''
+
+        def calculate(source_idxs):
+            all_targets = [
+                target for targets in targets_list for target in targets]
+            traces = heart.process_targets(
+                engine=self.engine,
+                sources=[self.sources[k] for k in source_idxs],
+                targets=all_targets,
+                nprocs=self.nprocs)
+
+            nt = len(all_targets)
+            target_offsets = num.cumsum(
+                [0] + [len(targets) for targets in targets_list])
+
+            filtered_traces = []
+            for i, (targets, filterer) in enumerate(
+                    zip(targets_list, filterers)):
+                filtered_traces.append(heart.filter_synthetics(
+                    traces=[
+                        traces[k * nt + j] for k in range(len(source_idxs))
+                        for j in range(
+                            target_offsets[i], target_offsets[i + 1])],
+                    targets=targets,
+                    filterer=filterer))
+
+            return [
+                [wtraces[k * len(targets):(k + 1) * len(targets)]
+                 for wtraces, targets in zip(filtered_traces, targets_list)]
+                for k in range(len(source_idxs))]
+
+        contributions = self._get_source_contributions(
+            self._source_keys(inputs, extra=extra), calculate)
+
+        results = []
+        for i, taperers in enumerate(taperers_list):
+            results.append(heart.window_synthetics(
+                traces=[
+                    tr for contribution in contributions
+                    for tr in contribution[i]],
+                taperers=taperers,
+                subsample_shift=True))
+
+        return results
+
+
+class GeoSynthesizer(
+        PopulationSynthesizer, SourceCacheSynthesizer, theano.Op):
     """
     Theano wrapper for a geodetic forward model with synthetic displacements.
-    Uses pyrocko engine and fomosto GF stores.
+    Uses pyrocko engine and fomosto GF stores or the analytical
+    :class:`beat.okada.OkadaEngine`.
     Input order does not matter anymore! Did in previous version.
 
     Parameters
     ----------
     engine : :class:`pyrocko.gf.seismosizer.LocalEngine`
+        or :class:`beat.okada.OkadaEngine`
     sources : List
         containing :class:`pyrocko.gf.seismosizer.Source` Objects
     targets : List
         containing :class:`pyrocko.gf.targets.StaticTarget` Objects
+    nprocs : int
+        number of threads to use for the synthetics calculation
     """
 
     __props__ = ('engine', 'sources', 'targets')
 
-    def __init__(self, engine, sources, targets):
+    def __init__(self, engine, sources, targets, nprocs=1):
         self.engine = engine
         self.sources = tuple(sources)
         self.targets = tuple(targets)
         self.nobs = sum([target.lats.size for target in self.targets])
+        self.nprocs = nprocs
 
     def __getstate__(self):
         self.engine.close_cashed_stores()
+        self.clear_population_cache()
+        self.clear_source_cache()
         return self.__dict__
 
     def __setstate__(self, state):
@@ -91,22 +287,70 @@ class GeoSynthesizer(theano.Op):
         """
         synths = output[0]
 
+        prefetched = self._get_prefetched(inputs)
+        if prefetched is not None:
+            synths[0] = prefetched
+            return
+
+        self._update_sources(self.sources, inputs)
+
+        def calculate(source_idxs):
+            disp_arrays = heart.geo_synthetics(
+                engine=self.engine,
+                targets=self.targets,
+                sources=[self.sources[k] for k in source_idxs],
+                outmode='arrays',
+                nprocs=self.nprocs)
+
+            nt = len(self.targets)
+            return [
+                num.vstack(disp_arrays[k * nt:(k + 1) * nt])
+                for k in range(len(source_idxs))]
+
+        contributions = self._get_source_contributions(
+            self._source_keys(inputs, exclude=()), calculate)
+
+        synths[0] = num.zeros((self.nobs, 3))
+        for contribution in contributions:
+            synths[0] += contribution
+
+    def _update_sources(self, sources, inputs):
         point = {vname: i for vname, i in zip(self.varnames, inputs)}
 
         mpoint = utility.adjust_point_units(point)
 
         source_points = utility.split_point(mpoint)
 
-        for i, source in enumerate(self.sources):
+        for i, source in enumerate(sources):
             utility.update_source(source, **source_points[i])
             # reset source time may result in store error otherwise
             source.time = 0.
 
-        synths[0] = heart.geo_synthetics(
+    def perform_population(self, inputs_list):
+        """
+        Calculate synthetic displacements for a list of Op inputs in one
+        engine call.
+
+        Parameters
+        ----------
+        inputs_list : list
+            of lists of :class:`numpy.ndarray` in the order of the Op inputs
+
+        Returns
+        -------
+        list of :class:`numpy.ndarray` (n x 3) synthetic displacements
+        """
+        sources_population = []
+        for inputs in inputs_list:
+            sources = [source.clone() for source in self.sources]
+            self._update_sources(sources, inputs)
+            sources_population.append(sources)
+
+        return heart.geo_synthetics_population(
             engine=self.engine,
             targets=self.targets,
-            sources=self.sources,
-            outmode='stacked_array')
+            sources_population=sources_population,
+            nprocs=self.nprocs)
 
     def infer_shape(self, node, input_shapes):
         return [(self.nobs, 3)]
@@ -290,7 +534,8 @@ class GeoInterseismicSynthesizer(theano.Op):
             return [(len(self.lats), 3)]
 
 
-class SeisSynthesizer(theano.Op):
+class SeisSynthesizer(
+        PopulationSynthesizer, SourceCacheSynthesizer, theano.Op):
     """
     Theano wrapper for a seismic forward model with synthetic waveforms.
     Input order does not matter anymore! Did in previous version.
@@ -307,6 +552,8 @@ class SeisSynthesizer(theano.Op):
     arrival_times : :class:`ǹumpy.NdArray`
         with synthetic arrival times wrt reference event
     filterer : :class:`heart.Filterer`
+    nprocs : int
+        number of threads to use for the synthetics calculation
     """
 
     __props__ = ('engine', 'sources', 'targets', 'event',
@@ -315,7 +562,7 @@ class SeisSynthesizer(theano.Op):
 
     def __init__(self, engine, sources, targets, event, arrival_taper,
                  arrival_times, wavename, filterer, pre_stack_cut,
-                 station_corrections):
+                 station_corrections, nprocs=1):
         self.engine = engine
         self.sources = tuple(sources)
         self.targets = tuple(targets)
@@ -326,9 +573,12 @@ class SeisSynthesizer(theano.Op):
         self.filterer = filterer
         self.pre_stack_cut = pre_stack_cut
         self.station_corrections = station_corrections
+        self.nprocs = nprocs
 
     def __getstate__(self):
         self.engine.close_cashed_stores()
+        self.clear_population_cache()
+        self.clear_source_cache()
         return self.__dict__
 
     def __setstate__(self, state):
@@ -375,6 +625,27 @@ class SeisSynthesizer(theano.Op):
         synths = output[0]
         tmins = output[1]
 
+        prefetched = self._get_prefetched(inputs)
+        if prefetched is not None:
+            synths[0], tmins[0] = prefetched
+            return
+
+        arrival_times = self._update_sources(self.sources, inputs)
+
+        [(synths[0], tmins[0])] = self._cached_seis_synthetics(
+            inputs=inputs,
+            targets_list=[self.targets],
+            arrival_tapers=[self.arrival_taper],
+            wavenames=[self.wavename],
+            filterers=[self.filterer],
+            arrival_times_list=[arrival_times],
+            pre_stack_cut=self.pre_stack_cut)
+
+    def _update_sources(self, sources, inputs):
+        """
+        Update sources (in place) with the Op inputs and return the
+        arrival times including station corrections.
+        """
         point = {vname: i for vname, i in zip(self.varnames, inputs)}
 
         mpoint = utility.adjust_point_units(point)
@@ -387,19 +658,49 @@ class SeisSynthesizer(theano.Op):
 
         source_points = utility.split_point(mpoint)
 
-        for i, source in enumerate(self.sources):
+        for i, source in enumerate(sources):
             utility.update_source(source, **source_points[i])
             source.time += self.event.time
 
-        synths[0], tmins[0] = heart.seis_synthetics(
+        return arrival_times
+
+    def perform_population(self, inputs_list):
+        """
+        Calculate synthetic waveforms for a list of Op inputs in one
+        engine call.
+
+        Parameters
+        ----------
+        inputs_list : list
+            of lists of :class:`numpy.ndarray` in the order of the Op inputs
+
+        Returns
+        -------
+        list of tuples of synthetic waveforms :class:`numpy.ndarray`
+        (n x nsamples) and start times :class:`numpy.ndarray` (n x 1)
+        """
+        if self.pre_stack_cut:
+            raise NotImplementedError(
+                'Population synthetics do not support "pre_stack_cut"!')
+
+        sources_population = []
+        arrival_times_population = []
+        for inputs in inputs_list:
+            sources = [source.clone() for source in self.sources]
+            arrival_times_population.append(
+                self._update_sources(sources, inputs))
+            sources_population.append(sources)
+
+        return heart.seis_synthetics_population(
             engine=self.engine,
-            sources=self.sources,
+            sources_population=sources_population,
             targets=self.targets,
             arrival_taper=self.arrival_taper,
             wavename=self.wavename,
             filterer=self.filterer,
-            pre_stack_cut=self.pre_stack_cut,
-            arrival_times=arrival_times)
+            arrival_times_population=arrival_times_population,
+            nprocs=self.nprocs,
+            subsample_shift=True)
 
     def infer_shape(self, node, input_shapes):
         nrow = len(self.targets)
@@ -409,6 +710,274 @@ class SeisSynthesizer(theano.Op):
         return [(nrow, ncol), (nrow,)]
 
 
+class MultiSeisSynthesizer(
+        PopulationSynthesizer, SourceCacheSynthesizer, theano.Op):
+    """
+    Theano wrapper for a seismic forward model with synthetic waveforms
+    for several waveform mappings (e.g. P on Z and S on T components).
+    The sources are updated once and the synthetics for the targets of
+    all waveform mappings are calculated with a single engine call.
+    Returns synthetics and start times for each waveform mapping.
+
+    Parameters
+    ----------
+    engine : :class:`pyrocko.gf.seismosizer.LocalEngine`
+    sources : List
+        containing :class:`pyrocko.gf.seismosizer.Source` Objects
+    targets : List
+        of lists containing :class:`pyrocko.gf.seismosizer.Target` Objects,
+        for each waveform mapping
+    event : :class:`pyrocko.model.Event`
+    arrival_tapers : List
+        of :class:`heart.ArrivalTaper` for each waveform mapping
+    arrival_times : List
+        of :class:`numpy.NdArray` with synthetic arrival times wrt
+        reference event for each waveform mapping
+    wavenames : List
+        of str, waveform names for each waveform mapping
+    filterers : List
+        of :class:`heart.Filterer` for each waveform mapping
+    station_corrections : bool
+        if True, the input "time_shift" contains the station corrections
+        of all waveform mappings concatenated
+    nprocs : int
+        number of threads to use for the synthetics calculation
+    """
+
+    __props__ = ('engine', 'sources', 'targets', 'event',
+                 'arrival_tapers', 'arrival_times', 'wavenames', 'filterers',
+                 'station_corrections')
+
+    def __init__(self, engine, sources, targets, event, arrival_tapers,
+                 arrival_times, wavenames, filterers, station_corrections,
+                 nprocs=1):
+        self.engine = engine
+        self.sources = tuple(sources)
+        self.targets = tuple(tuple(wtargets) for wtargets in targets)
+        self.event = event
+        self.arrival_tapers = tuple(arrival_tapers)
+        self.arrival_times = tuple(
+            tuple(num.asarray(warrival_times).tolist())
+            for warrival_times in arrival_times)
+        self.wavenames = tuple(wavenames)
+        self.filterers = tuple(filterers)
+        self.station_corrections = station_corrections
+        self.nprocs = nprocs
+
+    @property
+    def n_wavemaps(self):
+        return len(self.targets)
+
+    def __getstate__(self):
+        self.engine.close_cashed_stores()
+        self.clear_population_cache()
+        self.clear_source_cache()
+        return self.__dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def make_node(self, inputs):
+        """
+        Transforms theano tensors to node and allocates variables accordingly.
+
+        Parameters
+        ----------
+        inputs : dict
+            keys being strings of source attributes of the
+            :class:`pscmp.RectangularSource` that was used to initialise
+            the Operator
+            values are :class:`theano.tensor.Tensor`
+        """
+        inlist = []
+
+        self.varnames = list(inputs.keys())
+
+        for i in inputs.values():
+            inlist.append(tt.as_tensor_variable(i))
+
+        outm = tt.as_tensor_variable(num.zeros((2, 2)))
+        outv = tt.as_tensor_variable(num.zeros((2)))
+        outlist = [outm.type(), outv.type()] * self.n_wavemaps
+        return theano.Apply(self, inlist, outlist)
+
+    def perform(self, node, inputs, output):
+        """
+        Perform method of the Operator to calculate synthetic waveforms.
+
+        Parameters
+        ----------
+        inputs : list
+            of :class:`numpy.ndarray`
+        output : list
+            for each waveform mapping
+            1) of synthetic waveforms of :class:`numpy.ndarray`
+               (n x nsamples)
+            2) of start times of the first waveform samples
+               :class:`numpy.ndarray` (n x 1)
+        """
+        results = self._get_prefetched(inputs)
+        if results is None:
+            arrival_times = self._update_sources(self.sources, inputs)
+
+            results = self._cached_seis_synthetics(
+                inputs=inputs,
+                targets_list=self.targets,
+                arrival_tapers=self.arrival_tapers,
+                wavenames=self.wavenames,
+                filterers=self.filterers,
+                arrival_times_list=arrival_times)
+
+        for i, (synths, tmins) in enumerate(results):
+            output[2 * i][0] = synths
+            output[2 * i + 1][0] = tmins
+
+    def _update_sources(self, sources, inputs):
+        """
+        Update sources (in place) with the Op inputs and return the
+        arrival times including station corrections for each waveform
+        mapping.
+        """
+        point = {vname: i for vname, i in zip(self.varnames, inputs)}
+
+        mpoint = utility.adjust_point_units(point)
+
+        arrival_times = num.concatenate(self.arrival_times)
+        if self.station_corrections:
+            arrival_times = arrival_times + mpoint.pop('time_shift').ravel()
+
+        source_points = utility.split_point(mpoint)
+
+        for i, source in enumerate(sources):
+            utility.update_source(source, **source_points[i])
+            source.time += self.event.time
+
+        offsets = num.cumsum(
+            [len(warrival_times) for warrival_times in self.arrival_times])
+        return num.split(arrival_times, offsets[:-1])
+
+    def perform_population(self, inputs_list):
+        """
+        Calculate synthetic waveforms for a list of Op inputs and all
+        waveform mappings with one engine call.
+
+        Parameters
+        ----------
+        inputs_list : list
+            of lists of :class:`numpy.ndarray` in the order of the Op inputs
+
+        Returns
+        -------
+        list of lists of tuples of synthetic waveforms :class:`numpy.ndarray`
+        (n x nsamples) and start times :class:`numpy.ndarray` (n x 1),
+        for each input and waveform mapping
+        """
+        sources_population = []
+        arrival_times_population = []
+        for inputs in inputs_list:
+            sources = [source.clone() for source in self.sources]
+            arrival_times_population.append(
+                self._update_sources(sources, inputs))
+            sources_population.append(sources)
+
+        return heart.seis_synthetics_population_wavemaps(
+            engine=self.engine,
+            sources_population=sources_population,
+            targets_list=self.targets,
+            arrival_tapers=self.arrival_tapers,
+            wavenames=self.wavenames,
+            filterers=self.filterers,
+            arrival_times_population=arrival_times_population,
+            nprocs=self.nprocs,
+            subsample_shift=True)
+
+    def infer_shape(self, node, input_shapes):
+        shapes = []
+        for targets, arrival_taper in zip(self.targets, self.arrival_tapers):
+            nrow = len(targets)
+            store = self.engine.get_store(targets[0].store_id)
+            ncol = int(num.ceil(
+                store.config.sample_rate * arrival_taper.duration()))
+            shapes.extend([(nrow, ncol), (nrow,)])
+
+        return shapes
+
+
+class ToeplitzQuadraticForm(theano.Op):
+    """
+    Theano wrapper for the quadratic form r^T * C^-1 * r of a residual with
+    the inverse of a scaled Toeplitz covariance matrix, given by its
+    structured weight, see :class:`heart.ToeplitzCovariance`.
+    """
+
+    __props__ = ()
+
+    def make_node(self, weight, residual):
+        inlist = [
+            tt.as_tensor_variable(weight),
+            tt.as_tensor_variable(residual)]
+
+        out = tt.as_tensor_variable(num.zeros((), dtype=theano.config.floatX))
+        outlist = [out.type()]
+        return theano.Apply(self, inlist, outlist)
+
+    def perform(self, node, inputs, output):
+        weight, residual = inputs
+        z = output[0]
+
+        z[0] = num.asarray(
+            heart.toeplitz_quadratic_form(weight, residual),
+            dtype=theano.config.floatX)
+
+    def grad(self, inputs, output_grads):
+        weight, residual = inputs
+        gz, = output_grads
+        return [
+            theano.gradient.grad_not_implemented(self, 0, weight),
+            2. * gz * ToeplitzInverseProduct()(weight, residual)]
+
+    def infer_shape(self, node, input_shapes):
+        return [()]
+
+
+class ToeplitzInverseProduct(theano.Op):
+    """
+    Theano wrapper for the product C^-1 * r of a residual with the inverse
+    of a scaled Toeplitz covariance matrix, given by its structured weight,
+    see :class:`heart.ToeplitzCovariance`. Gradient of
+    :class:`ToeplitzQuadraticForm`.
+    """
+
+    __props__ = ()
+
+    def make_node(self, weight, residual):
+        inlist = [
+            tt.as_tensor_variable(weight),
+            tt.as_tensor_variable(residual)]
+
+        outlist = [inlist[1].type()]
+        return theano.Apply(self, inlist, outlist)
+
+    def perform(self, node, inputs, output):
+        weight, residual = inputs
+        z = output[0]
+
+        z[0] = num.asarray(
+            heart.toeplitz_inverse_product(weight, residual),
+            dtype=node.outputs[0].dtype)
+
+    def grad(self, inputs, output_grads):
+        weight, residual = inputs
+        gz, = output_grads
+        # the inverse covariance matrix is symmetric
+        return [
+            theano.gradient.grad_not_implemented(self, 0, weight),
+            self(weight, gz)]
+
+    def infer_shape(self, node, input_shapes):
+        return [input_shapes[1]]
+
+
 class SeisDataChopper(theano.Op):
     """
     Deprecated!
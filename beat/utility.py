@@ -1038,11 +1038,12 @@ def repair_covariance(x, epsilon=num.finfo(num.float64).eps):
 def running_window_rms(data, window_size, mode='valid'):
     """
     Calculate the standard deviations of a running window over data.
+    Vectorized over several data arrays of equal size.
 
     Parameters
     ----------
-    data : :class:`numpy.ndarray` 1-d
-        containing data to calculate stds from
+    data : :class:`numpy.ndarray` 1-d or 2-d
+        containing data to calculate stds from, along the last axis
     window_size : int
         sample size of running window
     mode : str
@@ -1050,12 +1051,31 @@ def running_window_rms(data, window_size, mode='valid'):
 
     Returns
     -------
-    :class:`numpy.ndarray` 1-d
-        with stds, size data.size - window_size + 1
+    :class:`numpy.ndarray` 1-d or 2-d
+        with stds, size data.size - window_size + 1 for mode 'valid'
     """
     data2 = num.power(data, 2)
-    window = num.ones(window_size) / float(window_size)
-    return num.sqrt(num.convolve(data2, window, mode))
+    nsamples = data2.shape[-1]
+
+    # running sums from the cumulative sum of the zero padded data,
+    # equal to the full convolution with the window
+    padding = [(0, 0)] * (data2.ndim - 1) + [(window_size, window_size - 1)]
+    cumsum = num.cumsum(num.pad(data2, padding, mode='constant'), axis=-1)
+    full = (cumsum[..., window_size:] - cumsum[..., :-window_size]) / \
+        float(window_size)
+
+    nmin = min(nsamples, window_size)
+    if mode == 'full':
+        istart, nout = 0, nsamples + window_size - 1
+    elif mode == 'same':
+        istart, nout = (nmin - 1) // 2, max(nsamples, window_size)
+    elif mode == 'valid':
+        istart, nout = nmin - 1, abs(nsamples - window_size) + 1
+    else:
+        raise ValueError('Mode "%s" not supported!' % mode)
+
+    # cumulative sums may result in tiny negative values
+    return num.sqrt(num.maximum(full[..., istart:istart + nout], 0.))
 
 
 def list2string(l, fill=', '):
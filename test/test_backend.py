@@ -5,7 +5,8 @@ import numpy as num
 import pymc3 as pm
 import theano.tensor as tt
 
-from beat.backend import TextChain, NumpyChain, load_multitrace, check_multitrace
+from beat.backend import TextChain, NumpyChain, load_multitrace, check_multitrace, \
+    dump_stage_draws, load_stage_draws
 
 
 class TestBackend(TestCase):
@@ -134,6 +135,30 @@ class TestBackend(TestCase):
         for data_key in self.data_keys:
             self.assertEqual(chain_at[data_key].all(), self.expected_chain_data.get(data_key)[data_index].all())
 
+    def test_checkpoint(self):
+        numpy_chain = NumpyChain(
+            dir_path=self.test_dir_path, model=self.PT_test)
+        numpy_chain.setup(10, 1, overwrite=True)
+        self.assertIsNone(numpy_chain.load_checkpoint(1))
+
+        draw = 0
+        for lpoint in self.data:
+            draw += 1
+            numpy_chain.write(lpoint, draw)
+
+        numpy_chain.checkpoint = dict(
+            stage=0, beta=1., draws=10, draw=draw,
+            chain_state={'cumulative_samples': draw})
+        numpy_chain.record_buffer()
+
+        checkpoint = numpy_chain.load_checkpoint(1)
+        self.assertEqual(checkpoint['draw'], self.sample_size)
+        self.assertEqual(checkpoint['n_stored'], self.sample_size)
+        self.assertEqual(len(numpy_chain), checkpoint['n_stored'])
+
+        numpy_chain.setup(10, 1, overwrite=True)
+        self.assertIsNone(numpy_chain.load_checkpoint(1))
+
     def test_load_check_multitrace(self):
         mtrace = load_multitrace(self.test_dir_path, varnames=self.PT_test.vars, backend='bin')
         mtrace.point(1)
@@ -141,6 +166,15 @@ class TestBackend(TestCase):
         corrupted = check_multitrace(mtrace, self.sample_size, 1)
         self.assertEqual(len(corrupted), 0)
 
+    def test_stage_draws(self):
+        stage_path = os.path.join(self.test_dir_path, 'stage_draws')
+        if not os.path.exists(stage_path):
+            os.mkdir(stage_path)
+
+        self.assertEqual(load_stage_draws(stage_path, 100), 100)
+        dump_stage_draws(stage_path, 30)
+        self.assertEqual(load_stage_draws(stage_path, 100), 30)
+
 #    def tearDown(self):
 #        import shutil
 #        shutil.rmtree(self.test_dir_path)
\ No newline at end of file
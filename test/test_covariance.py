@@ -1,5 +1,7 @@
 import numpy as num
-from beat.covariance import non_toeplitz_covariance
+from beat.covariance import non_toeplitz_covariance, \
+    sample_covariance_factor, autocovariance, scaled_autocovariance
+from beat import heart
 from pyrocko import util
 from matplotlib import pyplot as plt
 import unittest
@@ -30,6 +32,62 @@ class TestUtility(unittest.TestCase):
         plt.colorbar(im)
         plt.show()
 
+    def test_low_rank_covariance(self):
+        n = 300
+        n_variations = 20
+        A = num.random.normal(size=(n, n))
+        data = A.dot(A.T) + n * num.eye(n)
+        realizations = num.random.normal(scale=3., size=(n_variations, n))
+
+        factor = sample_covariance_factor(realizations)
+        pred_v = num.cov(realizations, rowvar=0)
+        num.testing.assert_allclose(factor.dot(factor.T), pred_v, atol=1e-12)
+
+        covariance = heart.Covariance(data=data, pred_v_factor=factor)
+        dense_covariance = heart.Covariance(data=data, pred_v=pred_v)
+
+        t0 = time()
+        weight = covariance.chol_inverse
+        t1 = time()
+        dense_weight = dense_covariance.chol_inverse
+        t2 = time()
+        logger.info(
+            'Low-rank weight time: %f, dense weight time: %f' % (
+                t1 - t0, t2 - t1))
+
+        num.testing.assert_allclose(
+            weight.T.dot(weight), dense_weight.T.dot(dense_weight),
+            atol=1e-12)
+        num.testing.assert_allclose(
+            covariance.log_pdet, dense_covariance.log_pdet)
+
+    def test_autocovariance(self):
+        n = 300
+        n_data = 5
+        datas = num.random.normal(scale=2, size=(n_data, n))
+
+        t0 = time()
+        autocovs = autocovariance(datas)
+        t1 = time()
+
+        for data, autocov in zip(datas, autocovs):
+            demeaned = data - data.mean()
+            ref = num.array([
+                demeaned[j:].dot(demeaned[:n - j]) for j in range(n)]) / n
+            num.testing.assert_allclose(autocov, ref, atol=1e-10)
+
+            num.testing.assert_allclose(
+                autocovariance(data), autocov, atol=1e-12)
+
+        logger.info('Batch autocovariance time: %f' % (t1 - t0))
+
+        coeffs, stds = scaled_autocovariance(datas, window_size=n // 5)
+        for data, coeff, std in zip(datas, coeffs, stds):
+            ref_coeff, ref_std = scaled_autocovariance(
+                data, window_size=n // 5)
+            num.testing.assert_allclose(coeff, ref_coeff, atol=1e-12)
+            num.testing.assert_allclose(std, ref_std, atol=1e-12)
+
     def test_linear_velmod_covariance(self):
         print('Warning!: Needs specific project_directory!')
         project_dir ='/home/vasyurhm/BEATS/LaquilaJointPonlyUPDATE_wide_cov'
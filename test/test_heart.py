@@ -8,6 +8,7 @@ from numpy.testing import assert_allclose
 from tempfile import mkdtemp
 import os
 import logging
+import pickle
 import shutil
 
 from pyrocko import util, trace
@@ -146,6 +147,681 @@ class TestGeoComposite(unittest.TestCase):
                 rtol=1e-08, atol=0)
 
 
+class TestPostProcessing(unittest.TestCase):
+
+    def test_batch_post_processing(self):
+        deltat = 0.5
+        traces = []
+        tapers = []
+        for i in range(30):
+            tmin = deltat * num.random.randint(-20, 100)
+            traces.append(trace.Trace(
+                tmin=tmin, deltat=deltat,
+                ydata=num.random.normal(size=num.random.randint(50, 400))))
+            arrival = deltat * num.random.randint(-60, 500) + 0.13
+            tapers.append(trace.CosTaper(
+                arrival - 10.3, arrival - 5.1, arrival + 30.2, arrival + 40.7))
+
+        for filterer in [None, heart.Filter(
+                lower_corner=0.01, upper_corner=0.3, order=4)]:
+            for tolerance, chop_bounds in [
+                    (0., ['b', 'c']), (0.5, ['a', 'd'])]:
+                synths = heart.post_process_traces_batch(
+                    traces, tapers, filterer,
+                    taper_tolerance_factor=tolerance,
+                    chop_bounds=chop_bounds)
+
+                for tr, taper, synth in zip(traces, tapers, synths):
+                    tr = heart.post_process_trace(
+                        tr.copy(), taper, filterer,
+                        taper_tolerance_factor=tolerance,
+                        outmode='array', chop_bounds=chop_bounds)
+                    assert_allclose(synth, tr.ydata, rtol=0., atol=1e-7)
+
+    def test_subsample_shift(self):
+        deltat = 0.5
+
+        def signal(t):
+            return num.exp(-((t - 100.) / 15.) ** 2) * \
+                num.sin(2. * num.pi * 0.05 * t)
+
+        traces = []
+        tapers = []
+        for i in range(10):
+            tmin = deltat * num.random.randint(-20, 20)
+            traces.append(trace.Trace(
+                tmin=tmin, deltat=deltat,
+                ydata=signal(tmin + num.arange(400) * deltat)))
+            arrival = num.random.uniform(90., 110.)
+            tapers.append(trace.CosTaper(
+                arrival - 30., arrival - 25., arrival + 25., arrival + 30.))
+
+        synths = heart.post_process_traces_batch(
+            traces, tapers, None, subsample_shift=True)
+
+        for taper, synth in zip(tapers, synths):
+            times = taper.b + num.arange(synth.size) * deltat
+            ref = signal(times) * heart.cos_taper_weights(
+                times, taper.a, taper.b, taper.c, taper.d)
+            assert_allclose(synth, ref, rtol=0., atol=1e-6)
+
+
+class TestArrivalTimeTable(unittest.TestCase):
+
+    class StoredPhase(object):
+
+        def interpolate_many(self, x):
+            return num.sqrt(x[:, 0] ** 2 + x[:, 1] ** 2) / 6000.
+
+    class Store(object):
+
+        class config(object):
+            id = 'test_store'
+            sample_rate = 2.
+            source_depth_min = 0.
+            source_depth_max = 30. * km
+            source_depth_delta = 1. * km
+            distance_min = 1. * km
+            distance_max = 100. * km
+            distance_delta = 0.5 * km
+
+        def get_stored_phase(self, wavename):
+            return TestArrivalTimeTable.StoredPhase()
+
+    def test_interpolation(self):
+        table = heart.ArrivalTimeTable(self.Store(), 'any_P')
+
+        depths = num.random.uniform(0., 30. * km, 1000)
+        distances = num.random.uniform(1. * km, 100. * km, 1000)
+        assert_allclose(
+            table(depths, distances),
+            num.sqrt(depths ** 2 + distances ** 2) / 6000.,
+            rtol=0., atol=0.1 * table.deltat)
+
+        assert num.isnan(table(10. * km, [0.5 * km, 101. * km])).all()
+
+
+class TestPrefilteredGF(unittest.TestCase):
+
+    def test_filter_gf_trace(self):
+        from pyrocko import gf
+
+        deltat = 0.5
+        # GF with static offset at the end
+        data = num.concatenate((
+            num.zeros(20), num.linspace(0., 1., 30), num.ones(50))) + \
+            num.random.normal(scale=0.1, size=100)
+        gf_trace = gf.GFTrace(
+            data=data.astype(num.float32), itmin=10, deltat=deltat)
+        filterer = heart.Filter(
+            lower_corner=0.01, upper_corner=0.2, order=4)
+
+        filtered = heart.filter_gf_trace(
+            gf_trace, filterer, padding=heart.get_prefilter_padding(filterer))
+
+        assert filtered.begin_value == 0.
+        assert filtered.end_value == 0.
+
+        # full store trace, the GF is extended with its begin and end values
+        nfull = 4000
+        tr = trace.Trace(
+            tmin=(gf_trace.itmin - nfull) * deltat, deltat=deltat,
+            ydata=num.concatenate((
+                num.full(nfull, gf_trace.begin_value), gf_trace.data,
+                num.full(nfull, gf_trace.end_value))).astype(num.float64))
+        tr = heart.post_process_trace(
+            trace=tr, taper=None, filterer=filterer, outmode='data',
+            demean=False)
+
+        ioffset = filtered.itmin - (gf_trace.itmin - nfull)
+        prefiltered = num.zeros_like(tr.ydata)
+        prefiltered[ioffset:ioffset + filtered.data.size] = filtered.data
+
+        # the step at the start of the full trace needs to decay
+        istart = nfull // 2
+        assert ioffset > istart
+        assert_allclose(
+            prefiltered[istart:], tr.ydata[istart:], rtol=0.,
+            atol=1e-4 * num.abs(tr.ydata).max())
+
+        store_id = heart.get_prefiltered_store_id('test_store', filterer)
+        assert store_id.startswith('test_store_pf')
+        assert store_id != heart.get_prefiltered_store_id(
+            'test_store', heart.Filter(lower_corner=0.02))
+
+
+class TestWavemapsSynthetics(unittest.TestCase):
+
+    class Response(object):
+
+        def __init__(self, results):
+            self.results = results
+
+        def iter_results(self):
+            return iter(self.results)
+
+    class Engine(object):
+
+        def __init__(self):
+            self.n_calls = 0
+            self.nthreads = None
+
+        def process(self, sources, targets, nthreads=1):
+            self.n_calls += 1
+            self.nthreads = nthreads
+            return TestWavemapsSynthetics.Response([
+                (source, target, trace.Trace(
+                    tmin=-50., deltat=0.5,
+                    ydata=num.random.RandomState(
+                        int(source.north_shift) * 100 +
+                        int(target.codes[1])).normal(size=400)))
+                for source in sources for target in targets])
+
+    def test_single_engine_call(self):
+        from pyrocko import gf
+
+        sources = [gf.DCSource(north_shift=float(i)) for i in range(3)]
+        targets_list = [
+            [heart.DynamicTarget(codes=('', '%i' % i, '', 'Z'))
+             for i in range(5)],
+            [heart.DynamicTarget(codes=('', '%i' % i, '', 'T'))
+             for i in range(5, 8)]]
+        arrival_tapers = [
+            heart.ArrivalTaper(a=-10., b=-5., c=20., d=30.),
+            heart.ArrivalTaper(a=-15., b=-10., c=40., d=50.)]
+        filterers = [
+            heart.Filter(lower_corner=0.01, upper_corner=0.3, order=4), None]
+        wavenames = ['any_P', 'any_S']
+        arrival_times_list = [
+            0.5 * num.random.randint(40, 120, len(targets))
+            for targets in targets_list]
+
+        engine = self.Engine()
+        results = heart.seis_synthetics_wavemaps(
+            engine=engine,
+            sources=sources,
+            targets_list=targets_list,
+            arrival_tapers=arrival_tapers,
+            wavenames=wavenames,
+            filterers=filterers,
+            arrival_times_list=arrival_times_list)
+
+        assert engine.n_calls == 1
+
+        for i, (synths, tmins) in enumerate(results):
+            ref_synths, ref_tmins = heart.seis_synthetics(
+                engine=engine,
+                sources=sources,
+                targets=targets_list[i],
+                arrival_taper=arrival_tapers[i],
+                wavename=wavenames[i],
+                filterer=filterers[i],
+                arrival_times=arrival_times_list[i],
+                outmode='array')
+
+            assert_allclose(synths, ref_synths, rtol=0., atol=1e-10)
+            assert_allclose(tmins, ref_tmins)
+
+    def test_population_single_engine_call(self):
+        from pyrocko import gf
+
+        sources_population = [
+            [gf.DCSource(north_shift=float(i + j)) for i in range(2)]
+            for j in range(3)]
+        targets_list = [
+            [heart.DynamicTarget(codes=('', '%i' % i, '', 'Z'))
+             for i in range(5)],
+            [heart.DynamicTarget(codes=('', '%i' % i, '', 'T'))
+             for i in range(5, 8)]]
+        arrival_tapers = [
+            heart.ArrivalTaper(a=-10., b=-5., c=20., d=30.),
+            heart.ArrivalTaper(a=-15., b=-10., c=40., d=50.)]
+        filterers = [
+            heart.Filter(lower_corner=0.01, upper_corner=0.3, order=4), None]
+        wavenames = ['any_P', 'any_S']
+        arrival_times_population = [
+            [0.5 * num.random.randint(40, 120, len(targets))
+             for targets in targets_list]
+            for _ in sources_population]
+
+        for subsample_shift in [True, False]:
+            engine = self.Engine()
+            results = heart.seis_synthetics_population_wavemaps(
+                engine=engine,
+                sources_population=sources_population,
+                targets_list=targets_list,
+                arrival_tapers=arrival_tapers,
+                wavenames=wavenames,
+                filterers=filterers,
+                arrival_times_population=arrival_times_population,
+                subsample_shift=subsample_shift)
+
+            assert engine.n_calls == 1
+
+            for i in range(len(targets_list)):
+                ref_results = heart.seis_synthetics_population(
+                    engine=engine,
+                    sources_population=sources_population,
+                    targets=targets_list[i],
+                    arrival_taper=arrival_tapers[i],
+                    wavename=wavenames[i],
+                    filterer=filterers[i],
+                    arrival_times_population=[
+                        arrival_times[i]
+                        for arrival_times in arrival_times_population],
+                    subsample_shift=subsample_shift)
+
+                for result, (ref_synths, ref_tmins) in zip(
+                        results, ref_results):
+                    synths, tmins = result[i]
+                    assert_allclose(synths, ref_synths, rtol=0., atol=1e-10)
+                    assert_allclose(tmins, ref_tmins)
+
+    def test_engine_threads(self):
+        from pyrocko import gf
+
+        sources = [gf.DCSource(north_shift=float(i)) for i in range(3)]
+        targets = [heart.DynamicTarget(codes=('', '%i' % i, '', 'Z'))
+                   for i in range(7)]
+        arrival_taper = heart.ArrivalTaper(a=-10., b=-5., c=20., d=30.)
+        filterer = heart.Filter(lower_corner=0.01, upper_corner=0.3, order=4)
+        arrival_times = 0.5 * num.random.randint(40, 120, len(targets))
+
+        for outmode in ['array', 'stacked_traces']:
+            for pre_stack_cut in [True, False]:
+                results = []
+                for nprocs in [1, 3]:
+                    engine = self.Engine()
+                    results.append(heart.seis_synthetics(
+                        engine=engine,
+                        sources=sources,
+                        targets=targets,
+                        arrival_taper=arrival_taper,
+                        wavename='any_P',
+                        filterer=filterer,
+                        pre_stack_cut=pre_stack_cut,
+                        arrival_times=arrival_times,
+                        outmode=outmode,
+                        nprocs=nprocs))
+
+                    assert engine.n_calls == 1
+                    assert engine.nthreads == nprocs
+
+                (synths, tmins), (synths_threaded, tmins_threaded) = results
+                if outmode == 'stacked_traces':
+                    synths = [tr.ydata for tr in synths]
+                    synths_threaded = [tr.ydata for tr in synths_threaded]
+
+                assert_allclose(synths_threaded, synths, rtol=0., atol=1e-10)
+                assert_allclose(tmins_threaded, tmins)
+
+    def test_shifted_windows(self):
+        from pyrocko import gf
+
+        sources = [gf.DCSource(north_shift=float(i)) for i in range(3)]
+        targets = [heart.DynamicTarget(codes=('', '%i' % i, '', 'Z'))
+                   for i in range(5)]
+        arrival_taper = heart.ArrivalTaper(a=-10., b=-5., c=20., d=30.)
+        arrival_times = 0.5 * num.random.randint(40, 120, len(targets))
+
+        for filterer in [
+                heart.Filter(lower_corner=0.01, upper_corner=0.3, order=4),
+                None]:
+            engine = self.Engine()
+            traces = heart.process_targets(
+                engine=engine, sources=sources, targets=targets)
+            filtered_traces = heart.filter_synthetics(
+                traces=traces, targets=targets, filterer=filterer)
+
+            for _ in range(3):
+                time_shifts = num.random.uniform(-3., 3., len(targets))
+                shifted_arrival_times = arrival_times + time_shifts
+
+                synths, tmins = heart.window_synthetics(
+                    traces=filtered_traces,
+                    taperers=[
+                        arrival_taper.get_pyrocko_taper(float(t))
+                        for t in shifted_arrival_times])
+
+                ref_synths, ref_tmins = heart.seis_synthetics(
+                    engine=engine,
+                    sources=sources,
+                    targets=targets,
+                    arrival_taper=arrival_taper,
+                    wavename='any_P',
+                    filterer=filterer,
+                    arrival_times=shifted_arrival_times,
+                    outmode='array')
+
+                assert_allclose(synths, ref_synths, rtol=0., atol=1e-10)
+                assert_allclose(tmins, ref_tmins)
+
+                synths, tmins = heart.window_synthetics(
+                    traces=filtered_traces,
+                    taperers=[
+                        arrival_taper.get_pyrocko_taper(float(t))
+                        for t in shifted_arrival_times],
+                    subsample_shift=True)
+
+                [(ref_synths, ref_tmins)] = heart.seis_synthetics_population(
+                    engine=engine,
+                    sources_population=[sources],
+                    targets=targets,
+                    arrival_taper=arrival_taper,
+                    wavename='any_P',
+                    filterer=filterer,
+                    arrival_times_population=[shifted_arrival_times],
+                    subsample_shift=True)
+
+                assert_allclose(synths, ref_synths, rtol=0., atol=1e-10)
+                assert_allclose(tmins, ref_tmins)
+
+
+class TestSourceCache(unittest.TestCase):
+
+    class StaticResult(object):
+
+        def __init__(self, result):
+            self.result = result
+
+    class Response(object):
+
+        def __init__(self, results):
+            self.results = results
+
+        def static_results(self):
+            return iter(self.results)
+
+    class Engine(object):
+
+        def __init__(self):
+            self.n_sources = []
+
+        def process(self, sources, targets, nthreads=1):
+            self.n_sources.append(len(sources))
+            return TestSourceCache.Response([
+                TestSourceCache.StaticResult({
+                    'displacement.n': source.north_shift * target.lats,
+                    'displacement.e': source.slip * target.lons,
+                    'displacement.d': source.north_shift * source.slip *
+                    num.ones_like(target.lats)})
+                for source in sources for target in targets])
+
+        def close_cashed_stores(self):
+            pass
+
+    def get_synthesizer(self, engine):
+        from pyrocko import gf
+        from beat import theanof
+
+        sources = [gf.RectangularSource() for _ in range(3)]
+        targets = [
+            gf.StaticTarget(
+                lats=num.random.normal(size=n), lons=num.random.normal(size=n))
+            for n in [5, 8]]
+
+        synthesizer = theanof.GeoSynthesizer(
+            engine=engine, sources=sources, targets=targets)
+        synthesizer.varnames = ['north_shift', 'slip']
+        return synthesizer
+
+    def test_changed_sources(self):
+        engine = self.Engine()
+        synthesizer = self.get_synthesizer(engine)
+
+        north_shifts = num.array([1., 2., 3.])
+        slips = num.array([0.5, 1., 1.5])
+        for i, n_sources in [(None, [3]), (1, [3, 1]), (None, [3, 1]),
+                             (2, [3, 1, 1])]:
+            if i is not None:
+                slips[i] += 1.
+
+            output = [[None]]
+            synthesizer.perform(
+                None, [north_shifts.copy(), slips.copy()], output)
+
+            assert engine.n_sources == n_sources
+
+            ref_synths = heart.geo_synthetics(
+                engine=self.Engine(),
+                targets=synthesizer.targets,
+                sources=synthesizer.sources,
+                outmode='stacked_array')
+
+            assert_allclose(output[0][0], ref_synths, rtol=0., atol=1e-12)
+
+
+class TestCovariance(unittest.TestCase):
+
+    def test_factorization(self):
+        n = 50
+        A = num.random.normal(size=(n, n))
+        data = A.dot(A.T) + n * num.eye(n)
+        covariance = heart.Covariance(data=data)
+
+        for Cx in [data, data + num.eye(n)]:
+            assert_allclose(covariance.inverse, num.linalg.inv(Cx))
+            assert_allclose(
+                covariance.chol_inverse,
+                num.linalg.cholesky(num.linalg.inv(Cx)).T, atol=1e-12)
+            assert_allclose(covariance.chol.dot(covariance.chol.T), Cx)
+            assert_allclose(covariance.log_pdet, num.linalg.slogdet(Cx)[1])
+            assert covariance.chol_inverse is covariance.chol_inverse
+
+            # factorization is not pickled
+            unpickled = pickle.loads(pickle.dumps(covariance))
+            assert '_factorization' not in unpickled.__dict__
+            assert_allclose(unpickled.inverse, num.linalg.inv(Cx))
+
+            # reassignment invalidates the factorization
+            covariance.pred_v = num.eye(n)
+
+    def test_toeplitz(self):
+        from scipy.linalg import toeplitz
+
+        n = 200
+        lags = num.arange(n)
+        autocovariance = 2. * num.exp(-lags * 0.5 / 3.) * num.cos(lags * 0.1)
+        stds = num.random.uniform(0.5, 2., n)
+
+        first_column, log_det = heart.levinson_durbin(autocovariance)
+        T = toeplitz(autocovariance)
+        assert_allclose(first_column, num.linalg.inv(T)[:, 0], atol=1e-10)
+        assert_allclose(log_det, num.linalg.slogdet(T)[1])
+
+        covariance = heart.ToeplitzCovariance(
+            autocovariance=autocovariance, stds=stds)
+        Cx = T * stds[:, num.newaxis] * stds[num.newaxis, :]
+        assert_allclose(covariance.data, Cx)
+        assert covariance.samples == n
+        assert covariance.toeplitz_weight.shape == (3, n)
+
+        residuals = num.random.normal(size=(4, n))
+        assert_allclose(
+            heart.toeplitz_quadratic_form(
+                covariance.toeplitz_weight, residuals),
+            num.einsum(
+                'ij,jk,ik->i', residuals, num.linalg.inv(Cx), residuals))
+        assert_allclose(
+            heart.toeplitz_inverse_product(
+                covariance.toeplitz_weight, residuals),
+            residuals.dot(num.linalg.inv(Cx)), atol=1e-10)
+
+        from beat.theanof import ToeplitzQuadraticForm
+        residual = tt.dvector('residual')
+        quadratic_form = ToeplitzQuadraticForm()(
+            covariance.toeplitz_weight, residual)
+        gradient = function([residual], tt.grad(quadratic_form, residual))
+        assert_allclose(
+            gradient(residuals[0]),
+            2. * num.linalg.inv(Cx).dot(residuals[0]), atol=1e-8)
+
+        assert_allclose(covariance.log_pdet, num.linalg.slogdet(Cx)[1])
+        assert_allclose(
+            covariance.slog_pdet.get_value(), num.linalg.slogdet(Cx)[1])
+
+    def test_tapered(self):
+        n = 150
+        locations = num.random.uniform(0., 20000., size=(n, 2))
+        covariance = heart.TaperedCovariance(
+            locations=locations, variance=2., correlation_distance=3000.,
+            taper_distance=10000., nugget=0.5, max_neighbours=n)
+
+        distances = num.sqrt(((
+            locations[:, num.newaxis] - locations[num.newaxis]) ** 2).sum(-1))
+        Cx = 2. * num.exp(-distances / 3000.) * \
+            heart.tapered_exponential_covariance(distances, 1., 1e30, 10000.)
+        Cx += 0.5 * num.eye(n)
+        assert_allclose(covariance.data, Cx, atol=1e-12)
+        assert covariance.samples == n
+
+        # all points as neighbours is exact
+        weight = covariance.sparse_weight
+        assert_allclose(
+            weight.T.dot(weight).toarray(), num.linalg.inv(Cx), atol=1e-8)
+        assert_allclose(covariance.log_pdet, num.linalg.slogdet(Cx)[1])
+
+        residual = num.random.normal(size=n)
+        assert_allclose(
+            covariance.inverse_quadratic_form(residual),
+            residual.dot(num.linalg.solve(Cx, residual)))
+
+        covariance.max_neighbours = 10
+        assert covariance.sparse_weight.nnz <= n * 11
+        assert_allclose(
+            covariance.log_pdet, num.linalg.slogdet(Cx)[1], rtol=0.05)
+
+
+class TestSpectralMisfit(unittest.TestCase):
+
+    class Dataset(object):
+        typ = 'any_P'
+
+        def __init__(self, covariance, samples):
+            self.covariance = covariance
+            self.samples = samples
+
+    def setUp(self):
+        self.nsamples = 120
+        self.deltat = 0.5
+
+        # circulant exponential covariance, i.e. periodic stationary noise
+        lags = num.arange(self.nsamples)
+        lags = num.minimum(lags, self.nsamples - lags)
+        cov_row = 2. * num.exp(-lags * self.deltat / 3.)
+        idxs = num.arange(self.nsamples)
+        self.covariance = heart.Covariance(
+            data=cov_row[num.abs(idxs[:, num.newaxis] - idxs[num.newaxis])])
+        self.residuals = num.random.normal(size=(3, self.nsamples))
+
+    def test_spectral_basis(self):
+        basis = heart.spectral_basis(self.nsamples, self.deltat)
+        assert basis.shape == (self.nsamples, self.nsamples)
+        assert_allclose(
+            basis.T.dot(basis), num.eye(self.nsamples), atol=1e-10)
+
+        band = heart.get_filter_band(
+            heart.Filter(lower_corner=0.05, upper_corner=0.2))
+        basis = heart.spectral_basis(self.nsamples, self.deltat, *band)
+        freqs = num.arange(self.nsamples // 2 + 1) / (
+            self.nsamples * self.deltat)
+        nfreqs = ((freqs >= 0.05) & (freqs <= 0.2)).sum()
+        assert basis.shape == (self.nsamples, 2 * nfreqs)
+        assert_allclose(basis.T.dot(basis), num.eye(2 * nfreqs), atol=1e-10)
+
+        # coefficients are the normalised DFT of a trace
+        spectrum = num.fft.rfft(self.residuals[0]) * num.sqrt(
+            2. / self.nsamples)
+        coefficients = self.residuals[0].dot(basis)
+        in_band = (freqs >= 0.05) & (freqs <= 0.2)
+        assert_allclose(coefficients[:nfreqs], spectrum[in_band].real)
+        assert_allclose(coefficients[nfreqs:], -spectrum[in_band].imag)
+
+    def test_likelihood(self):
+        basis = heart.spectral_basis(self.nsamples, self.deltat)
+        weights = self.covariance.spectral_weights(basis)
+
+        # full band of a circulant covariance is the time domain likelihood
+        assert_allclose(
+            -2 * num.log(weights).sum(), self.covariance.log_pdet, rtol=1e-6)
+        for residual in self.residuals:
+            tmp = self.covariance.chol_inverse.dot(residual)
+            stmp = weights * residual.dot(basis)
+            assert_allclose(stmp.dot(stmp), tmp.dot(tmp), rtol=1e-6)
+
+        datasets = [
+            self.Dataset(self.covariance, self.nsamples)
+            for _ in range(self.residuals.shape[0])]
+        hyperparams = {'h_any_P': tt.dscalar('h_any_P')}
+        residuals = shared(self.residuals, borrow=True)
+
+        logpts_time = models.multivariate_normal_chol(
+            datasets,
+            [shared(self.covariance.chol_inverse)] * len(datasets),
+            hyperparams, residuals)
+        logpts_spectral = models.multivariate_normal_spectral(
+            datasets, [shared(weights)] * len(datasets),
+            hyperparams, residuals.dot(basis))
+
+        f = function(
+            [hyperparams['h_any_P']], [logpts_time, logpts_spectral])
+        for hp in [-1., 0., 0.5]:
+            llk_time, llk_spectral = f(hp)
+            assert_allclose(llk_spectral, llk_time, rtol=1e-6)
+
+
+class TestDecimation(unittest.TestCase):
+
+    def _check_operator(self, operator, nsamples):
+        assert operator.shape[0] == nsamples
+        assert_allclose(
+            operator.T.dot(operator), num.eye(operator.shape[1]), atol=1e-10)
+
+    def test_operators(self):
+        operator = heart.decimation_operator(103, 4)
+        self._check_operator(operator, 103)
+        assert operator.shape[1] == 26
+
+        data = num.random.normal(size=103)
+        assert_allclose(
+            operator.T.dot(data)[:-1] / 2.,
+            data[:100].reshape((25, 4)).mean(axis=1))
+
+        north_shifts = num.random.uniform(-10. * km, 10. * km, 2000)
+        east_shifts = num.random.uniform(-20. * km, 20. * km, 2000)
+        operator = heart.spatial_decimation_operator(
+            north_shifts, east_shifts, 10)
+        self._check_operator(operator, 2000)
+        assert 100 < operator.shape[1] < 400
+
+    def test_reduced_covariance(self):
+        nsamples = 60
+        idxs = num.arange(nsamples)
+        covariance = heart.Covariance(
+            data=num.exp(-num.abs(idxs[:, num.newaxis] - idxs) / 5.),
+            pred_v=num.eye(nsamples) * 0.1)
+        operator = heart.decimation_operator(nsamples, 3)
+
+        reduced_data = operator.T.dot(
+            covariance.data + covariance.pred_v).dot(operator)
+        residual = num.random.normal(size=nsamples)
+        reduced_residual = operator.T.dot(residual)
+
+        weight = covariance.reduced_chol_inverse(operator)
+        assert weight.shape == (20, nsamples)
+
+        tmp = weight.dot(residual)
+        assert_allclose(
+            tmp.dot(tmp),
+            reduced_residual.dot(
+                num.linalg.solve(reduced_data, reduced_residual)))
+
+        covariance.update_slog_pdet(operator)
+        assert_allclose(
+            covariance.slog_pdet.get_value(),
+            num.linalg.slogdet(reduced_data)[1], rtol=1e-6)
+
+
 if __name__ == "__main__":
     util.setup_logging('test_heart', 'warning')
     unittest.main()
@@ -0,0 +1,90 @@
+import pymc3 as pm
+import numpy as num
+from beat.sampler import HamiltonianMonteCarlo, metropolis_sample
+from tempfile import mkdtemp
+import shutil
+import logging
+import theano.tensor as tt
+import unittest
+from pyrocko import util
+
+
+logger = logging.getLogger('test_hmc')
+
+
+class TestHMC(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        unittest.TestCase.__init__(self, *args, **kwargs)
+
+        self.test_folder = mkdtemp(prefix='HMC_TEST')
+
+        logger.info('Test result in: \n %s' % self.test_folder)
+
+        self.n_chains = 4
+        self.n_steps = 2000
+        self.tune_interval = 50
+
+    def test_gibbs_sample(self):
+        n = 50
+
+        mu = num.linspace(-1., 1., n)
+        stdev = 0.1
+        y_mu = 0.3
+
+        with pm.Model() as HMC_test:
+            # differentiable, e.g. slips
+            X = pm.Uniform('X',
+                           shape=n,
+                           lower=-2. * num.ones(n),
+                           upper=2. * num.ones(n),
+                           testval=num.zeros(n),
+                           transform=None)
+            # updated by Metropolis steps, e.g. rupture velocities
+            Y = pm.Uniform('Y',
+                           shape=1,
+                           lower=-1.,
+                           upper=1.,
+                           testval=0.,
+                           transform=None)
+
+            llk = - 0.5 * tt.sum(((X - mu) / stdev) ** 2) \
+                - 0.5 * tt.sum(((Y - y_mu) / stdev) ** 2)
+            like = pm.Deterministic('like', llk)
+            pm.Potential('like', like)
+
+        with HMC_test:
+            step = HamiltonianMonteCarlo(
+                n_chains=self.n_chains,
+                gradient_vars=[X],
+                tune_interval=self.tune_interval,
+                likelihood_name='like',
+                proposal_name='Normal')
+
+        assert step.n_metropolis == 1
+        assert step.gradient_mask.sum() == n
+
+        mtrace = metropolis_sample(
+            n_steps=self.n_steps,
+            step=step,
+            progressbar=False,
+            homepath=self.test_folder,
+            model=HMC_test,
+            n_jobs=1,
+            rm_flag=True)
+
+        burn = int(self.n_steps / 2)
+        x = mtrace.get_values('X', combine=True, burn=burn, squeeze=True)
+        y = mtrace.get_values('Y', combine=True, burn=burn, squeeze=True)
+
+        num.testing.assert_allclose(x.mean(axis=0), mu, rtol=0., atol=0.03)
+        num.testing.assert_allclose(x.std(axis=0), stdev, rtol=0.3)
+        num.testing.assert_allclose(y.mean(), y_mu, rtol=0., atol=0.03)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_folder)
+
+
+if __name__ == '__main__':
+    util.setup_logging('test_hmc', 'info')
+    unittest.main()
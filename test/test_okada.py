@@ -0,0 +1,105 @@
+import unittest
+import logging
+
+import numpy as num
+from numpy.testing import assert_allclose
+
+from pyrocko import util, orthodrome
+from pyrocko.gf import RectangularSource, StaticTarget
+
+from beat.okada import OkadaEngine, okada_surface_displacements
+
+
+logger = logging.getLogger('test_okada')
+
+
+class TestOkada(unittest.TestCase):
+
+    def test_okada85_checklist(self):
+        # Okada 1985, Table 2, case 2; x=2, y=3, d=4, dip=70, L=3, W=2
+        # in fault coordinates with origin at the lower fault corner
+        dip = 70.
+        cd = num.cos(dip * num.pi / 180.)
+        sd = num.sin(dip * num.pi / 180.)
+
+        reference = {
+            'strike-slip': ((0., 1., 0.), [-8.689e-3, -4.298e-3, -2.747e-3]),
+            'dip-slip': ((90., 1., 0.), [-4.682e-3, -3.527e-2, -3.564e-2]),
+            'tensile': ((0., 0., 1.), [-2.660e-4, 1.056e-2, 3.214e-3])}
+
+        for name, ((rake, slip, opening), uxyz) in reference.items():
+            disp = okada_surface_displacements(
+                norths=[[0.5]], easts=[[cd - 3.]], depths=[4. - sd],
+                strikes=[0.], dips=[dip], lengths=[3.], widths=[2.],
+                rakes=[rake], slips=[slip], openings=[opening],
+                poisson_ratio=0.25)[0, 0]
+
+            logger.info('%s: %s' % (name, disp))
+            # strike to north, fault y-axis to west
+            assert_allclose(
+                [disp[0], -disp[1], disp[2]], uxyz, rtol=1e-3, atol=1e-7)
+
+    def test_vertical(self):
+        coords = num.linspace(-20000., 20000., 21)
+        norths, easts = num.meshgrid(coords, coords)
+        disps = []
+        for dip in [90., 89.9999]:
+            disps.append(okada_surface_displacements(
+                norths=norths.ravel(), easts=easts.ravel(), depths=[5000.],
+                strikes=[37.], dips=[dip], lengths=[10000.], widths=[6000.],
+                rakes=[-130.], slips=[2.])[0])
+
+        assert num.isfinite(disps[0]).all()
+        assert_allclose(disps[0], disps[1], rtol=0., atol=1e-5)
+
+    def test_engine(self):
+        sources = [
+            RectangularSource(
+                lat=10., lon=20., north_shift=1000., east_shift=-3000.,
+                depth=4000., strike=strike, dip=dip, rake=30.,
+                length=8000., width=5000., slip=1.)
+            for strike, dip in [(30., 40.), (250., 75.)]]
+
+        targets = [
+            StaticTarget(
+                lats=num.random.uniform(9.9, 10.1, n),
+                lons=num.random.uniform(19.9, 20.1, n)) for n in [10, 20]]
+
+        engine = OkadaEngine()
+        disps = engine.get_displacements(sources, targets)
+        assert disps.shape == (2, 30, 3)
+
+        results = engine.process(sources, targets).static_results()
+        assert len(results) == 4
+        assert_allclose(
+            results[3].result['displacement.d'], -disps[1, 10:, 2])
+
+        for block_size in [1, 7, 45]:
+            blocked = OkadaEngine(block_size=block_size).get_displacements(
+                sources, targets)
+            assert_allclose(blocked, disps)
+
+    def test_engine_opening(self):
+        source = RectangularSource(
+            lat=10., lon=20., depth=4000., strike=30., dip=40., rake=30.,
+            length=8000., width=5000., slip=2., opening_fraction=0.25)
+        target = StaticTarget(
+            lats=num.random.uniform(9.9, 10.1, 10),
+            lons=num.random.uniform(19.9, 20.1, 10))
+
+        norths, easts = orthodrome.latlon_to_ne_numpy(
+            source.lat, source.lon, target.lats, target.lons)
+
+        disps = OkadaEngine().get_displacements([source], [target])
+        ref_disps = okada_surface_displacements(
+            norths=norths, easts=easts, depths=[source.depth],
+            strikes=[source.strike], dips=[source.dip],
+            lengths=[source.length], widths=[source.width],
+            rakes=[source.rake], slips=[1.5], openings=[0.5])
+
+        assert_allclose(disps, ref_disps)
+
+
+if __name__ == '__main__':
+    util.setup_logging('test_okada', 'info')
+    unittest.main()
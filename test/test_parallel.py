@@ -0,0 +1,113 @@
+import logging
+import multiprocessing
+import os
+import unittest
+
+from beat import parallel
+import numpy as num
+from pyrocko import util
+
+
+logger = logging.getLogger('test_parallel')
+
+
+_offset = None
+
+
+def init_offset(offset):
+    global _offset
+    _offset = offset
+
+
+def add_offset(x):
+    return x + _offset, os.getpid()
+
+
+def echo_worker(comm):
+    status = parallel.LocalStatus()
+    comm.send(None, dest=0, tag=0)
+    package = comm.recv(source=0, tag=1, status=status)
+
+    data = num.empty(3)
+    while True:
+        comm.Recv(data, source=0, status=status)
+        if status.Get_tag() == 2:
+            break
+
+        comm.Send(data + package['offset'], dest=0, tag=1)
+
+
+class ParallelTestCase(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        unittest.TestCase.__init__(self, *args, **kwargs)
+        self.factors = num.array([0, 1, 2, 3, 2, 1, 0])
+
+    def test_persistent_pool(self):
+
+        pool = parallel.PersistentPool(
+            nprocs=2, initializer=init_offset, initargs=(10,))
+
+        pids = []
+        for _ in range(2):
+            p = parallel.paripool(
+                add_offset, [[k] for k in self.factors], chunksize=1,
+                nprocs=2, pool=pool)
+
+            for e in p:
+                assert [val for val, _ in e] == (self.factors + 10).tolist()
+                pids.append(set([pid for _, pid in e]))
+
+            assert pool.running
+
+        assert pids[1].issubset(pids[0])
+
+        with self.assertRaises(ValueError):
+            next(parallel.paripool(
+                add_offset, [[k] for k in self.factors], nprocs=2,
+                initializer=init_offset, initargs=(10,), pool=pool))
+
+        pool.close()
+        assert not pool.running
+
+    def test_local_communicator(self):
+
+        n_jobs = 3
+        channels = [
+            parallel.SharedMemoryChannel(n_slots=4, slot_size=3)
+            for _ in range(n_jobs)]
+
+        ctx = multiprocessing.get_context('fork')
+        workers = []
+        for rank in range(1, n_jobs):
+            worker = ctx.Process(
+                target=echo_worker,
+                args=(parallel.LocalCommunicator(channels, rank),))
+            worker.start()
+            workers.append(worker)
+
+        comm = parallel.LocalCommunicator(channels, 0)
+        status = parallel.LocalStatus()
+        for _ in range(1, n_jobs):
+            comm.recv(tag=0, status=status)
+            source = status.Get_source()
+            # package exceeds the channel capacity
+            package = {'offset': source, 'filler': list(range(100))}
+            comm.send(package, dest=source, tag=1)
+
+        data = num.zeros(3)
+        for rank in range(1, n_jobs):
+            comm.Send(self.factors[:3], dest=rank, tag=1)
+            comm.Recv(data, source=rank, status=status)
+            assert status.Get_source() == rank
+            assert (data == self.factors[:3] + rank).all()
+            comm.send(None, dest=rank, tag=2)
+
+        for worker in workers:
+            worker.join()
+            assert worker.exitcode == 0
+
+
+if __name__ == "__main__":
+    util.setup_logging('test_parallel', 'debug')
+    unittest.main()
@@ -26,6 +26,22 @@ class TestProposals(unittest.TestCase):
             draw = choose_proposal(proposal, scale=scale)
             print((proposal, draw(self.draws)))
 
+    def test_differential_evolution(self):
+
+        population = num.random.normal(size=(200, 3)) * \
+            num.array([1., 10., 100.])
+        draw = choose_proposal('DifferentialEvolution', scale=population)
+
+        deltas = draw(5000)
+        assert deltas.shape == (5000, 3)
+        ratio = deltas.std(axis=0) / population.std(axis=0)
+        num.testing.assert_allclose(ratio, ratio[0], rtol=0.15)
+
+        q0 = population[0] + 1.
+        delta, log_jacobian = draw.snooker(q0)
+        assert delta.shape == q0.shape
+        assert num.isfinite(log_jacobian)
+
 
 if __name__ == '__main__':
 
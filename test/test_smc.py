@@ -21,6 +21,8 @@ class TestSMC(unittest.TestCase):
 
         self.test_folder_one = mkdtemp(prefix='SMC_TEST')
         self.test_folder_multi = mkdtemp(prefix='SMC_TEST')
+        self.test_folder_population = mkdtemp(prefix='SMC_TEST')
+        self.test_folder_surrogate = mkdtemp(prefix='SMC_TEST')
 
         logger.info('Test result in: \n %s, \n %s ' % (
             self.test_folder_one, self.test_folder_multi))
@@ -30,7 +32,8 @@ class TestSMC(unittest.TestCase):
         self.n_steps = 100
         self.tune_interval = 25
 
-    def _test_sample(self, n_jobs, test_folder):
+    def _test_sample(self, n_jobs, test_folder, population_batch=False,
+                     surrogate=False):
         logger.info('Running on %i cores...' % n_jobs)
 
         n = 4
@@ -68,11 +71,18 @@ class TestSMC(unittest.TestCase):
             like = pm.Deterministic('like', two_gaussians(X))
             llk = pm.Potential('like', like)
 
+        if surrogate:
+            # flattened approximation of the likelihood
+            surrogate = 0.5 * two_gaussians(X)
+        else:
+            surrogate = None
+
         with SMC_test:
             step = smc.SMC(
                 n_chains=self.n_chains,
                 tune_interval=self.tune_interval,
-                likelihood_name=SMC_test.deterministics[0].name)
+                likelihood_name=SMC_test.deterministics[0].name,
+                surrogate=surrogate)
 
         smc.smc_sample(
             n_steps=self.n_steps,
@@ -82,7 +92,8 @@ class TestSMC(unittest.TestCase):
             stage=0,
             homepath=test_folder,
             model=SMC_test,
-            rm_flag=False)
+            rm_flag=False,
+            population_batch=population_batch)
 
         stage_handler = backend.SampleStage(test_folder)
 
@@ -103,9 +114,109 @@ class TestSMC(unittest.TestCase):
             self.n_chains, self.n_cpu)
         self._test_sample(n_jobs, self.test_folder_multi)
 
+    def test_population_batch(self):
+        self._test_sample(
+            1, self.test_folder_population, population_batch=True)
+
+    def test_delayed_acceptance(self):
+        self._test_sample(1, self.test_folder_surrogate, surrogate=True)
+
     def tearDown(self):
         shutil.rmtree(self.test_folder_one)
         shutil.rmtree(self.test_folder_multi)
+        shutil.rmtree(self.test_folder_population)
+        shutil.rmtree(self.test_folder_surrogate)
+
+
+class TestStageLengthController(unittest.TestCase):
+
+    def _ar1(self, phi, n_samples, n_chains):
+        x = num.zeros((n_samples, n_chains))
+        e = num.random.normal(size=(n_samples, n_chains))
+        for i in range(1, n_samples):
+            x[i] = phi * x[i - 1] + e[i]
+        return x
+
+    def test_autocorrelation_time(self):
+        from beat.sampler.base import integrated_autocorrelation_time
+
+        phi = 0.8
+        x = self._ar1(phi, 20000, 1)[:, 0]
+        tau = integrated_autocorrelation_time(x)
+        num.testing.assert_allclose(tau, (1 + phi) / (1 - phi), rtol=0.15)
+
+        # no accepted steps
+        assert integrated_autocorrelation_time(num.ones(50)) == 50.
+
+    def test_required_steps(self):
+        controller = smc.StageLengthController(
+            min_steps=10, max_steps=500, decorrelation_factor=5.)
+
+        uncorrelated = self._ar1(0., 200, 20)
+        correlated = self._ar1(0.95, 200, 20)
+
+        n_unc = controller.required_steps(uncorrelated)
+        n_cor = controller.required_steps(correlated)
+
+        assert n_unc < n_cor
+        assert controller.is_decorrelated(uncorrelated)
+
+        stuck = num.ones((100, 20))
+        assert controller.required_steps(stuck) == 500
+        assert not controller.is_decorrelated(stuck)
+
+
+class TestResolutionSchedule(unittest.TestCase):
+
+    class Problem(object):
+
+        def __init__(self):
+            self.factors = []
+
+        def set_resolution(self, factor):
+            self.factors.append(factor)
+
+    def test_schedule(self):
+        problem = self.Problem()
+        schedule = smc.ResolutionSchedule(
+            problem, factors=[8, 2], betas=[0.001, 0.1])
+
+        assert schedule.get_level(0.) == 0
+        assert schedule.get_level(0.001) == 1
+        assert schedule.get_level(1.) == 2
+
+        assert not schedule.update(0.)
+        assert not schedule.update(0.0005)
+        assert schedule.update(0.01)
+        assert not schedule.update(0.0001)
+        assert schedule.update(1.)
+        assert problem.factors == [8, 2, 1]
+
+        with self.assertRaises(ValueError):
+            smc.ResolutionSchedule(problem, factors=[8, 2], betas=[0.1])
+
+        with self.assertRaises(ValueError):
+            smc.ResolutionSchedule(problem, factors=[8, 2], betas=[0.1, 0.01])
+
+    def test_importance_weights(self):
+        from types import SimpleNamespace
+
+        coarse = num.random.normal(size=100) * 10.
+        fine = coarse + num.random.normal(size=100)
+        beta, old_beta = 0.05, 0.01
+
+        population = SimpleNamespace(
+            likelihoods=fine, previous_likelihoods=None)
+        weights = smc.SMC.importance_weights(population, beta, old_beta)
+        num.testing.assert_allclose(
+            weights, num.exp((beta - old_beta) * (fine - fine.max())))
+
+        # reweighting from the coarse to the fine likelihood
+        population.previous_likelihoods = coarse
+        weights = smc.SMC.importance_weights(population, beta, old_beta)
+        ref = num.exp(beta * fine - old_beta * coarse)
+        num.testing.assert_allclose(
+            weights / weights.sum(), ref / ref.sum(), rtol=1e-10)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,41 @@
+import logging
+import unittest
+
+import numpy as num
+from pyrocko import util
+
+from beat.sampler.surrogate import GaussianProcessEmulator
+
+
+logger = logging.getLogger('test_surrogate')
+
+
+class TestGaussianProcessEmulator(unittest.TestCase):
+
+    def _llks(self, x):
+        return num.vstack([
+            -0.5 * (x ** 2).sum(axis=1),
+            -0.5 * ((x - 1.) ** 2).sum(axis=1)]).T
+
+    def test_predict(self):
+        x = num.random.uniform(-2., 2., size=(400, 3))
+        emulator = GaussianProcessEmulator(max_samples=500)
+        emulator.fit(x, self._llks(x))
+
+        xt = num.random.uniform(-1.5, 1.5, size=(50, 3))
+        num.testing.assert_allclose(
+            emulator.predict(xt), self._llks(xt), rtol=0., atol=0.1)
+
+    def test_update(self):
+        emulator = GaussianProcessEmulator(max_samples=100)
+        for _ in range(3):
+            x = num.random.uniform(-2., 2., size=(80, 2))
+            emulator.update(x, self._llks(x))
+
+        assert emulator.n_samples == 100
+        assert emulator.predict(x[:5]).shape == (5, 2)
+
+
+if __name__ == '__main__':
+    util.setup_logging('test_surrogate', 'info')
+    unittest.main()